@@ -0,0 +1,97 @@
+"""
+Artefactos direccionados por contenido para campos voluminosos de eventos.
+
+Algunos eventos embeben datos grandes en el payload (`status_porcelain` de
+RepoBaselineCaptured, `delta.new_events` de los resúmenes, `files` de
+DocsTouched). Una línea de cientos de KB hace más lento cada escaneo del log.
+
+storage.append_event mueve los campos del payload que superan
+`offload_bytes` (storage.json) a artifacts/blobs/<xx>/<sha256>.json y deja
+en la línea una referencia con la cantidad de elementos:
+
+    "status_porcelain": {"$blob": "9f2c...", "count": 4210, "bytes": 181234}
+
+Los lectores resuelven la referencia cuando la necesitan (`resolve`).
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+from pathlib import Path
+from typing import Any
+
+from . import codec, config
+
+BLOB_KEY = "$blob"
+BLOBS_DIR = "blobs"
+
+
+def blobs_dir(index_dir: Path) -> Path:
+    return config.artifacts_dir(index_dir.parent) / BLOBS_DIR
+
+
+def blob_path(index_dir: Path, digest: str) -> Path:
+    return blobs_dir(index_dir) / digest[:2] / f"{digest}.json"
+
+
+def is_ref(value: Any) -> bool:
+    return type(value) is dict and BLOB_KEY in value
+
+
+def _count(value: Any) -> int:
+    """Elementos de una lista/dict, o líneas de un texto."""
+    if isinstance(value, str):
+        return len(value.splitlines())
+    if isinstance(value, (list, dict)):
+        return len(value)
+    return 1
+
+
+def store(index_dir: Path, value: Any) -> dict[str, Any]:
+    """Guarda `value` como blob (si no existe ya) y retorna su referencia."""
+    data = codec.dumps(value)
+    digest = hashlib.sha256(data).hexdigest()
+    path = blob_path(index_dir, digest)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+    return {BLOB_KEY: digest, "count": _count(value), "bytes": len(data)}
+
+
+def offload(index_dir: Path, value: dict[str, Any], threshold: int) -> dict[str, Any]:
+    """
+    Copia de `value` con los campos de más de `threshold` bytes (JSON) movidos
+    a blobs. En un dict grande se baja a sus campos primero, así se mueve el
+    campo voluminoso (ej: delta.new_events) y no todo el dict.
+    """
+    if len(codec.dumps(value)) <= threshold:
+        return value
+    result = dict(value)
+    for key, child in value.items():
+        if is_ref(child) or len(codec.dumps(child)) <= threshold:
+            continue
+        if isinstance(child, dict):
+            child = offload(index_dir, child, threshold)
+            if len(codec.dumps(child)) <= threshold:
+                result[key] = child
+                continue
+        result[key] = store(index_dir, child)
+    return result
+
+
+def load(index_dir: Path, ref: dict[str, Any]) -> Any:
+    """Contenido de una referencia. FileNotFoundError si el blob no existe."""
+    return codec.loads(blob_path(index_dir, ref[BLOB_KEY]).read_bytes())
+
+
+def resolve(index_dir: Path, value: Any) -> Any:
+    """`value` con las referencias a blobs (a cualquier profundidad) reemplazadas por su contenido."""
+    if is_ref(value):
+        return load(index_dir, value)
+    if isinstance(value, dict):
+        return {key: resolve(index_dir, child) for key, child in value.items()}
+    if isinstance(value, list):
+        return [resolve(index_dir, child) for child in value]
+    return value
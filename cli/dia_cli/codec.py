@@ -0,0 +1,160 @@
+"""
+Codec JSON de eventos con backend intercambiable.
+
+Usa orjson o msgspec si están instalados (dependencias opcionales) y cae a la
+stdlib si no. Decodifica bytes directamente (sin pasar por str) y codifica a
+bytes UTF-8 compactos: el mismo formato de línea con cualquier backend.
+
+Lo usan las lecturas/escrituras del log (ndjson, storage, segments,
+event_index, sqlite_mirror) y las respuestas JSON del server.
+
+Las líneas NDJSON (`dumps_line`) llevan un CRC32 como última clave
+(`,"_crc":"xxxxxxxx"}`): la línea sigue siendo JSON válido para cualquier
+lector, y `check_line` la valida sin parsear el JSON. `loads_line` descarta
+la clave.
+"""
+from __future__ import annotations
+
+import json
+import zlib
+from typing import Any, Callable, Optional, Union
+
+BACKENDS = ("orjson", "msgspec", "json")
+
+CRC_KEY = "_crc"
+_CRC_PREFIX = b',"_crc":"'
+# ,"_crc":"xxxxxxxx"}
+_CRC_SUFFIX_SIZE = len(_CRC_PREFIX) + 8 + 2
+
+
+def _default(value: Any) -> Any:
+    """Objetos con `to_dict()` (ej: event.Event) se serializan como su dict."""
+    to_dict = getattr(value, "to_dict", None)
+    if to_dict is None:
+        raise TypeError(f"Tipo no serializable a JSON: {type(value).__name__}")
+    return to_dict()
+
+
+def _load_backend(name: str) -> tuple[Callable[[Union[bytes, str]], Any], Callable[[Any], bytes]]:
+    """(loads, dumps) del backend pedido. ImportError si no está instalado."""
+    if name == "orjson":
+        import orjson
+
+        option = orjson.OPT_NON_STR_KEYS
+
+        def orjson_dumps(value: Any) -> bytes:
+            return orjson.dumps(value, default=_default, option=option)
+
+        return orjson.loads, orjson_dumps
+    if name == "msgspec":
+        import msgspec
+
+        decoder = msgspec.json.Decoder()
+        encoder = msgspec.json.Encoder(enc_hook=_default)
+
+        def msgspec_loads(data: Union[bytes, str]) -> Any:
+            # Mismo contrato que json/orjson: JSON inválido -> ValueError
+            try:
+                return decoder.decode(data)
+            except msgspec.DecodeError as exc:
+                raise ValueError(str(exc)) from exc
+
+        return msgspec_loads, encoder.encode
+    if name == "json":
+
+        def json_dumps(value: Any) -> bytes:
+            return json.dumps(
+                value, ensure_ascii=False, separators=(",", ":"), default=_default
+            ).encode("utf-8")
+
+        return json.loads, json_dumps
+    raise ValueError(f"Backend JSON desconocido: {name}")
+
+
+BACKEND = "json"
+_loads, _dumps = _load_backend(BACKEND)
+
+
+def set_backend(name: str) -> str:
+    """Fija el backend (orjson, msgspec o json). Retorna el nombre activo."""
+    global _loads, _dumps, BACKEND
+    _loads, _dumps = _load_backend(name)
+    BACKEND = name
+    return BACKEND
+
+
+def available_backends() -> list[str]:
+    """Backends instalados, en orden de preferencia."""
+    found = []
+    for name in BACKENDS:
+        try:
+            _load_backend(name)
+        except ImportError:
+            continue
+        found.append(name)
+    return found
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """Decodifica JSON desde bytes (o str) sin decodificar a str antes."""
+    return _loads(data)
+
+
+def dumps(value: Any) -> bytes:
+    """Codifica a JSON compacto en bytes UTF-8."""
+    return _dumps(value)
+
+
+def dumps_str(value: Any) -> str:
+    """Como `dumps`, como str (columnas TEXT de SQLite, archivos de texto)."""
+    return _dumps(value).decode("utf-8")
+
+
+def dumps_line(payload: Any) -> bytes:
+    """
+    Línea NDJSON: JSON compacto + `\\n`. Un objeto no vacío lleva como última
+    clave el CRC32 del JSON sin ella (ver `check_line`). Un `_crc` que ya
+    traiga el objeto (decodificado con `loads` en vez de `loads_line`) se
+    descarta, así la línea no repite la clave.
+    """
+    if type(payload) is dict and CRC_KEY in payload:
+        payload = {key: value for key, value in payload.items() if key != CRC_KEY}
+    body = _dumps(payload)
+    if len(body) < 3 or body[-1:] != b"}":
+        return body + b"\n"
+    return b"%s%s%08x\"}\n" % (body[:-1], _CRC_PREFIX, zlib.crc32(body))
+
+
+def check_line(raw_line: bytes) -> Optional[bool]:
+    """
+    Valida el CRC de una línea de `dumps_line` sin parsear el JSON.
+    True si coincide, False si no (línea dañada), None si la línea no tiene CRC
+    (escrita antes del CRC o por otra herramienta).
+    """
+    line = raw_line.rstrip(b"\r\n")
+    if len(line) <= _CRC_SUFFIX_SIZE or line[-2:] != b'"}' or (
+        line[-_CRC_SUFFIX_SIZE:-10] != _CRC_PREFIX
+    ):
+        return None
+    try:
+        expected = int(line[-10:-2], 16)
+    except ValueError:
+        return False
+    return zlib.crc32(line[:-_CRC_SUFFIX_SIZE] + b"}") == expected
+
+
+def loads_line(raw_line: Union[bytes, str]) -> Any:
+    """
+    Decodifica una línea NDJSON descartando la clave del CRC. ValueError si
+    el JSON es inválido o el CRC no coincide (línea dañada).
+    """
+    if isinstance(raw_line, bytes) and check_line(raw_line) is False:
+        raise ValueError("CRC de la línea no coincide")
+    value = _loads(raw_line)
+    if type(value) is dict:
+        value.pop(CRC_KEY, None)
+    return value
+
+
+# Primer backend instalado
+set_backend(available_backends()[0])
@@ -0,0 +1,376 @@
+"""
+Cache columnar (NumPy) derivado del log de eventos, para métricas.
+
+Guarda una fila por evento en index/columns/, una columna por archivo
+(binario little-endian, leído con np.memmap):
+
+    ts.f8       epoch del ts (float64)
+    type.i2     código de tipo (int16)
+    day.i4      código de día (event_day)
+    session.i4  código de sesión ("day_id:session_id", -1 sin sesión)
+    repo.i4     código de repo.path (-1 sin repo)
+    ref.i8      FixLinked: fila de la captura que resuelve (-1 si no aplica)
+
+meta.json tiene el cursor del log, la cantidad de filas y los diccionarios
+código -> valor; open_captures.json, las capturas de error todavía sin fix
+(acotadas a OPEN_CAPTURES_MAX). El cache se extiende incrementalmente desde
+el cursor (los rangos nuevos del log se parsean con parallel.map_chunks) y
+se reconstruye solo si el cursor deja de ser válido (log reescrito).
+
+NumPy es opcional: sin numpy `is_available()` es False y los llamadores
+usan el camino por eventos.
+"""
+from __future__ import annotations
+
+import json
+import os
+from itertools import islice
+from pathlib import Path
+from typing import Any, Iterable, Iterator, Optional
+
+from . import codec, locking, parallel, refs, storage
+from .utils import ts_epoch
+
+COLUMNS_DIR = "columns"
+META_NAME = "meta.json"
+META_VERSION = 2
+OPEN_CAPTURES_NAME = "open_captures.json"
+# Capturas sin fix que se recuerdan (las más viejas se olvidan: un fix
+# posterior no tiene latencia)
+OPEN_CAPTURES_MAX = 10_000
+# nombre -> (archivo, dtype)
+COLUMNS = {
+    "ts": ("ts.f8", "<f8"),
+    "type": ("type.i2", "<i2"),
+    "day": ("day.i4", "<i4"),
+    "session": ("session.i4", "<i4"),
+    "repo": ("repo.i4", "<i4"),
+    "ref": ("ref.i8", "<i8"),
+}
+DICTIONARIES = {"type": "types", "day": "days", "session": "sessions", "repo": "repos"}
+
+SESSION_START_TYPES = ("SessionStarted", "SessionStartedAfterDayClosed")
+SESSION_END_TYPES = ("SessionEnded",)
+
+
+def _numpy():
+    """Retorna numpy si está instalado (dependencia opcional)."""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def is_available() -> bool:
+    return _numpy() is not None
+
+
+def columns_dir(events_path: Path) -> Path:
+    return events_path.parent / COLUMNS_DIR
+
+
+def _empty_meta() -> dict[str, Any]:
+    return {
+        "version": META_VERSION,
+        "cursor": {},
+        "rows": 0,
+        "types": [],
+        "days": [],
+        "sessions": [],
+        "repos": [],
+    }
+
+
+def _read_meta(directory: Path) -> dict[str, Any]:
+    path = directory / META_NAME
+    if not path.exists():
+        return _empty_meta()
+    try:
+        meta = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return _empty_meta()
+    if not isinstance(meta, dict) or meta.get("version") != META_VERSION:
+        return _empty_meta()
+    return meta
+
+
+def _write_json(path: Path, value: Any) -> None:
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(value, ensure_ascii=True), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def _read_open_captures(directory: Path) -> dict[str, int]:
+    """Capturas con error_hash sin fix todavía: event_id -> fila, de la más vieja a la más nueva."""
+    try:
+        captures = json.loads((directory / OPEN_CAPTURES_NAME).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return captures if isinstance(captures, dict) else {}
+
+
+def _locked(events_path: Path) -> Any:
+    """
+    Lock propio de columns/ (no el de index/): la extensión escanea el log
+    sin frenar los appends del CLI y del server.
+    """
+    directory = columns_dir(events_path)
+    directory.mkdir(parents=True, exist_ok=True)
+    return locking.locked(directory, "columns")
+
+
+def _code(values: list[str], lookup: dict[str, int], value: Optional[str]) -> int:
+    if not value:
+        return -1
+    code = lookup.get(value)
+    if code is None:
+        code = lookup[value] = len(values)
+        values.append(value)
+    return code
+
+
+def chunk_values(
+    events_path: Path, chunk: parallel.Chunk, lines: Iterator[tuple[int, bytes]]
+) -> list[tuple[Any, ...]]:
+    """
+    Mapper de parallel: por evento del rango, (epoch, tipo, día, sesión,
+    repo, event_id si es una captura con error_hash, error_event_id).
+    """
+    ref_table = refs.load(events_path.parent) if refs.refs_path(events_path.parent).exists() else None
+    values = []
+    for _, raw_line in lines:
+        if not raw_line.strip():
+            continue
+        try:
+            event = codec.loads_line(raw_line)
+        except ValueError:
+            # Línea dañada (ver storage.skip_damaged): sin fila
+            continue
+        if ref_table:
+            event = refs.expand(event, ref_table)
+        event_type = event.get("type")
+        session = event.get("session") or {}
+        payload = event.get("payload") or {}
+        values.append((
+            ts_epoch(event.get("ts")),
+            event_type,
+            storage.event_day(event),
+            f"{session.get('day_id')}:{session.get('session_id')}" if session.get("session_id") else None,
+            (event.get("repo") or {}).get("path"),
+            event.get("event_id") if event_type == "CaptureCreated" and payload.get("error_hash") else None,
+            payload.get("error_event_id") if event_type == "FixLinked" else None,
+        ))
+    return values
+
+
+def sync(events_path: Path) -> dict[str, Any]:
+    """
+    Extiende el cache con los eventos nuevos del log y lo retorna (ver `load`).
+    Sin líneas nuevas no toma lock; si hay, las agrega con el lock de
+    columns/ (dos procesos no agregan las mismas filas).
+    """
+    np = _numpy()
+    if np is None:
+        raise RuntimeError("El cache columnar requiere numpy (pip install numpy).")
+    directory = columns_dir(events_path)
+    meta = _read_meta(directory)
+    if storage.cursor_is_valid(events_path, meta["cursor"]) and not storage.pending_files(
+        events_path, meta["cursor"]
+    ):
+        return _load(directory, meta)
+    with _locked(events_path):
+        meta = _read_meta(directory)
+        if not storage.cursor_is_valid(events_path, meta["cursor"]):
+            meta = _empty_meta()
+        rows = meta["rows"]
+        lookups = {name: {v: i for i, v in enumerate(meta[name])} for name in DICTIONARIES.values()}
+        open_captures = _read_open_captures(directory) if rows else {}
+        captures_changed = False
+        new: dict[str, list[Any]] = {name: [] for name in COLUMNS}
+        cursor = meta["cursor"]
+        # Los rangos del log se parsean en paralelo (reconstrucción de un log
+        # grande); los códigos y las referencias se asignan acá, en orden
+        chunks = parallel.split(events_path, cursor=cursor)
+        for (key, _, end), values in parallel.map_chunks(events_path, chunk_values, chunks):
+            cursor[key] = end
+            for epoch, event_type, day, session_key, repo_path, capture_id, error_event_id in values:
+                row = rows + len(new["ts"])
+                new["ts"].append(epoch)
+                new["type"].append(_code(meta["types"], lookups["types"], event_type))
+                new["day"].append(_code(meta["days"], lookups["days"], day))
+                new["session"].append(_code(meta["sessions"], lookups["sessions"], session_key))
+                new["repo"].append(_code(meta["repos"], lookups["repos"], repo_path))
+                ref = -1
+                if capture_id:
+                    open_captures[capture_id] = row
+                    captures_changed = True
+                elif event_type == "FixLinked":
+                    ref = open_captures.pop(error_event_id or "", -1)
+                    captures_changed = captures_changed or ref >= 0
+                new["ref"].append(ref)
+
+        added = len(new["ts"])
+        if added or not (directory / META_NAME).exists():
+            for name, (file_name, dtype) in COLUMNS.items():
+                path = directory / file_name
+                # Filas de una extensión interrumpida (más allá de meta["rows"]) se descartan
+                with path.open("ab") as handle:
+                    handle.truncate(rows * np.dtype(dtype).itemsize)
+                    handle.write(np.asarray(new[name], dtype=dtype).tobytes())
+            if captures_changed or not rows:
+                excess = len(open_captures) - OPEN_CAPTURES_MAX
+                for capture_id in list(islice(open_captures, max(excess, 0))):
+                    del open_captures[capture_id]
+                _write_json(directory / OPEN_CAPTURES_NAME, open_captures)
+            meta["rows"] = rows + added
+            _write_json(directory / META_NAME, meta)
+    return _load(directory, meta)
+
+
+def _load(directory: Path, meta: dict[str, Any]) -> dict[str, Any]:
+    np = _numpy()
+    columns: dict[str, Any] = {name: meta[name] for name in DICTIONARIES.values()}
+    columns["rows"] = rows = meta["rows"]
+    for name, (file_name, dtype) in COLUMNS.items():
+        if rows == 0:
+            columns[name] = np.zeros(0, dtype=dtype)
+        else:
+            columns[name] = np.memmap(directory / file_name, dtype=dtype, mode="r", shape=(rows,))
+    return columns
+
+
+def load(events_path: Path) -> dict[str, Any]:
+    """
+    Columnas al día con el log: dict con arrays `ts`, `type`, `day`,
+    `session`, `repo`, `ref` (memmap de `rows` filas) y los diccionarios
+    `types`, `days`, `sessions`, `repos` (código = índice en la lista).
+    """
+    return sync(events_path)
+
+
+def rebuild(events_path: Path) -> dict[str, Any]:
+    """Descarta el cache y lo reconstruye desde el log."""
+    directory = columns_dir(events_path)
+    with _locked(events_path):
+        # Se conserva el lock (columns/.lock) que otros procesos pueden estar esperando
+        for path in directory.iterdir():
+            if not path.name.startswith(locking.LOCK_NAME):
+                path.unlink()
+        return sync(events_path)
+
+
+def _codes(values: list[str], wanted: Iterable[str]) -> list[int]:
+    lookup = {v: i for i, v in enumerate(values)}
+    return [lookup[v] for v in wanted if v in lookup]
+
+
+def mask(
+    columns: dict[str, Any],
+    types: Optional[Iterable[str]] = None,
+    day_id: Optional[str] = None,
+    repo_path: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+) -> Any:
+    """Máscara booleana de las filas que cumplen los filtros (vectorizado)."""
+    np = _numpy()
+    selected = np.ones(columns["rows"], dtype=bool)
+    if types:
+        selected &= np.isin(columns["type"], _codes(columns["types"], types))
+    if day_id:
+        selected &= np.isin(columns["day"], _codes(columns["days"], [day_id]))
+    if repo_path:
+        selected &= np.isin(columns["repo"], _codes(columns["repos"], [repo_path]))
+    if since:
+        selected &= columns["ts"] >= ts_epoch(since)
+    if until:
+        selected &= columns["ts"] <= ts_epoch(until)
+    return selected
+
+
+def count(columns: dict[str, Any], **filters: Any) -> int:
+    """Cantidad de eventos que cumplen los filtros de `mask`."""
+    if not filters:
+        return int(columns["rows"])
+    return int(mask(columns, **filters).sum())
+
+
+def counts_by(columns: dict[str, Any], column: str, selected: Any = None) -> dict[str, int]:
+    """Conteo por valor de `column` (type, day, session, repo), opcionalmente sobre una máscara."""
+    np = _numpy()
+    values = columns[DICTIONARIES[column]]
+    codes = columns[column] if selected is None else columns[column][selected]
+    codes = codes[codes >= 0]
+    totals = np.bincount(codes, minlength=len(values)) if len(codes) else np.zeros(len(values), dtype=int)
+    return {values[code]: int(total) for code, total in enumerate(totals) if total}
+
+
+def counts_by_day_and_type(columns: dict[str, Any], selected: Any = None) -> dict[str, dict[str, int]]:
+    """{día: {tipo: cantidad}}."""
+    np = _numpy()
+    days, types = columns["days"], columns["types"]
+    day_codes, type_codes = columns["day"], columns["type"]
+    if selected is not None:
+        day_codes, type_codes = day_codes[selected], type_codes[selected]
+    valid = (day_codes >= 0) & (type_codes >= 0)
+    flat = day_codes[valid].astype(np.int64) * max(len(types), 1) + type_codes[valid]
+    result: dict[str, dict[str, int]] = {}
+    if not len(flat):
+        return result
+    pairs, totals = np.unique(flat, return_counts=True)
+    for pair, total in zip(pairs.tolist(), totals.tolist()):
+        day, event_type = divmod(pair, max(len(types), 1))
+        result.setdefault(days[day], {})[types[event_type]] = total
+    return result
+
+
+def session_durations(columns: dict[str, Any], day_id: Optional[str] = None) -> dict[str, Optional[float]]:
+    """
+    Duración en segundos de cada sesión ("day_id:session_id"): del primer
+    inicio al último SessionEnded. None si la sesión sigue abierta.
+    """
+    np = _numpy()
+    sessions = columns["sessions"]
+    session_codes = columns["session"]
+    scope = session_codes >= 0
+    if day_id:
+        scope &= mask(columns, day_id=day_id)
+    starts = scope & np.isin(columns["type"], _codes(columns["types"], SESSION_START_TYPES))
+    ends = scope & np.isin(columns["type"], _codes(columns["types"], SESSION_END_TYPES))
+
+    size = len(sessions)
+    start_ts = np.full(size, np.inf)
+    np.minimum.at(start_ts, session_codes[starts], columns["ts"][starts])
+    end_ts = np.full(size, -np.inf)
+    np.maximum.at(end_ts, session_codes[ends], columns["ts"][ends])
+
+    durations: dict[str, Optional[float]] = {}
+    for code in np.flatnonzero(np.isfinite(start_ts)).tolist():
+        end = end_ts[code]
+        durations[sessions[code]] = float(end - start_ts[code]) if np.isfinite(end) else None
+    return durations
+
+
+def fix_latencies(columns: dict[str, Any], day_id: Optional[str] = None) -> Any:
+    """Segundos entre cada captura de error y su primer FixLinked (array float64)."""
+    np = _numpy()
+    fixes = columns["ref"] >= 0
+    if day_id:
+        fixes &= mask(columns, day_id=day_id)
+    fix_rows = np.flatnonzero(fixes)
+    return columns["ts"][fix_rows] - columns["ts"][columns["ref"][fix_rows]]
+
+
+def latency_summary(latencies: Any) -> dict[str, Any]:
+    """count/p50/p90/max (segundos) de un array de latencias."""
+    np = _numpy()
+    if not len(latencies):
+        return {"count": 0, "p50_s": None, "p90_s": None, "max_s": None}
+    p50, p90 = np.percentile(latencies, [50, 90]).tolist()
+    return {
+        "count": int(len(latencies)),
+        "p50_s": round(p50, 1),
+        "p90_s": round(p90, 1),
+        "max_s": round(float(latencies.max()), 1),
+    }
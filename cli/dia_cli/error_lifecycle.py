@@ -0,0 +1,257 @@
+"""
+Ciclo de vida de los errores capturados: Capture -> Fix -> Commit.
+
+Proyección "errors" (ver projections.py) con una fila por CaptureCreated,
+indexada por su event_id:
+
+- estado: "open" (sin fix), "fixed" (con FixLinked) o "committed" (un fix
+  suyo tiene FixCommitted);
+- el primer fix (fix_id, event_id, sha, título, ts) y el primer commit
+  (commit_sha, event_id, ts);
+- recurrencias: CaptureReoccurred que apuntan a la captura (cantidad y ts de
+  la última).
+
+Además guarda cada FixLinked por fix_id (con su commit) y, por sesión
+("day_id:session_id"), la última captura y las abiertas en orden del log.
+Así `dia cap`, `dia fix`, `dia fix-commit`, `dia pre-feat` y los endpoints
+de errores responden sin recorrer el log: solo se aplican los eventos nuevos.
+"""
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any, Optional
+
+from . import projections
+
+ERROR_EVENT_TYPES = ("CaptureCreated", "CaptureReoccurred", "FixLinked", "FixCommitted")
+STATE_VERSION = 1
+
+# Estados de una captura: open -> fixed -> committed
+ERROR_STATES = ("open", "fixed", "committed")
+
+
+def _empty_state() -> dict[str, Any]:
+    return {
+        # CaptureCreated.event_id -> registro
+        "captures": {},
+        # fix_id -> registro del FixLinked (con su commit)
+        "fixes": {},
+        # FixLinked.event_id -> fix_id (FixCommitted referencia el event_id)
+        "fix_events": {},
+        # "day_id:session_id" -> event_id de la última captura de la sesión
+        "latest": {},
+        # "day_id:session_id" -> event_ids de capturas abiertas, en orden del log
+        "open": {},
+    }
+
+
+def _session_key(day_id: Optional[str], session_id: Optional[str]) -> str:
+    return f"{day_id}:{session_id}"
+
+
+def _capture_record(event: dict[str, Any], seq: int) -> dict[str, Any]:
+    payload = event.get("payload") or {}
+    return {
+        "event_id": event.get("event_id"),
+        # Posición entre las capturas, en orden del log
+        "seq": seq,
+        "ts": event.get("ts"),
+        "session": event.get("session") or {},
+        "title": payload.get("title"),
+        "kind": payload.get("kind"),
+        "error_hash": payload.get("error_hash"),
+        "artifact_ref": payload.get("artifact_ref"),
+        "links": event.get("links") or [],
+        "state": "open",
+        "recurrences": 0,
+        "last_seen_ts": event.get("ts"),
+        "fix_id": None,
+        "fix_event_id": None,
+        "fix_sha": None,
+        "fix_title": None,
+        "fixed_ts": None,
+        "commit_sha": None,
+        "commit_event_id": None,
+        "committed_ts": None,
+    }
+
+
+def _fix_record(event: dict[str, Any]) -> dict[str, Any]:
+    payload = event.get("payload") or {}
+    return {
+        "fix_id": payload.get("fix_id"),
+        "event_id": event.get("event_id"),
+        "ts": event.get("ts"),
+        "session": event.get("session") or {},
+        "error_event_id": payload.get("error_event_id"),
+        "error_hash": payload.get("error_hash"),
+        "fix_sha": payload.get("fix_sha"),
+        "title": payload.get("title"),
+        "commit_sha": None,
+        "commit_event_id": None,
+        "committed_ts": None,
+    }
+
+
+def _close(state: dict[str, Any], record: dict[str, Any]) -> None:
+    """Saca una captura de las abiertas de su sesión."""
+    session = record["session"]
+    key = _session_key(session.get("day_id"), session.get("session_id"))
+    pending = state["open"].get(key)
+    if pending and record["event_id"] in pending:
+        remaining = [event_id for event_id in pending if event_id != record["event_id"]]
+        if remaining:
+            state["open"][key] = remaining
+        else:
+            del state["open"][key]
+
+
+def apply_error_event(state: dict[str, Any], event: dict[str, Any]) -> None:
+    """
+    Aplica un evento de la cadena de errores, en orden del log.
+
+    - CaptureCreated: nueva captura abierta (abierta para `dia fix` solo si
+      tiene error_hash).
+    - CaptureReoccurred: suma una recurrencia a la captura original.
+    - FixLinked: registra el fix; la captura pasa a "fixed" con el primero.
+    - FixCommitted: registra el commit del fix (el primero gana); la captura
+      pasa a "committed".
+
+    Los registros y listas que cambian se reemplazan por una copia (el
+    estado anterior puede estar en uso, ver projections.register).
+    """
+    event_type = event.get("type")
+    payload = event.get("payload") or {}
+    captures = state["captures"]
+    if event_type == "CaptureCreated":
+        event_id = event.get("event_id")
+        if not event_id or event_id in captures:
+            return
+        record = _capture_record(event, len(captures))
+        captures[event_id] = record
+        key = _session_key(record["session"].get("day_id"), record["session"].get("session_id"))
+        state["latest"][key] = event_id
+        if record["error_hash"]:
+            state["open"][key] = [*state["open"].get(key, ()), event_id]
+        return
+    if event_type == "CaptureReoccurred":
+        record = captures.get(payload.get("original_event_id"))
+        if record is not None:
+            captures[record["event_id"]] = dict(
+                record, recurrences=record["recurrences"] + 1, last_seen_ts=event.get("ts")
+            )
+        return
+    if event_type == "FixLinked":
+        fix = _fix_record(event)
+        if not fix["fix_id"] or fix["fix_id"] in state["fixes"]:
+            return
+        state["fixes"][fix["fix_id"]] = fix
+        state["fix_events"][fix["event_id"]] = fix["fix_id"]
+        record = captures.get(fix["error_event_id"])
+        if record is None or record["fix_event_id"]:
+            return
+        captures[record["event_id"]] = dict(
+            record,
+            state="fixed" if record["state"] == "open" else record["state"],
+            fix_id=fix["fix_id"],
+            fix_event_id=fix["event_id"],
+            fix_sha=fix["fix_sha"],
+            fix_title=fix["title"],
+            fixed_ts=fix["ts"],
+        )
+        _close(state, record)
+        return
+    if event_type == "FixCommitted":
+        fix = state["fixes"].get(state["fix_events"].get(payload.get("fix_event_id")))
+        if fix is None or fix["commit_event_id"]:
+            return
+        fix = state["fixes"][fix["fix_id"]] = dict(
+            fix,
+            commit_sha=payload.get("commit_sha"),
+            commit_event_id=event.get("event_id"),
+            committed_ts=event.get("ts"),
+        )
+        record = captures.get(fix["error_event_id"])
+        if record is None or record["commit_event_id"]:
+            return
+        captures[record["event_id"]] = dict(
+            record,
+            state="committed",
+            commit_sha=fix["commit_sha"],
+            commit_event_id=fix["commit_event_id"],
+            committed_ts=fix["committed_ts"],
+        )
+
+
+projections.register(
+    "errors", STATE_VERSION, _empty_state, apply_error_event, types=ERROR_EVENT_TYPES
+)
+
+
+def load_error_state(events_path: Path, at: Optional[str] = None) -> dict[str, Any]:
+    """
+    Estado de la proyección "errors" al día con el log; con `at` (ts ISO),
+    a ese momento. El estado es compartido; no modificarlo.
+    """
+    if at:
+        return projections.load_at(events_path, "errors", at)
+    return projections.load(events_path, "errors")
+
+
+def get_capture(events_path: Path, event_id: Optional[str]) -> Optional[dict[str, Any]]:
+    """Registro de una captura por el event_id de su CaptureCreated, o None."""
+    return load_error_state(events_path)["captures"].get(event_id)
+
+
+def get_fix(events_path: Path, fix_id: Optional[str]) -> Optional[dict[str, Any]]:
+    """Registro de un FixLinked por fix_id (con commit_sha si ya se commiteó), o None."""
+    return load_error_state(events_path)["fixes"].get(fix_id)
+
+
+def last_open_capture(
+    events_path: Path,
+    session_id: Optional[str] = None,
+    day_id: Optional[str] = None,
+    at: Optional[str] = None,
+) -> Optional[dict[str, Any]]:
+    """
+    La última captura (con error_hash) sin fix, opcionalmente de una sesión
+    y/o un día, o None.
+    """
+    state = load_error_state(events_path, at)
+    if session_id and day_id:
+        pending = state["open"].get(_session_key(day_id, session_id))
+        return state["captures"][pending[-1]] if pending else None
+    found = None
+    for pending in state["open"].values():
+        record = state["captures"][pending[-1]]
+        session = record["session"]
+        if session_id and session.get("session_id") != session_id:
+            continue
+        if day_id and session.get("day_id") != day_id:
+            continue
+        if found is None or record["seq"] > found["seq"]:
+            found = record
+    return found
+
+
+def open_captures(
+    events_path: Path, day_id: Optional[str] = None, at: Optional[str] = None
+) -> list[dict[str, Any]]:
+    """La última captura sin fix de cada sesión (opcionalmente de un día), de la más nueva a la más vieja."""
+    state = load_error_state(events_path, at)
+    records = []
+    for pending in state["open"].values():
+        record = state["captures"][pending[-1]]
+        if day_id and record["session"].get("day_id") != day_id:
+            continue
+        records.append(record)
+    records.sort(key=lambda record: record["seq"], reverse=True)
+    return records
+
+
+def latest_capture(events_path: Path, day_id: Optional[str], session_id: Optional[str]) -> Optional[dict[str, Any]]:
+    """La última captura de una sesión (abierta o no), o None."""
+    state = load_error_state(events_path)
+    event_id = state["latest"].get(_session_key(day_id, session_id))
+    return state["captures"].get(event_id) if event_id else None
@@ -0,0 +1,199 @@
+"""
+Representación compacta de un evento leído del log.
+
+Un evento como dict anidado (session, actor, project, repo, payload, links)
+ocupa varios KB en memoria. `Event` guarda la línea cruda y solo decodifica
+los campos de cabecera (event_id, ts, type, session); el resto se decodifica
+al primer acceso. Con msgspec instalado la cabecera se decodifica sin
+construir el resto del JSON; sin msgspec se decodifican solo las claves de
+cabecera del principio de la línea (orden canónico, ver
+ndjson.canonical_order) con el scanner de la stdlib.
+
+El acceso tipo dict (`event["type"]`, `event.get("payload", {})`, `in`,
+`keys()`/`items()`) sigue funcionando para los llamadores existentes, y el
+codec lo serializa como el dict original.
+"""
+from __future__ import annotations
+
+import json
+from typing import Any, Iterator, Optional, Union
+
+from . import codec, refs
+
+HEADER_FIELDS = ("event_id", "ts", "type", "session")
+
+# Campo ausente en la línea (distinto de presente con null)
+_MISSING: Any = object()
+
+
+def _header_decoder():
+    """Decoder de cabecera con msgspec (dependencia opcional), o None."""
+    try:
+        import msgspec
+    except ImportError:
+        return None
+
+    class _Header(msgspec.Struct):
+        event_id: Any = msgspec.UNSET
+        ts: Any = msgspec.UNSET
+        type: Any = msgspec.UNSET
+        session: Any = msgspec.UNSET
+
+    decoder = msgspec.json.Decoder(_Header)
+    unset = msgspec.UNSET
+
+    def decode(raw: Union[bytes, str]) -> tuple[Any, Any, Any, Any]:
+        try:
+            header = decoder.decode(raw)
+        except msgspec.DecodeError as exc:
+            raise ValueError(str(exc)) from exc
+        return (
+            _MISSING if header.event_id is unset else header.event_id,
+            _MISSING if header.ts is unset else header.ts,
+            _MISSING if header.type is unset else header.type,
+            _MISSING if header.session is unset else header.session,
+        )
+
+    return decode
+
+
+def _full_header(raw: Union[bytes, str]) -> tuple[Any, Any, Any, Any]:
+    """Decodifica la línea completa y conserva solo la cabecera."""
+    event = codec.loads_line(raw)
+    if not isinstance(event, dict):
+        raise ValueError("La línea no es un objeto JSON")
+    return (
+        event.get("event_id", _MISSING),
+        event.get("ts", _MISSING),
+        event.get("type", _MISSING),
+        event.get("session", _MISSING),
+    )
+
+
+_scan_value = json.JSONDecoder().scan_once
+
+
+def _prefix_header(raw: Union[bytes, str]) -> tuple[Any, Any, Any, Any]:
+    """
+    Sin msgspec: decodifica solo las claves de cabecera del principio de la
+    línea, sin construir el payload. Las líneas con CRC válido (bytes del
+    log) y las de la columna raw del espejo están en orden canónico; las
+    demás, o si falta alguna clave de cabecera antes del resto, se
+    decodifican enteras (y se valida el JSON).
+    """
+    if isinstance(raw, bytes):
+        if not codec.check_line(raw):
+            return _full_header(raw)
+        text = raw.decode("utf-8")
+    else:
+        text = raw
+    if not text.startswith("{"):
+        return _full_header(raw)
+    header = dict.fromkeys(HEADER_FIELDS, _MISSING)
+    found = 0
+    position = 1
+    try:
+        while found < len(HEADER_FIELDS) and text[position] == '"':
+            key, position = _scan_value(text, position)
+            if key not in header or text[position] != ":":
+                break
+            header[key], position = _scan_value(text, position + 1)
+            found += 1
+            if text[position] == "}":
+                # Fin del objeto: las claves ausentes no están en la línea
+                found = len(HEADER_FIELDS)
+            elif text[position] != ",":
+                break
+            position += 1
+    except (StopIteration, IndexError):
+        return _full_header(raw)
+    if found < len(HEADER_FIELDS):
+        return _full_header(raw)
+    return header["event_id"], header["ts"], header["type"], header["session"]
+
+
+_decode_header = _header_decoder() or _prefix_header
+
+
+class Event:
+    """Evento del log con cabecera decodificada y el resto perezoso (ver módulo)."""
+
+    __slots__ = ("event_id", "ts", "type", "session", "_raw", "_full", "_refs")
+
+    def __init__(self, raw: Union[bytes, str], ref_table: Optional[dict[str, Any]] = None) -> None:
+        self.event_id, self.ts, self.type, self.session = _decode_header(raw)
+        self._raw = raw
+        self._full: Optional[dict[str, Any]] = None
+        # Tabla de refs.ndjson (líneas compactas), ver refs.py
+        self._refs = ref_table
+
+    @property
+    def raw(self) -> Union[bytes, str]:
+        """Línea JSON original (sin `\\n`; en formato compacto si así se escribió)."""
+        return self._raw
+
+    def _decoded(self) -> dict[str, Any]:
+        # Se conserva: un llamador que toca el payload suele tocarlo varias veces
+        if self._full is None:
+            self._full = self._load()
+        return self._full
+
+    def _load(self) -> dict[str, Any]:
+        event = codec.loads_line(self._raw)
+        return refs.expand(event, self._refs) if self._refs else event
+
+    def to_dict(self) -> dict[str, Any]:
+        """El evento como dict (el de codec.loads de la línea, con referencias expandidas)."""
+        if self._full is not None:
+            return self._full
+        return self._load()
+
+    def copy(self) -> dict[str, Any]:
+        return dict(self.to_dict())
+
+    def __getitem__(self, key: str) -> Any:
+        if key in HEADER_FIELDS:
+            value = getattr(self, key)
+            if value is _MISSING:
+                raise KeyError(key)
+            return value
+        return self._decoded()[key]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in HEADER_FIELDS:
+            value = getattr(self, key)
+            return default if value is _MISSING else value
+        return self._decoded().get(key, default)
+
+    def __contains__(self, key: object) -> bool:
+        if key in HEADER_FIELDS:
+            return getattr(self, key) is not _MISSING
+        return key in self._decoded()
+
+    def keys(self):
+        return self._decoded().keys()
+
+    def values(self):
+        return self._decoded().values()
+
+    def items(self):
+        return self._decoded().items()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._decoded())
+
+    def __len__(self) -> int:
+        return len(self._decoded())
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Event):
+            return self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        return f"Event(type={self.type!r}, ts={self.ts!r}, event_id={self.event_id!r})"
+
@@ -0,0 +1,385 @@
+"""
+Índice sidecar de offsets para archivos NDJSON (ej: events.ndjson -> events.idx).
+
+Cada línea del log tiene un registro de tamaño fijo en el índice con:
+número de línea, offset en bytes, largo, timestamp (epoch) y tipo de evento.
+Al ser de tamaño fijo, el registro N está en N * RECORD.size, lo que permite
+saltar a cualquier línea (o leer solo lo agregado desde un offset conocido)
+sin parsear el log desde el byte 0.
+
+El índice es derivado: si falta o quedó desfasado respecto del log
+(escrituras sin índice, truncado), se reconstruye o se completa solo.
+Las escrituras al índice (registro de un append, puesta al día,
+reconstrucción) se hacen con el lock del directorio del log tomado: un
+lector y un writer poniéndolo al día a la vez duplicarían registros.
+
+Junto al índice, events.idx.json guarda si todas las líneas indexadas están
+en orden canónico (empiezan por `{"type":`, ver ndjson.canonical_order):
+las búsquedas por substring (storage._scan_lines) usan solo la forma
+canónica cuando lo están. Se calcula al reconstruir y se baja al indexar una
+línea que no lo está (ej: copiada tal cual por `dia storage migrate`).
+"""
+from __future__ import annotations
+
+import os
+import struct
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+from . import codec, locking
+from .utils import ts_epoch
+
+# line (Q), offset (Q), length (I), ts epoch (d), type (48s)
+RECORD = struct.Struct("<QQId48s")
+TYPE_SIZE = 48
+# Comienzo de una línea en orden canónico (ndjson.encode_line)
+CANONICAL_PREFIX = b'{"type":'
+
+
+def index_path(log_path: Path) -> Path:
+    """Ruta del índice sidecar de un log NDJSON (events.ndjson -> events.idx)."""
+    return log_path.with_suffix(".idx")
+
+
+def meta_path(log_path: Path) -> Path:
+    """Metadata del índice (events.ndjson -> events.idx.json)."""
+    return log_path.with_suffix(".idx.json")
+
+
+def _read_meta(log_path: Path) -> Optional[dict[str, Any]]:
+    try:
+        meta = codec.loads(meta_path(log_path).read_bytes())
+    except (OSError, ValueError):
+        return None
+    return meta if isinstance(meta, dict) else None
+
+
+def _write_meta(log_path: Path, canonical: bool) -> None:
+    """Escritura atómica (tmp + rename), con el lock del índice tomado."""
+    path = meta_path(log_path)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    tmp_path.write_bytes(codec.dumps({"canonical": canonical}))
+    os.replace(tmp_path, path)
+
+
+def _locked(log_path: Path) -> Any:
+    """
+    Lock de las escrituras al índice: el del directorio del log (index/, el
+    de los writers, o index/events/ en layout daily; siempre después del de
+    index/, nunca antes).
+    """
+    return locking.locked(log_path.parent, "event_index")
+
+
+def _pack(line: int, offset: int, length: int, ts: Any, event_type: Any) -> bytes:
+    type_bytes = str(event_type or "").encode("utf-8")[:TYPE_SIZE]
+    return RECORD.pack(line, offset, length, ts_epoch(ts), type_bytes)
+
+
+def _unpack(raw: bytes) -> dict[str, Any]:
+    line, offset, length, ts, type_bytes = RECORD.unpack(raw)
+    return {
+        "line": line,
+        "offset": offset,
+        "length": length,
+        "ts": ts,
+        "type": type_bytes.rstrip(b"\x00").decode("utf-8", errors="replace"),
+    }
+
+
+def _header_fields(raw_line: bytes) -> tuple[Any, Any]:
+    """Extrae (ts, type) de una línea cruda. Líneas inválidas se indexan sin datos."""
+    try:
+        event = codec.loads_line(raw_line)
+    except ValueError:
+        return None, None
+    if not isinstance(event, dict):
+        return None, None
+    return event.get("ts"), event.get("type")
+
+
+def entry_count(log_path: Path) -> int:
+    """Cantidad de líneas indexadas (sin validar contra el log)."""
+    idx = index_path(log_path)
+    if not idx.exists():
+        return 0
+    return idx.stat().st_size // RECORD.size
+
+
+def read_entry(log_path: Path, line: int) -> Optional[dict[str, Any]]:
+    """Lee el registro del índice para una línea (0-based). None si no existe."""
+    idx = index_path(log_path)
+    if line < 0 or not idx.exists():
+        return None
+    with idx.open("rb") as handle:
+        handle.seek(line * RECORD.size)
+        raw = handle.read(RECORD.size)
+    if len(raw) < RECORD.size:
+        return None
+    return _unpack(raw)
+
+
+def iter_entries(log_path: Path, start: int = 0) -> Iterator[dict[str, Any]]:
+    """Itera registros del índice desde la línea `start`."""
+    idx = index_path(log_path)
+    if not idx.exists():
+        return
+    with idx.open("rb") as handle:
+        handle.seek(max(start, 0) * RECORD.size)
+        while True:
+            raw = handle.read(RECORD.size)
+            if len(raw) < RECORD.size:
+                break
+            yield _unpack(raw)
+
+
+def iter_entries_reverse(log_path: Path, block: int = 256) -> Iterator[dict[str, Any]]:
+    """Itera registros del índice desde la última línea hacia la primera (de a bloques)."""
+    idx = index_path(log_path)
+    if not idx.exists():
+        return
+    with idx.open("rb") as handle:
+        remaining = idx.stat().st_size // RECORD.size
+        while remaining > 0:
+            take = min(block, remaining)
+            remaining -= take
+            handle.seek(remaining * RECORD.size)
+            raw = handle.read(take * RECORD.size)
+            for position in range(take - 1, -1, -1):
+                yield _unpack(raw[position * RECORD.size:(position + 1) * RECORD.size])
+
+
+def line_at(log_path: Path, offset: int) -> int:
+    """Primera línea (0-based) que empieza en `offset` o después (bisección sobre el índice)."""
+    low, high = 0, entry_count(log_path)
+    idx = index_path(log_path)
+    if not high:
+        return 0
+    with idx.open("rb") as handle:
+        while low < high:
+            middle = (low + high) // 2
+            handle.seek(middle * RECORD.size)
+            if _unpack(handle.read(RECORD.size))["offset"] < offset:
+                low = middle + 1
+            else:
+                high = middle
+    return low
+
+
+def indexed_bytes(log_path: Path) -> int:
+    """Bytes del log cubiertos por el índice (fin de la última línea indexada)."""
+    count = entry_count(log_path)
+    if count == 0:
+        return 0
+    last = read_entry(log_path, count - 1)
+    return last["offset"] + last["length"] if last else 0
+
+
+def _index_from(log_path: Path, offset: int, first_line: int) -> tuple[int, bool]:
+    """
+    Indexa líneas completas del log desde `offset`. Retorna (líneas
+    agregadas, si todas están en orden canónico).
+    """
+    added = 0
+    canonical = True
+    records: list[bytes] = []
+    line_no = first_line
+    with log_path.open("rb") as handle:
+        handle.seek(offset)
+        position = offset
+        for raw_line in handle:
+            length = len(raw_line)
+            if not raw_line.endswith(b"\n"):
+                # Línea incompleta (escritura en curso o cortada): no indexar aún
+                break
+            if raw_line.strip():
+                ts, event_type = _header_fields(raw_line)
+                records.append(_pack(line_no, position, length, ts, event_type))
+                canonical = canonical and raw_line.startswith(CANONICAL_PREFIX)
+                line_no += 1
+                added += 1
+            position += length
+    if not canonical:
+        # Antes que los registros: quien ve las líneas indexadas ya ve la marca
+        _write_meta(log_path, False)
+    if records:
+        with index_path(log_path).open("ab") as idx:
+            idx.write(b"".join(records))
+    return added, canonical
+
+
+def rebuild_index(log_path: Path) -> int:
+    """Reconstruye el índice completo desde el log. Retorna cantidad de líneas."""
+    idx = index_path(log_path)
+    idx.parent.mkdir(parents=True, exist_ok=True)
+    with _locked(log_path):
+        meta_path(log_path).unlink(missing_ok=True)
+        idx.write_bytes(b"")
+        if not log_path.exists():
+            return 0
+        added, canonical = _index_from(log_path, 0, 0)
+        _write_meta(log_path, canonical)
+        return added
+
+
+def _is_stale(log_path: Path, count: int, log_size: int) -> bool:
+    """
+    El final del índice no corresponde al log: los dos últimos registros no
+    son consecutivos (numeración u offsets), cubre más bytes que el archivo
+    o la última línea indexada no termina en fin de línea.
+    """
+    if count == 0:
+        return False
+    last = read_entry(log_path, count - 1)
+    if last is None or last["line"] != count - 1:
+        return True
+    if count > 1:
+        previous = read_entry(log_path, count - 2)
+        if previous is None or previous["offset"] + previous["length"] > last["offset"]:
+            return True
+    covered = last["offset"] + last["length"]
+    if covered > log_size:
+        return True
+    with log_path.open("rb") as handle:
+        handle.seek(covered - 1)
+        return handle.read(1) != b"\n"
+
+
+def _is_contiguous(log_path: Path) -> bool:
+    """Todos los registros numerados 0..N-1, con offsets crecientes y sin solaparse."""
+    expected, end = 0, 0
+    with index_path(log_path).open("rb") as handle:
+        while True:
+            data = handle.read(RECORD.size * 4096)
+            if not data:
+                return True
+            for line, offset, length, _, _ in RECORD.iter_unpack(data):
+                if line != expected or offset < end:
+                    return False
+                expected += 1
+                end = offset + length
+
+
+def ensure_index(log_path: Path) -> int:
+    """
+    Garantiza que el índice cubra todo el log y retorna la cantidad de líneas.
+
+    - Al día con el log: responde sin lock.
+    - Si no, con el lock tomado (y releyendo el índice): si no existe o
+      está corrupto/desfasado (incluye registros no contiguos), lo
+      reconstruye; si el log creció sin actualizar el índice (ej: escritura
+      de otro proceso), indexa solo la cola nueva.
+    """
+    idx = index_path(log_path)
+    if log_path.exists() and idx.exists() and idx.stat().st_size % RECORD.size == 0:
+        count = entry_count(log_path)
+        if indexed_bytes(log_path) == log_path.stat().st_size and not _is_stale(
+            log_path, count, log_path.stat().st_size
+        ):
+            return count
+    with _locked(log_path):
+        if not log_path.exists():
+            idx.unlink(missing_ok=True)
+            meta_path(log_path).unlink(missing_ok=True)
+            return 0
+        if not idx.exists() or idx.stat().st_size % RECORD.size != 0:
+            return rebuild_index(log_path)
+        count = entry_count(log_path)
+        log_size = log_path.stat().st_size
+        if _is_stale(log_path, count, log_size) or not _is_contiguous(log_path):
+            return rebuild_index(log_path)
+        covered = indexed_bytes(log_path)
+        if covered < log_size:
+            count += _index_from(log_path, covered, count)[0]
+        return count
+
+
+def canonical_bytes(log_path: Path) -> int:
+    """
+    Bytes del principio del log (los indexados) cuyas líneas están todas en
+    orden canónico; 0 si alguna no lo está. Un índice sin metadata (de una
+    versión anterior) se reconstruye una vez para calcularla.
+    """
+    ensure_index(log_path)
+    # Cubierto antes que la marca: una puesta al día escribe la marca antes
+    # que sus registros
+    covered = indexed_bytes(log_path)
+    meta = _read_meta(log_path)
+    if meta is None:
+        with _locked(log_path):
+            if _read_meta(log_path) is None:
+                rebuild_index(log_path)
+            covered = indexed_bytes(log_path)
+            meta = _read_meta(log_path)
+    return covered if meta and meta.get("canonical") else 0
+
+
+def record_append(log_path: Path, offset: int, length: int, payload: dict[str, Any]) -> None:
+    """
+    Registra en el índice una línea recién escrita por append_line.
+    Si el índice no estaba al día con el log, lo pone al día (incluye la línea nueva).
+    """
+    record_appends(log_path, offset, [(length, payload)])
+
+
+def record_appends(
+    log_path: Path, offset: int, lines: list[tuple[int, dict[str, Any]]]
+) -> None:
+    """
+    Registra líneas consecutivas escritas juntas desde `offset` (EventWriter):
+    `lines` son pares (largo, payload). Un solo write al índice.
+    """
+    with _locked(log_path):
+        if indexed_bytes(log_path) != offset or not index_path(log_path).exists():
+            ensure_index(log_path)
+            return
+        line_no = entry_count(log_path)
+        records: list[bytes] = []
+        if any("type" not in payload for _, payload in lines):
+            # encode_line pone "type" primero; un payload sin tipo no queda canónico
+            _write_meta(log_path, False)
+        for length, payload in lines:
+            records.append(_pack(line_no, offset, length, payload.get("ts"), payload.get("type")))
+            line_no += 1
+            offset += length
+        with index_path(log_path).open("ab") as idx:
+            idx.write(b"".join(records))
+
+
+def line_offset(log_path: Path, line: int) -> Optional[int]:
+    """Offset en bytes de una línea (0-based). None si la línea no existe."""
+    ensure_index(log_path)
+    entry = read_entry(log_path, line)
+    return entry["offset"] if entry else None
+
+
+def read_since(log_path: Path, offset: int = 0) -> Iterator[tuple[int, dict[str, Any]]]:
+    """
+    Lee las líneas completas agregadas desde `offset` (inclusive).
+    Retorna pares (offset_de_fin_de_línea, evento) para que el caller
+    pueda persistir hasta dónde leyó.
+    """
+    if not log_path.exists():
+        return
+    with log_path.open("rb") as handle:
+        handle.seek(offset)
+        position = offset
+        for raw_line in handle:
+            if not raw_line.endswith(b"\n"):
+                break
+            position += len(raw_line)
+            if not raw_line.strip():
+                continue
+            yield position, codec.loads_line(raw_line)
+
+
+def read_tail(log_path: Path, limit: int) -> list[dict[str, Any]]:
+    """Retorna las últimas `limit` líneas del log sin leer el archivo completo."""
+    if limit <= 0:
+        return []
+    count = ensure_index(log_path)
+    if count == 0:
+        return []
+    entry = read_entry(log_path, max(count - limit, 0))
+    start = entry["offset"] if entry else 0
+    return [event for _, event in read_since(log_path, start)]
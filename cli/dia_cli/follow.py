@@ -0,0 +1,259 @@
+"""
+Seguimiento del log de eventos en vivo (`dia events tail --follow`).
+
+`follow` retorna lotes de eventos a medida que se agregan al log. Entre
+lotes el proceso espera bloqueado, sin consumir CPU:
+
+- con inotify (Linux, vía ctypes sobre libc) se vigilan los directorios del
+  log (index/, index/events/ en layout daily y sus segments/): un append, un
+  archivo de día nuevo o un segmento sellado despiertan la espera;
+- si inotify no está disponible, se compara cada `interval` segundos un
+  stat de esos directorios y de los archivos activos (tamaño, mtime, inode).
+
+Las líneas nuevas se leen con el cursor de offsets lógicos ({archivo:
+offset}, ver storage.py), así la rotación (líneas del activo que pasan a un
+segmento sellado) no cambia la posición. La lectura se hace con el lock de
+index/ tomado: un sellado a medio hacer no se ve. Si el cursor deja de
+corresponder al log (archivo truncado, log migrado o reescrito) se sigue
+desde el final.
+"""
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from . import codec, refs, segments, storage
+from .ndjson import recover
+from .query import table_row
+
+# Espera del polling por stat entre comparaciones
+POLL_SECONDS = 1.0
+# Con inotify igual se revisa el log cada tanto (filesystems de red o montajes
+# donde las escrituras de otra máquina no generan eventos)
+RESYNC_SECONDS = 30.0
+
+IN_MODIFY = 0x00000002
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+# Sin IN_OPEN/IN_CLOSE_*: tomar el lock (abrir index/.lock) no despierta la espera
+WATCH_MASK = (
+    IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+)
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def _inotify() -> Optional[Any]:
+    """libc con inotify_init1/inotify_add_watch, o None (no es Linux, sin libc)."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+def watched_dirs(events_path: Path) -> list[Path]:
+    """Directorios donde se escriben, rotan o crean archivos del log (los que existen)."""
+    daily = storage.daily_dir(events_path)
+    candidates = [
+        events_path.parent,
+        segments.segments_dir(events_path),
+        daily,
+        segments.segments_dir(daily / events_path.name),
+    ]
+    return [path for path in candidates if path.is_dir()]
+
+
+class LogWatcher:
+    """
+    Espera cambios en los archivos del log. `backend` es "inotify" o "poll".
+
+        with LogWatcher(events_path) as watcher:
+            while True:
+                watcher.wait(timeout)   # True si algo cambió
+    """
+
+    def __init__(self, events_path: Path, interval: float = POLL_SECONDS, use_inotify: bool = True):
+        self.events_path = events_path
+        self.interval = interval
+        self.fd: Optional[int] = None
+        # watch descriptor -> directorio vigilado
+        self.watches: dict[int, Path] = {}
+        self.signature: Optional[tuple] = None
+        libc = _inotify() if use_inotify else None
+        if libc is not None:
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd >= 0:
+                self.libc, self.fd = libc, fd
+                self._add_watches()
+        self.backend = "inotify" if self.fd is not None else "poll"
+        if self.fd is None:
+            self.signature = self._stat_signature()
+
+    def __enter__(self) -> "LogWatcher":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.close()
+        return False
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _add_watches(self) -> None:
+        # Directorios creados después (events/, segments/) se agregan al despertar;
+        # volver a agregar uno ya vigilado retorna el mismo descriptor
+        for directory in watched_dirs(self.events_path):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if wd >= 0:
+                self.watches[wd] = directory
+
+    def _is_relevant(self, wd: int, mask: int, name: bytes) -> bool:
+        """Cambios en archivos del log: el activo, archivos de día, segmentos, directorios."""
+        if mask & (IN_Q_OVERFLOW | IN_IGNORED | IN_ISDIR | IN_DELETE_SELF | IN_MOVE_SELF):
+            return True
+        directory = self.watches.get(wd)
+        if directory is None or name.endswith(b".tmp"):
+            return False
+        if directory.name == segments.SEGMENTS_DIR:
+            return True
+        if directory == storage.daily_dir(self.events_path):
+            return name.endswith(b".ndjson")
+        return name == os.fsencode(self.events_path.name)
+
+    def _drain(self) -> bool:
+        """Lee los eventos de inotify pendientes. True si alguno es del log."""
+        relevant = False
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            position = 0
+            while position + _EVENT_HEADER.size <= len(data):
+                wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, position)
+                start = position + _EVENT_HEADER.size
+                name = data[start:start + length].rstrip(b"\0")
+                position = start + length
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                relevant = relevant or self._is_relevant(wd, mask, name)
+        return relevant
+
+    def _stat_signature(self) -> tuple:
+        entries = []
+        for directory in watched_dirs(self.events_path):
+            entries.append((str(directory), directory.stat().st_mtime_ns))
+        for path in storage.log_files(self.events_path):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((str(path), stat.st_ino, stat.st_size, stat.st_mtime_ns))
+        return tuple(entries)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Bloquea hasta un cambio en el log (True) o hasta `timeout` segundos (False)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+            if self.fd is not None:
+                ready, _, _ = select.select([self.fd], [], [], remaining)
+                if ready and self._drain():
+                    self._add_watches()
+                    return True
+            else:
+                time.sleep(self.interval if remaining is None else min(self.interval, remaining))
+                signature = self._stat_signature()
+                if signature != self.signature:
+                    self.signature = signature
+                    return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+
+
+def read_new(
+    events_path: Path, cursor: dict[str, int], types: Optional[Iterable[str]] = None
+) -> Optional[list[dict[str, Any]]]:
+    """
+    Eventos escritos después de `cursor` (que avanza en el lugar), de los
+    tipos dados. None si el cursor ya no corresponde al log.
+    """
+    type_set = frozenset(types) if types else None
+    needles = tuple(codec.dumps(t) for t in type_set) if type_set else ()
+    batch = []
+    # Con el lock no hay un sellado ni un lote a medio escribir; la salida se
+    # escribe después de soltarlo (una terminal lenta no frena a los escritores)
+    with storage.locked(events_path, "tail"):
+        if not storage.cursor_is_valid(events_path, cursor):
+            return None
+        ref_table = refs.load(events_path.parent) if refs.refs_path(events_path.parent).exists() else None
+        for path in storage.pending_files(events_path, cursor):
+            recover(path, events_path.parent)
+            key = storage.file_key(events_path, path)
+            for end_offset, raw_line in segments.iter_raw(path, cursor.get(key, 0)):
+                cursor[key] = end_offset
+                if not raw_line.strip() or (needles and not any(n in raw_line for n in needles)):
+                    continue
+                try:
+                    event = codec.loads_line(raw_line)
+                except ValueError:
+                    storage.skip_damaged(events_path)
+                    continue
+                if type_set and event.get("type") not in type_set:
+                    continue
+                batch.append(refs.expand(event, ref_table) if ref_table else event)
+    return batch
+
+
+def follow(
+    events_path: Path,
+    cursor: dict[str, int],
+    types: Optional[Iterable[str]] = None,
+    watcher: Optional[LogWatcher] = None,
+    on_rewrite: Optional[Callable[[], None]] = None,
+) -> Iterator[list[dict[str, Any]]]:
+    """
+    Lotes de eventos nuevos (desde `cursor`), sin fin. Si el cursor deja de
+    ser válido se llama `on_rewrite` y se sigue desde el final del log.
+    """
+    types = tuple(types) if types else None
+    watcher = watcher or LogWatcher(events_path)
+    with watcher:
+        while True:
+            if not storage.cursor_is_valid(events_path, cursor) or storage.pending_files(events_path, cursor):
+                batch = read_new(events_path, cursor, types)
+                if batch is None:
+                    if on_rewrite:
+                        on_rewrite()
+                    with storage.locked(events_path, "tail"):
+                        cursor.clear()
+                        cursor.update(storage.end_cursor(events_path))
+                elif batch:
+                    yield batch
+                continue
+            watcher.wait(RESYNC_SECONDS if watcher.backend == "inotify" else None)
+
+
+def format_line(event: Any) -> str:
+    """Línea de `dia events tail` (ts, tipo, día, sesión, repo, event_id)."""
+    ts, event_type, day, session_id, repo, event_id = table_row(event)
+    return f"{ts}  {event_type:<28} {day}  {session_id or '-':<4} {repo or '-'}  {event_id}"
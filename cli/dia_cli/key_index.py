@@ -0,0 +1,270 @@
+"""
+Índices por clave del log de eventos: event_id, capture_id, error_hash,
+fix_id y los vínculos capture -> fix -> commit.
+
+`dia fix --from`, `dia fix-commit`, la detección de errores repetidos de
+`dia cap` y /api/chain/latest buscaban un evento por un campo recorriendo
+todas las capturas o fixes. index/keys.sqlite3 guarda, por cada valor de
+clave, la posición (archivo, offset lógico, largo) de las líneas que lo
+tienen: la búsqueda es una consulta indexada y un seek, sin importar el
+tamaño del historial.
+
+El índice se pone al día antes de cada búsqueda (`opened`/`lookup`), no al
+escribir: los appends (CLI y server) no pagan la transacción SQLite ni,
+si el cursor se invalidó, una reconstrucción con el lock de index/ tomado.
+Es derivado: si su cursor deja de ser válido (log migrado o reescrito) se
+reconstruye, y cada resultado se verifica contra la línea leída.
+
+Usa SQLite (stdlib) como tabla de claves: de los backends de dbm el único
+siempre disponible, dbm.dumb, reescribe su directorio completo al cerrar.
+"""
+from __future__ import annotations
+
+import contextlib
+import json
+import sqlite3
+from pathlib import Path, PurePosixPath
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from . import parallel, storage
+from .event import Event
+
+KEYS_NAME = "keys.sqlite3"
+SCHEMA_VERSION = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS keys (
+    name TEXT NOT NULL,
+    value TEXT NOT NULL,
+    file TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS keys_lookup ON keys (name, value);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def _capture_id(payload: dict[str, Any]) -> Optional[str]:
+    """ID de captura: nombre del artefacto (artifacts/captures/<día>/<sesión>/<capture_id>.txt)."""
+    ref = payload.get("artifact_ref")
+    return PurePosixPath(ref).stem if isinstance(ref, str) and ref else None
+
+
+# clave -> (tipos de evento, valor desde el payload); event_id va en todos
+KEYS: dict[str, tuple[tuple[str, ...], Optional[Callable[[dict[str, Any]], Any]]]] = {
+    "event_id": ((), None),
+    "capture_id": (("CaptureCreated",), _capture_id),
+    "error_hash": (("CaptureCreated",), lambda payload: payload.get("error_hash")),
+    "fix_id": (("FixLinked",), lambda payload: payload.get("fix_id")),
+    "error_event_id": (("FixLinked",), lambda payload: payload.get("error_event_id")),
+    "fix_event_id": (("FixCommitted",), lambda payload: payload.get("fix_event_id")),
+}
+_PAYLOAD_TYPES = {event_type for types, _ in KEYS.values() for event_type in types}
+
+
+def keys_path(events_path: Path) -> Path:
+    return events_path.parent / KEYS_NAME
+
+
+def key_value(event: Any, name: str) -> Optional[str]:
+    """Valor de la clave `name` en el evento (dict o Event), o None si no aplica."""
+    types, getter = KEYS[name]
+    if getter is None:
+        value = event.get(name)
+    elif event.get("type") in types:
+        payload = event.get("payload")
+        value = getter(payload) if isinstance(payload, dict) else None
+    else:
+        return None
+    return value if isinstance(value, str) and value else None
+
+
+def _connect(path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(path), timeout=30, isolation_level=None)
+    # WAL: las búsquedas no esperan al writer y el commit no hace fsync
+    # (el índice se reconstruye desde el log si se pierde)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _get_meta(conn: sqlite3.Connection, key: str) -> Optional[str]:
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def _set_meta(conn: sqlite3.Connection, key: str, value: str) -> None:
+    conn.execute(
+        "INSERT INTO meta (key, value) VALUES (?, ?) "
+        "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+        (key, value),
+    )
+
+
+def _cursor(conn: sqlite3.Connection) -> dict[str, int]:
+    return json.loads(_get_meta(conn, "cursor") or "{}")
+
+
+def chunk_rows(
+    events_path: Path, chunk: parallel.Chunk, lines: Iterator[tuple[int, bytes]]
+) -> list[tuple[Any, ...]]:
+    """
+    Mapper de parallel: filas (clave, valor, archivo, offset, largo) de las
+    líneas de un rango del log.
+    """
+    key = chunk[0]
+    rows = []
+    for end, raw_line in lines:
+        if not raw_line.strip():
+            continue
+        try:
+            # Solo se decodifica la cabecera; el payload, en los tipos con claves
+            event = Event(raw_line.rstrip(b"\r\n"))
+            names = KEYS if event.type in _PAYLOAD_TYPES else ("event_id",)
+            for name in names:
+                value = key_value(event, name)
+                if value:
+                    rows.append((name, value, key, end - len(raw_line), len(raw_line)))
+        except ValueError:
+            continue
+    return rows
+
+
+def sync(events_path: Path) -> int:
+    """
+    Indexa las líneas escritas después del cursor. Retorna la cantidad de
+    claves agregadas. Corre en una transacción IMMEDIATE: dos procesos no
+    indexan las mismas líneas.
+    """
+    conn = _connect(keys_path(events_path))
+    try:
+        return _sync(conn, events_path)
+    finally:
+        conn.close()
+
+
+def _sync(conn: sqlite3.Connection, events_path: Path) -> int:
+    if (
+        _get_meta(conn, "schema_version") == str(SCHEMA_VERSION)
+        and _get_meta(conn, "cursor") is not None
+        and not storage.pending_files(events_path, _cursor(conn))
+    ):
+        return 0
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cursor = _cursor(conn)
+        if _get_meta(conn, "schema_version") != str(SCHEMA_VERSION) or not storage.cursor_is_valid(
+            events_path, cursor
+        ):
+            conn.execute("DELETE FROM keys")
+            conn.execute("DELETE FROM meta")
+            _set_meta(conn, "schema_version", str(SCHEMA_VERSION))
+            cursor = {}
+        added = 0
+        # Una reconstrucción sobre un log grande reparte los rangos entre workers
+        chunks = parallel.split(events_path, cursor=cursor)
+        for (key, _, end), rows in parallel.map_chunks(events_path, chunk_rows, chunks):
+            conn.executemany(
+                "INSERT INTO keys (name, value, file, offset, length) VALUES (?, ?, ?, ?, ?)", rows
+            )
+            added += len(rows)
+            cursor[key] = end
+        _set_meta(conn, "cursor", json.dumps(cursor))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return added
+
+
+@contextlib.contextmanager
+def opened(events_path: Path) -> Iterator[sqlite3.Connection]:
+    """Conexión al índice ya al día con el log."""
+    conn = _connect(keys_path(events_path))
+    try:
+        _sync(conn, events_path)
+        yield conn
+    finally:
+        conn.close()
+
+
+def rebuild(events_path: Path) -> int:
+    """Descarta el índice y lo reconstruye desde el log. Retorna la cantidad de claves."""
+    conn = _connect(keys_path(events_path))
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM keys")
+        conn.execute("DELETE FROM meta")
+        conn.execute("COMMIT")
+        return _sync(conn, events_path)
+    finally:
+        conn.close()
+
+
+def lookup(events_path: Path, name: str, value: str, newest_first: bool = False) -> list[Event]:
+    """
+    Eventos con `name == value`, en orden del log (o del más nuevo al más
+    viejo). Si una posición ya no corresponde a la línea (log reescrito sin
+    que el cursor lo detecte) el índice se reconstruye y se busca de nuevo.
+    """
+    if name not in KEYS:
+        raise ValueError(f"Clave no indexada: {name}")
+    for attempt in range(2):
+        with opened(events_path) as conn:
+            rows = conn.execute(
+                "SELECT file, offset, length FROM keys WHERE name = ? AND value = ?", (name, value)
+            ).fetchall()
+        order = {
+            storage.file_key(events_path, path): position
+            for position, path in enumerate(storage.log_files(events_path))
+        }
+        pointers = sorted(
+            (row for row in rows if row[0] in order), key=lambda row: (order[row[0]], row[1])
+        )
+        if newest_first:
+            pointers.reverse()
+        events = list(storage.events_at(events_path, pointers))
+        if len(events) == len(rows) == len(pointers) and all(key_value(event, name) == value for event in events):
+            return events
+        if attempt == 0:
+            rebuild(events_path)
+    return [event for event in events if key_value(event, name) == value]
+
+
+def is_enabled(events_path: Path) -> bool:
+    return bool(storage.load_config(events_path.parent).get("key_index"))
+
+
+def find_event(
+    events_path: Path,
+    name: str,
+    value: str,
+    types: Optional[Iterable[str]] = None,
+    newest_first: bool = False,
+) -> Optional[Event]:
+    """
+    Primer evento con `name == value` (el más nuevo con `newest_first`), o
+    None. Con el índice desactivado (`"key_index": false` en storage.json)
+    recorre el log filtrando por `types`.
+    """
+    if is_enabled(events_path):
+        events = lookup(events_path, name, value, newest_first)
+        return events[0] if events else None
+    return storage.first_event(
+        events_path,
+        types=tuple(types) if types else None,
+        newest_first=newest_first,
+        where=lambda event: key_value(event, name) == value,
+    )
+
+
+def status(events_path: Path) -> dict[str, int]:
+    """Cantidad de valores indexados por clave (al día con el log)."""
+    with opened(events_path) as conn:
+        counts = dict(conn.execute("SELECT name, COUNT(*) FROM keys GROUP BY name").fetchall())
+    return {name: counts.get(name, 0) for name in KEYS}
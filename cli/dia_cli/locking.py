@@ -0,0 +1,266 @@
+"""
+Lock entre procesos sobre el directorio index/.
+
+El CLI y el server (Django, con ./cli montado por Docker) escriben los mismos
+logs. Las escrituras (storage.append_event, EventWriter de storage) y las
+secuencias leer-modificar-escribir (asignar session_id, validar la sesión
+activa y registrar el evento, rotar, migrar) toman el lock de index/.lock.
+
+Usa fcntl.flock cuando está disponible; si no (Windows, filesystems sin
+soporte de locks) cae a un lockfile exclusivo (index/.lock.excl, O_EXCL)
+con el pid y el host de quien lo tiene. El lock es reentrante dentro del
+mismo hilo.
+
+El tiempo de espera se mide: STATS acumula las esperas del proceso y las
+que superan WAIT_LOG_MS se registran en index/locks.ndjson
+(ver `dia storage locks`).
+"""
+from __future__ import annotations
+
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+from .utils import now_iso
+
+LOCK_NAME = ".lock"
+FALLBACK_SUFFIX = ".excl"
+WAIT_LOG_NAME = "locks.ndjson"
+# Esperas a partir de este umbral se registran en locks.ndjson
+WAIT_LOG_MS = 50.0
+# Lockfile (fallback) sin renovar hace más que esto se considera abandonado;
+# quien lo tiene le actualiza el mtime cada HEARTBEAT_SECONDS
+STALE_SECONDS = 300.0
+HEARTBEAT_SECONDS = 30.0
+POLL_SECONDS = 0.01
+
+# Esperas de este proceso
+STATS: dict[str, Any] = {
+    "acquired": 0,
+    "contended": 0,
+    "wait_total_ms": 0.0,
+    "wait_max_ms": 0.0,
+}
+
+_held = threading.local()
+
+
+class LockTimeout(TimeoutError):
+    """No se pudo tomar el lock dentro del timeout."""
+
+
+def _fcntl():
+    """Retorna el módulo fcntl si existe (no disponible en Windows)."""
+    try:
+        import fcntl
+    except ImportError:
+        return None
+    return fcntl
+
+
+def lock_path(index_dir: Path) -> Path:
+    return index_dir / LOCK_NAME
+
+
+def wait_log_path(index_dir: Path) -> Path:
+    return index_dir / WAIT_LOG_NAME
+
+
+def _held_depths() -> dict[str, int]:
+    depths = getattr(_held, "depths", None)
+    if depths is None:
+        depths = _held.depths = {}
+    return depths
+
+
+def _acquire_flock(path: Path, timeout: Optional[float]) -> Optional[Callable[[], None]]:
+    """Toma flock sobre `path`. None si el filesystem no soporta locks."""
+    fcntl = _fcntl()
+    if fcntl is None:
+        return None
+    handle = path.open("a+b")
+    try:
+        if timeout is None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+        else:
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        raise LockTimeout(f"Timeout esperando el lock {path}")
+                    time.sleep(POLL_SECONDS)
+    except LockTimeout:
+        handle.close()
+        raise
+    except OSError:
+        # ENOLCK/EINVAL: el filesystem no soporta flock
+        handle.close()
+        return None
+
+    def release() -> None:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+        handle.close()
+
+    return release
+
+
+def _holder_is_gone(lockfile: Path) -> bool:
+    """
+    True si el lockfile es de un proceso de este host que ya no existe. Con
+    otro host (el server en Docker no comparte los pids) o sin poder
+    verificarlo, decide el mtime (ver `_is_abandoned`).
+    """
+    try:
+        pid_text, _, host = lockfile.read_text(encoding="ascii").strip().partition(" ")
+        pid = int(pid_text)
+    except (OSError, ValueError):
+        return False
+    # En Windows os.kill(pid, 0) termina el proceso: no se usa
+    if os.name != "posix" or host != socket.gethostname():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        return False
+    return False
+
+
+def _is_abandoned(lockfile: Path) -> bool:
+    """El dueño murió (mismo host) o no renueva el mtime hace STALE_SECONDS."""
+    return _holder_is_gone(lockfile) or time.time() - lockfile.stat().st_mtime > STALE_SECONDS
+
+
+def _heartbeat(lockfile: Path, stop: threading.Event) -> None:
+    """Renueva el mtime del lockfile mientras se tiene el lock."""
+    while not stop.wait(HEARTBEAT_SECONDS):
+        try:
+            os.utime(lockfile)
+        except OSError:
+            return
+
+
+def _acquire_lockfile(path: Path, timeout: Optional[float]) -> Callable[[], None]:
+    """
+    Fallback: lockfile creado con O_EXCL con "<pid> <host>"; se reclama solo
+    si quedó abandonado (ver `_is_abandoned`), no por tener el lock mucho
+    tiempo.
+    """
+    lockfile = path.with_name(path.name + FALLBACK_SUFFIX)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(lockfile, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            break
+        except FileExistsError:
+            try:
+                if _is_abandoned(lockfile):
+                    lockfile.unlink()
+                    continue
+            except FileNotFoundError:
+                continue
+            if deadline is not None and time.monotonic() >= deadline:
+                raise LockTimeout(f"Timeout esperando el lock {lockfile}")
+            time.sleep(POLL_SECONDS)
+    os.write(fd, f"{os.getpid()} {socket.gethostname()}\n".encode("ascii", errors="replace"))
+    os.close(fd)
+    stop = threading.Event()
+    threading.Thread(target=_heartbeat, args=(lockfile, stop), daemon=True).start()
+
+    def release() -> None:
+        stop.set()
+        try:
+            lockfile.unlink()
+        except FileNotFoundError:
+            pass
+
+    return release
+
+
+def _record_wait(index_dir: Path, waited_ms: float, label: str) -> None:
+    STATS["acquired"] += 1
+    STATS["wait_total_ms"] += waited_ms
+    STATS["wait_max_ms"] = max(STATS["wait_max_ms"], waited_ms)
+    if waited_ms < WAIT_LOG_MS:
+        return
+    STATS["contended"] += 1
+    record = {
+        "ts": now_iso(),
+        "pid": os.getpid(),
+        "label": label,
+        "wait_ms": round(waited_ms, 1),
+    }
+    # Se escribe con el lock tomado: no se intercala con otros procesos
+    with wait_log_path(index_dir).open("a", encoding="utf-8") as handle:
+        handle.write(json.dumps(record, ensure_ascii=True) + "\n")
+
+
+@contextmanager
+def locked(index_dir: Path, label: str = "", timeout: Optional[float] = None) -> Iterator[float]:
+    """
+    Toma el lock exclusivo del directorio index/ durante el bloque `with`.
+    Retorna (yield) los milisegundos esperados. `label` identifica la
+    operación en locks.ndjson. Reentrante dentro del mismo hilo.
+    """
+    key = os.path.abspath(index_dir)
+    depths = _held_depths()
+    if depths.get(key):
+        depths[key] += 1
+        try:
+            yield 0.0
+        finally:
+            depths[key] -= 1
+        return
+
+    index_dir.mkdir(parents=True, exist_ok=True)
+    path = lock_path(index_dir)
+    started = time.monotonic()
+    release = _acquire_flock(path, timeout) or _acquire_lockfile(path, timeout)
+    waited_ms = (time.monotonic() - started) * 1000
+    depths[key] = 1
+    try:
+        _record_wait(index_dir, waited_ms, label)
+        yield waited_ms
+    finally:
+        depths.pop(key, None)
+        release()
+
+
+def wait_stats(index_dir: Path) -> dict[str, Any]:
+    """Resumen de locks.ndjson: cantidad, p50/p95/max de espera y conteo por label."""
+    waits: list[float] = []
+    labels: dict[str, int] = {}
+    path = wait_log_path(index_dir)
+    if path.exists():
+        with path.open("r", encoding="utf-8") as handle:
+            for line in handle:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                waits.append(float(record.get("wait_ms", 0.0)))
+                label = record.get("label") or "-"
+                labels[label] = labels.get(label, 0) + 1
+    waits.sort()
+
+    def percentile(fraction: float) -> float:
+        if not waits:
+            return 0.0
+        return waits[min(len(waits) - 1, int(len(waits) * fraction))]
+
+    return {
+        "count": len(waits),
+        "p50_ms": percentile(0.5),
+        "p95_ms": percentile(0.95),
+        "max_ms": waits[-1] if waits else 0.0,
+        "labels": labels,
+    }
@@ -9,7 +9,7 @@ from pathlib import Path
 import subprocess
 from typing import Any, Optional
 
-from . import config
+from . import config, error_lifecycle, key_index, projections, sqlite_mirror, storage
 from .config import captures_dir
 from .cursor_reminder import write_reminder_to_file
 from .git_ops import (
@@ -26,24 +26,35 @@ from .git_ops import (
     status_porcelain,
     tracked_files_count,
 )
-from .ndjson import append_line
+from .storage import append_event, event_writer, iter_events, read_events
 from .rules import load_rules, load_repo_structure_rules
-from .sessions import active_session, current_session, next_session_id
+from .sessions import (
+    OPEN_STATUSES,
+    active_session,
+    current_session,
+    is_day_closed,
+    list_sessions,
+    next_session_id,
+    open_sessions,
+    session_is_paused,
+)
 from .templates import cierre_template, limpieza_template, session_start_template
 from .utils import (
     compute_content_hash,
     day_id,
     find_last_unfixed_capture,
+    new_event_id,
     now_iso,
-    read_json_lines,
+    parse_ts,
     read_text,
+    ts_day,
     write_text,
 )
 from .llm_analyzer import analyze_error_with_llm
 
 
 def _event_id() -> str:
-    return f"evt_{uuid.uuid4().hex}"
+    return new_event_id()
 
 
 def _build_event(
@@ -110,10 +121,6 @@ def _events_path(root: Path) -> Path:
     return config.index_dir(root) / "events.ndjson"
 
 
-def _sessions_path(root: Path) -> Path:
-    return config.index_dir(root) / "sessions.ndjson"
-
-
 def _write_bitacora_start(
     root: Path,
     day: str,
@@ -219,40 +226,26 @@ def cmd_session_close(args: argparse.Namespace) -> int:
     root = config.data_root(args.data_root)
     config.ensure_data_dirs(root)
     events_path = _events_path(root)
-    sessions_path = _sessions_path(root)
     
     session_id = args.session_id
     if not session_id:
         print("Error: --id requerido", file=sys.stderr)
         return 1
     
-    # Buscar sesión por ID en eventos
-    events = list(read_json_lines(events_path))
-    session_started = None
-    session_ended = False
-    
-    for event in events:
-        event_type = event.get("type")
-        event_session_id = event.get("session", {}).get("session_id")
-        
-        if event_session_id == session_id:
-            if event_type in ("SessionStarted", "SessionStartedAfterDayClosed"):
-                session_started = event
-            elif event_type == "SessionEnded":
-                session_ended = True
-                break
-    
-    if not session_started:
+    # Buscar la sesión por ID en la proyección de sesiones (la abierta más reciente)
+    matches = [item for item in list_sessions(events_path) if item["session_id"] == session_id]
+    if not matches:
         print(f"Error: Sesión {session_id} no encontrada.", file=sys.stderr)
         return 1
     
-    if session_ended:
+    session_started = next((item for item in matches if item["status"] in OPEN_STATUSES), None)
+    if session_started is None:
         print(f"Sesión {session_id} ya está cerrada.", file=sys.stderr)
         return 0
     
     # Crear evento SessionForceClosed
     session = {
-        "day_id": session_started["session"]["day_id"],
+        "day_id": session_started["day_id"],
         "session_id": session_id,
         "result": "forced_close",
     }
@@ -284,9 +277,9 @@ def cmd_session_close(args: argparse.Namespace) -> int:
         },
     )
     
-    append_line(events_path, close_event)
-    append_line(events_path, end_event)
-    append_line(sessions_path, end_event)
+    with event_writer(events_path) as writer:
+        append_event(events_path, close_event, writer=writer)
+        append_event(events_path, end_event, writer=writer)
     
     # Actualizar bitácora
     jornada_path = config.bitacora_dir(root) / f"{session['day_id']}.md"
@@ -324,69 +317,76 @@ def cmd_start(args: argparse.Namespace) -> int:
 
     root = config.data_root(args.data_root, repo_path=repo_path)
     config.ensure_data_dirs(root)
-    sessions_path = _sessions_path(root)
     events_path = _events_path(root)
 
-    # Validar que no haya sesión activa (no paused) para este repositorio
-    active = active_session(events_path, repo_path=str(repo_path))
-    if active:
-        session_id_active = active.get("session", {}).get("session_id", "N/A")
-        active_repo = active.get("repo", {}).get("path", "N/A")
-        print(f"Error: Ya hay una sesión activa: {session_id_active}", file=sys.stderr)
-        print(f"  Repositorio: {active_repo}", file=sys.stderr)
-        print("Sugerencia: Ejecuta 'dia end' para cerrar la sesión activa o 'dia pause' para pausarla.", file=sys.stderr)
-        return 1
-
-    # Verificar si el día está cerrado
-    current_day = day_id()
-    events = list(read_json_lines(events_path))
-    day_events = [e for e in events if e.get("session", {}).get("day_id") == current_day]
-    day_closed = any(e.get("type") == "DayClosed" for e in day_events)
-
-    session_id = next_session_id(current_day, sessions_path)
-    actor = _actor_from_args(args)
-    project = _project_from_args(args)
-
+    # Estado del repo y diff antes del lock: son subprocesos de git y una
+    # escritura sin tope que no deben frenar a los demás escritores
     branch = current_branch(repo_path)
     start_sha = head_sha(repo_path)
-    if start_sha is None:
-        print("Repo sin commits. Continuando en modo inicial.")
     repo_state = _repo_payload(repo_path, branch, start_sha)
+    baseline_payload = {
+        "status_porcelain": status_porcelain(repo_path),
+        "tracked_files": tracked_files_count(repo_path),
+    }
+    pending_diff = None
+    if repo_state["dirty"]:
+        # Nombre provisorio: el session_id se asigna con el lock tomado
+        pending_diff = _write_artifact(root, f".repo_diff_start.{uuid.uuid4().hex}.tmp", diff(repo_path))
+
+    # Validación, asignación de session_id y escritura con el lock de index/
+    # tomado: otro `dia start` (o el server) no puede asignar el mismo ID
+    with storage.locked(events_path, "start"):
+        # Validar que no haya sesión activa (no paused) para este repositorio
+        active = active_session(events_path, repo_path=str(repo_path))
+        if active:
+            if pending_diff:
+                pending_diff.unlink(missing_ok=True)
+            session_id_active = active.get("session", {}).get("session_id", "N/A")
+            active_repo = active.get("repo", {}).get("path", "N/A")
+            print(f"Error: Ya hay una sesión activa: {session_id_active}", file=sys.stderr)
+            print(f"  Repositorio: {active_repo}", file=sys.stderr)
+            print("Sugerencia: Ejecuta 'dia end' para cerrar la sesión activa o 'dia pause' para pausarla.", file=sys.stderr)
+            return 1
+
+        # Verificar si el día está cerrado
+        current_day = day_id()
+        day_closed = is_day_closed(events_path, current_day)
 
-    session = _session_payload(args, session_id)
+        session_id = next_session_id(current_day, events_path)
+        actor = _actor_from_args(args)
+        project = _project_from_args(args)
+
+        if start_sha is None:
+            print("Repo sin commits. Continuando en modo inicial.")
+
+        session = _session_payload(args, session_id)
     
-    # Determinar tipo de evento según si el día está cerrado
-    event_type = "SessionStartedAfterDayClosed" if day_closed else "SessionStarted"
+        # Determinar tipo de evento según si el día está cerrado
+        event_type = "SessionStartedAfterDayClosed" if day_closed else "SessionStarted"
     
-    start_event = _build_event(
-        event_type,
-        session=session,
-        actor=actor,
-        project=project,
-        repo=repo_state,
-        payload={"cmd": "dia start", "day_was_closed": day_closed},
-    )
-    baseline_event = _build_event(
-        "RepoBaselineCaptured",
-        session={"day_id": session["day_id"], "session_id": session_id},
-        actor=actor,
-        project=project,
-        repo=repo_state,
-        payload={
-            "status_porcelain": status_porcelain(repo_path),
-            "tracked_files": tracked_files_count(repo_path),
-        },
-    )
-    if repo_state["dirty"]:
-        diff_output = diff(repo_path)
-        artifact = _write_artifact(
-            root, f"{session_id}_repo_diff_start.patch", diff_output
+        start_event = _build_event(
+            event_type,
+            session=session,
+            actor=actor,
+            project=project,
+            repo=repo_state,
+            payload={"cmd": "dia start", "day_was_closed": day_closed},
+        )
+        baseline_event = _build_event(
+            "RepoBaselineCaptured",
+            session={"day_id": session["day_id"], "session_id": session_id},
+            actor=actor,
+            project=project,
+            repo=repo_state,
+            payload=baseline_payload,
         )
-        baseline_event["links"].append({"kind": "artifact", "ref": str(artifact)})
+        if pending_diff:
+            artifact = pending_diff.rename(pending_diff.with_name(f"{session_id}_repo_diff_start.patch"))
+            baseline_event["links"].append({"kind": "artifact", "ref": str(artifact)})
 
-    append_line(events_path, start_event)
-    append_line(events_path, baseline_event)
-    append_line(sessions_path, start_event)
+        with event_writer(events_path) as writer:
+            append_event(events_path, start_event, writer=writer)
+            append_event(events_path, baseline_event, writer=writer)
 
     bitacora_path = _write_bitacora_start(
         root,
@@ -455,12 +455,12 @@ def cmd_pre_feat(args: argparse.Namespace) -> int:
     
     if active_error:
         # Hay un error activo, sugerir mensaje de fix
-        error_hash = active_error.get("payload", {}).get("error_hash", "")[:8]
-        error_title = active_error.get("payload", {}).get("title", "error")
+        error_hash = active_error["error_hash"][:8]
+        error_title = active_error["title"] or "error"
         message = f'🦾 fix: {error_title} [dia] [#sesion {session_id}] [#error {error_hash}]'
         error_ref = {
-            "error_event_id": active_error.get("event_id"),
-            "error_hash": active_error.get("payload", {}).get("error_hash"),
+            "error_event_id": active_error["event_id"],
+            "error_hash": active_error["error_hash"],
         }
     else:
         # Mensaje normal
@@ -488,7 +488,7 @@ def cmd_pre_feat(args: argparse.Namespace) -> int:
         repo=_repo_payload(repo_path, current_branch(repo_path), start_sha),
         payload=payload,
     )
-    append_line(events_path, event)
+    append_event(events_path, event)
 
     print(command)
     return 0
@@ -499,7 +499,6 @@ def cmd_end(args: argparse.Namespace) -> int:
     root = config.data_root(args.data_root, repo_path=repo_path)
     config.ensure_data_dirs(root)
     events_path = _events_path(root)
-    sessions_path = _sessions_path(root)
 
     current = current_session(events_path, repo_path=str(repo_path))
     if not current:
@@ -563,10 +562,16 @@ def cmd_end(args: argparse.Namespace) -> int:
             "duration_min": None,
         },
     )
-    append_line(events_path, diff_event)
-    append_line(events_path, cleanup_event)
-    append_line(events_path, end_event)
-    append_line(sessions_path, end_event)
+    with storage.locked(events_path, "end"):
+        # El diff puede tardar: revalidar con el lock que la sesión siga abierta
+        still_open = current_session(events_path, repo_path=str(repo_path))
+        if not still_open or still_open.get("session") != current.get("session"):
+            print("La sesion fue cerrada por otro proceso.", file=sys.stderr)
+            return 1
+        with event_writer(events_path) as writer:
+            append_event(events_path, diff_event, writer=writer)
+            append_event(events_path, cleanup_event, writer=writer)
+            append_event(events_path, end_event, writer=writer)
 
     # Actualizar bitácora de jornada con cierre de sesión
     jornada_path = config.bitacora_dir(root) / f"{session['day_id']}.md"
@@ -619,38 +624,37 @@ def cmd_pause(args: argparse.Namespace) -> int:
     root = config.data_root(args.data_root, repo_path=repo_path)
     config.ensure_data_dirs(root)
     events_path = _events_path(root)
-    sessions_path = _sessions_path(root)
 
-    current = current_session(events_path, repo_path=str(repo_path))
-    if not current:
-        print("No hay sesion activa o pausada para este repo.", file=sys.stderr)
-        return 1
+    with storage.locked(events_path, "pause"):
+        current = current_session(events_path, repo_path=str(repo_path))
+        if not current:
+            print("No hay sesion activa o pausada para este repo.", file=sys.stderr)
+            return 1
 
-    # Verificar que la sesión esté activa (no paused)
-    active = active_session(events_path, repo_path=str(repo_path))
-    if not active:
-        print("La sesión actual ya está pausada.", file=sys.stderr)
-        return 1
+        # Verificar que la sesión esté activa (no paused)
+        active = active_session(events_path, repo_path=str(repo_path))
+        if not active:
+            print("La sesión actual ya está pausada.", file=sys.stderr)
+            return 1
 
-    session_id = current["session"]["session_id"]
-    session = {
-        "day_id": current["session"]["day_id"],
-        "session_id": session_id,
-    }
+        session_id = current["session"]["session_id"]
+        session = {
+            "day_id": current["session"]["day_id"],
+            "session_id": session_id,
+        }
 
-    pause_event = _build_event(
-        "SessionPaused",
-        session=session,
-        actor=_actor_from_args(args),
-        project=_project_from_args(args),
-        repo=None,
-        payload={
-            "cmd": "dia pause",
-            "reason": args.reason or None,
-        },
-    )
-    append_line(events_path, pause_event)
-    append_line(sessions_path, pause_event)
+        pause_event = _build_event(
+            "SessionPaused",
+            session=session,
+            actor=_actor_from_args(args),
+            project=_project_from_args(args),
+            repo=None,
+            payload={
+                "cmd": "dia pause",
+                "reason": args.reason or None,
+            },
+        )
+        append_event(events_path, pause_event)
 
     # Actualizar bitácora
     jornada_path = config.bitacora_dir(root) / f"{session['day_id']}.md"
@@ -669,37 +673,36 @@ def cmd_resume(args: argparse.Namespace) -> int:
     root = config.data_root(args.data_root, repo_path=repo_path)
     config.ensure_data_dirs(root)
     events_path = _events_path(root)
-    sessions_path = _sessions_path(root)
 
-    current = current_session(events_path, repo_path=str(repo_path))
-    if not current:
-        print("No hay sesion activa o pausada para este repo.", file=sys.stderr)
-        return 1
+    with storage.locked(events_path, "resume"):
+        current = current_session(events_path, repo_path=str(repo_path))
+        if not current:
+            print("No hay sesion activa o pausada para este repo.", file=sys.stderr)
+            return 1
 
-    # Verificar que la sesión esté paused (no activa)
-    active = active_session(events_path, repo_path=str(repo_path))
-    if active:
-        print("La sesión actual ya está activa (no está pausada).", file=sys.stderr)
-        return 1
+        # Verificar que la sesión esté paused (no activa)
+        active = active_session(events_path, repo_path=str(repo_path))
+        if active:
+            print("La sesión actual ya está activa (no está pausada).", file=sys.stderr)
+            return 1
 
-    session_id = current["session"]["session_id"]
-    session = {
-        "day_id": current["session"]["day_id"],
-        "session_id": session_id,
-    }
+        session_id = current["session"]["session_id"]
+        session = {
+            "day_id": current["session"]["day_id"],
+            "session_id": session_id,
+        }
 
-    resume_event = _build_event(
-        "SessionResumed",
-        session=session,
-        actor=_actor_from_args(args),
-        project=_project_from_args(args),
-        repo=None,
-        payload={
-            "cmd": "dia resume",
-        },
-    )
-    append_line(events_path, resume_event)
-    append_line(sessions_path, resume_event)
+        resume_event = _build_event(
+            "SessionResumed",
+            session=session,
+            actor=_actor_from_args(args),
+            project=_project_from_args(args),
+            repo=None,
+            payload={
+                "cmd": "dia resume",
+            },
+        )
+        append_event(events_path, resume_event)
 
     # Actualizar bitácora
     jornada_path = config.bitacora_dir(root) / f"{session['day_id']}.md"
@@ -712,74 +715,43 @@ def cmd_resume(args: argparse.Namespace) -> int:
 
 
 def cmd_day_status(args: argparse.Namespace) -> int:
-    """Muestra el estado del día actual."""
+    """Muestra el estado del día actual (o de un momento pasado con --at)."""
     root = config.data_root(args.data_root)
     config.ensure_data_dirs(root)
     events_path = _events_path(root)
-    day = day_id()
-    
-    # Leer eventos del día
-    events = list(read_json_lines(events_path))
-    day_events = [e for e in events if e.get("session", {}).get("day_id") == day]
+    at = None
+    if args.at:
+        try:
+            at = parse_ts(args.at)
+        except ValueError:
+            print(f"Error: --at debe ser un timestamp ISO 8601 (ej: 2026-10-17T15:30): {args.at}", file=sys.stderr)
+            return 1
+    day = ts_day(at) if at else day_id()
     
-    # Verificar si está cerrado
-    day_closed = any(e.get("type") == "DayClosed" for e in day_events)
+    # Estado de sesiones desde el checkpoint (solo aplica eventos nuevos);
+    # con --at, desde el snapshot as-of anterior a ese momento
+    day_closed = is_day_closed(events_path, day, at=at)
     
     # Buscar sesiones activas/pausadas
     active_sessions = []
     paused_sessions = []
     
-    sessions: dict[str, dict[str, Any]] = {}
-    for event in day_events:
-        event_type = event.get("type")
-        if event_type in ("SessionStarted", "SessionStartedAfterDayClosed"):
-            session_id = event["session"]["session_id"]
-            sessions[session_id] = {
-                "started": event,
-                "ended": None,
-                "paused": None,
-                "resumed": None,
-            }
-        if event_type == "SessionEnded":
-            session_id = event["session"]["session_id"]
-            if session_id in sessions:
-                sessions[session_id]["ended"] = event
-        if event_type == "SessionPaused":
-            session_id = event["session"]["session_id"]
-            if session_id in sessions:
-                sessions[session_id]["paused"] = event
-        if event_type == "SessionResumed":
-            session_id = event["session"]["session_id"]
-            if session_id in sessions:
-                sessions[session_id]["resumed"] = event
-    
-    for session_id, entry in sessions.items():
-        if entry["ended"] is None:  # Sesión no terminada
-            # Verificar si está paused
-            is_paused = False
-            if entry["paused"]:
-                if not entry["resumed"]:
-                    is_paused = True
-                else:
-                    paused_ts = entry["paused"].get("ts", "")
-                    resumed_ts = entry["resumed"].get("ts", "")
-                    if paused_ts > resumed_ts:
-                        is_paused = True
-            
-            session_info = {
-                "session_id": session_id,
-                "start_ts": entry["started"].get("ts"),
-                "repo": entry["started"].get("repo", {}).get("path", "N/A"),
-                "intent": entry["started"].get("session", {}).get("intent", ""),
-            }
-            
-            if is_paused:
-                paused_sessions.append(session_info)
-            else:
-                active_sessions.append(session_info)
+    for entry in open_sessions(events_path, day_id=day, at=at):
+        started = entry["started"]
+        session_info = {
+            "session_id": started["session"]["session_id"],
+            "start_ts": started.get("ts"),
+            "repo": (started.get("repo") or {}).get("path", "N/A"),
+            "intent": started.get("session", {}).get("intent", ""),
+        }
+        
+        if session_is_paused(entry):
+            paused_sessions.append(session_info)
+        else:
+            active_sessions.append(session_info)
     
     # Mostrar estado
-    print(f"Día: {day}")
+    print(f"Día: {day}" + (f" (estado al {at})" if at else ""))
     print(f"Estado: {'Cerrado' if day_closed else 'Abierto'}")
     print(f"\nSesiones activas: {len(active_sessions)}")
     for s in active_sessions:
@@ -807,38 +779,22 @@ def cmd_day_close(args: argparse.Namespace) -> int:
     day = day_id()
     
     # Verificar si ya está cerrado
-    events = list(read_json_lines(events_path))
-    day_events = [e for e in events if e.get("session", {}).get("day_id") == day]
-    already_closed = any(e.get("type") == "DayClosed" for e in day_events)
+    already_closed = is_day_closed(events_path, day)
     
     if already_closed:
         print(f"Jornada {day} ya está cerrada.", file=sys.stderr)
         return 1
     
     # Validar que no haya sesiones activas o pausadas (incluyendo huérfanas)
-    events = list(read_json_lines(events_path))
-    ended_sessions: set[str] = set()
     orphan_sessions: list[dict[str, Any]] = []
-    
-    # Identificar sesiones cerradas
-    for event in events:
-        if event.get("type") in ("SessionEnded", "SessionForceClosed"):
-            session_id = event.get("session", {}).get("session_id")
-            if session_id:
-                ended_sessions.add(session_id)
-    
-    # Buscar sesiones huérfanas (started sin ended)
-    for event in events:
-        event_type = event.get("type")
-        if event_type in ("SessionStarted", "SessionStartedAfterDayClosed"):
-            session_id = event.get("session", {}).get("session_id")
-            if session_id and session_id not in ended_sessions:
-                orphan_sessions.append({
-                    "session_id": session_id,
-                    "day_id": event.get("session", {}).get("day_id"),
-                    "start_ts": event.get("ts"),
-                    "repo": event.get("repo", {}).get("path", "N/A"),
-                })
+    for entry in open_sessions(events_path):
+        started = entry["started"]
+        orphan_sessions.append({
+            "session_id": started.get("session", {}).get("session_id"),
+            "day_id": started.get("session", {}).get("day_id"),
+            "start_ts": started.get("ts"),
+            "repo": (started.get("repo") or {}).get("path", "N/A"),
+        })
     
     if orphan_sessions:
         print(f"Error: No puedo cerrar el día: hay {len(orphan_sessions)} sesión(es) sin cerrar:", file=sys.stderr)
@@ -879,7 +835,7 @@ def cmd_day_close(args: argparse.Namespace) -> int:
         payload={"closed_at": now_iso()},
     )
     
-    append_line(events_path, close_event)
+    append_event(events_path, close_event)
     
     # Opcionalmente agregar marca a bitácora
     jornada_path = config.bitacora_dir(root) / f"{day}.md"
@@ -914,9 +870,8 @@ def cmd_summary_rolling(args: argparse.Namespace) -> int:
         print("Error: No hay sesión activa. Rolling summary requiere sesión activa.", file=sys.stderr)
         return 1
     
-    # Leer eventos del día
-    events = list(read_json_lines(events_path))
-    day_events = [e for e in events if e.get("session", {}).get("day_id") == day_id_val]
+    # Leer eventos del día (en layout daily solo se abre el archivo del día)
+    day_events = read_events(events_path, day_id=day_id_val)
     
     if not day_events:
         print(f"No hay eventos registrados para {day_id_val}.", file=sys.stderr)
@@ -926,9 +881,6 @@ def cmd_summary_rolling(args: argparse.Namespace) -> int:
     jornada_path = config.bitacora_dir(root) / f"{day_id_val}.md"
     objective = extract_objective(jornada_path)
     
-    # Ruta del índice de resúmenes (summaries.ndjson)
-    summaries_path = config.index_dir(root) / "summaries.ndjson"
-    
     # Generar resumen
     summary_data = generate_summary(
         root=root,
@@ -936,7 +888,7 @@ def cmd_summary_rolling(args: argparse.Namespace) -> int:
         mode="rolling",
         events=day_events,
         objective=objective,
-        summaries_path=summaries_path,
+        events_path=events_path,
     )
     
     # Construir evento completo
@@ -950,9 +902,7 @@ def cmd_summary_rolling(args: argparse.Namespace) -> int:
         links=summary_data["links"],
     )
     
-    # Guardar en índice y events
-    append_line(summaries_path, event)
-    append_line(events_path, event)
+    append_event(events_path, event)
     
     print(f"Resumen rolling generado para {day_id_val}")
     print(f"Assessment: {summary_data['payload']['assessment']}")
@@ -976,9 +926,8 @@ def cmd_summary_nightly(args: argparse.Namespace) -> int:
     # Determinar día
     day_id_val = args.day_id if args.day_id else day_id()
     
-    # Leer eventos del día
-    events = list(read_json_lines(events_path))
-    day_events = [e for e in events if e.get("session", {}).get("day_id") == day_id_val]
+    # Leer eventos del día (en layout daily solo se abre el archivo del día)
+    day_events = read_events(events_path, day_id=day_id_val)
     
     if not day_events:
         print(f"No hay eventos registrados para {day_id_val}.", file=sys.stderr)
@@ -997,9 +946,6 @@ def cmd_summary_nightly(args: argparse.Namespace) -> int:
     jornada_path = config.bitacora_dir(root) / f"{day_id_val}.md"
     objective = extract_objective(jornada_path)
     
-    # Ruta del índice de resúmenes (summaries.ndjson)
-    summaries_path = config.index_dir(root) / "summaries.ndjson"
-    
     # Generar resumen
     summary_data = generate_summary(
         root=root,
@@ -1007,7 +953,7 @@ def cmd_summary_nightly(args: argparse.Namespace) -> int:
         mode="nightly",
         events=day_events,
         objective=objective,
-        summaries_path=summaries_path,
+        events_path=events_path,
     )
     
     # Construir evento completo
@@ -1021,9 +967,7 @@ def cmd_summary_nightly(args: argparse.Namespace) -> int:
         links=summary_data["links"],
     )
     
-    # Guardar en índice y events
-    append_line(summaries_path, event)
-    append_line(events_path, event)
+    append_event(events_path, event)
     
     print(f"Resumen nightly generado para {day_id_val}")
     print(f"Assessment: {summary_data['payload']['assessment']}")
@@ -1100,28 +1044,27 @@ def cmd_cap(args: argparse.Namespace) -> int:
     # Calcular hash
     error_hash = compute_content_hash(content)
 
-    # Verificar si ya existe este error y buscar errores similares
-    events = list(read_json_lines(events_path))
-    existing_capture = None
+    # Verificar si ya existe este error (índice por error_hash) y, si es
+    # nuevo, buscar errores similares
+    existing_capture = key_index.find_event(
+        events_path, "error_hash", error_hash, types=("CaptureCreated",), newest_first=True
+    )
     similar_errors = []
     
-    for event in events:
-        if event.get("type") == "CaptureCreated":
-            event_hash = event.get("payload", {}).get("error_hash")
-            if event_hash == error_hash:
-                existing_capture = event
-            elif event_hash:
-                # Buscar errores similares (mismo título o palabras clave)
-                event_title = event.get("payload", {}).get("title", "").lower()
-                current_title_lower = (title or "").lower()
-                # Si comparten palabras clave importantes
-                if event_title and current_title_lower:
-                    event_words = set(event_title.split())
-                    current_words = set(current_title_lower.split())
-                    common_words = event_words.intersection(current_words)
-                    # Si comparten al menos 2 palabras significativas
-                    if len(common_words) >= 2:
-                        similar_errors.append(event)
+    for event in iter_events(events_path, types=("CaptureCreated",)) if not existing_capture else ():
+        event_hash = event.get("payload", {}).get("error_hash")
+        if event_hash and event_hash != error_hash:
+            # Buscar errores similares (mismo título o palabras clave)
+            event_title = event.get("payload", {}).get("title", "").lower()
+            current_title_lower = (title or "").lower()
+            # Si comparten palabras clave importantes
+            if event_title and current_title_lower:
+                event_words = set(event_title.split())
+                current_words = set(current_title_lower.split())
+                common_words = event_words.intersection(current_words)
+                # Si comparten al menos 2 palabras significativas
+                if len(common_words) >= 2:
+                    similar_errors.append(event)
 
     # Obtener estado del repo
     branch = current_branch(repo_path)
@@ -1203,7 +1146,7 @@ def cmd_cap(args: argparse.Namespace) -> int:
             links=[{"kind": "artifact", "ref": artifact_ref}],
         )
 
-    append_line(events_path, event)
+    append_event(events_path, event)
 
     # Mostrar resultado
     if existing_capture:
@@ -1211,16 +1154,15 @@ def cmd_cap(args: argparse.Namespace) -> int:
         print(f"   Original: {existing_capture.get('ts', 'N/A')} - {existing_capture.get('payload', {}).get('title', 'Sin título')}")
         print(f"   Sesión original: {existing_capture.get('session', {}).get('session_id', 'N/A')}")
         
-        # Verificar si el error original tiene fix
-        original_event_id = existing_capture.get("event_id")
-        has_fix = any(
-            e.get("type") == "FixLinked" 
-            and e.get("payload", {}).get("error_event_id") == original_event_id
-            for e in events
-        )
+        # Verificar si el error original tiene fix (proyección "errors")
+        original = error_lifecycle.get_capture(events_path, existing_capture.get("event_id"))
+        if original:
+            print(f"   Recurrencias: {original['recurrences']}")
         
-        if has_fix:
-            print(f"   ℹ️  Este error ya fue resuelto anteriormente")
+        if original and original["state"] != "open":
+            print(f"   ℹ️  Este error ya fue resuelto anteriormente (fix {original['fix_id']})")
+            if original["commit_sha"]:
+                print(f"   Commit: {original['commit_sha']}")
         else:
             print(f"   ⚠️  Este error aún no tiene fix asociado")
             print(f"   💡 Sugerencia: Revisa el fix anterior o aplica uno nuevo con 'dia fix'")
@@ -1267,14 +1209,18 @@ def cmd_fix(args: argparse.Namespace) -> int:
     # Buscar último error sin fix
     if args.from_capture:
         # Buscar por capture_id específico
-        events = list(read_json_lines(events_path))
-        target_capture = None
-        for event in events:
-            if event.get("type") == "CaptureCreated":
-                artifact_ref = event.get("payload", {}).get("artifact_ref", "")
-                if args.from_capture in artifact_ref:
-                    target_capture = event
-                    break
+        # Casi siempre es el capture_id completo: búsqueda exacta por índice
+        # antes de recorrer las capturas por fragmento del artifact_ref
+        capture_event = key_index.find_event(
+            events_path, "capture_id", args.from_capture, types=("CaptureCreated",)
+        ) or storage.first_event(
+            events_path,
+            types=("CaptureCreated",),
+            where=lambda e: args.from_capture in e.get("payload", {}).get("artifact_ref", ""),
+        )
+        target_capture = (
+            error_lifecycle.get_capture(events_path, capture_event.get("event_id")) if capture_event else None
+        )
         if not target_capture:
             print(f"Capture {args.from_capture} no encontrado.", file=sys.stderr)
             return 1
@@ -1299,8 +1245,8 @@ def cmd_fix(args: argparse.Namespace) -> int:
     repo_state = _repo_payload(repo_path, branch, None)
     repo_state["end_sha"] = fix_sha
 
-    error_hash = target_capture.get("payload", {}).get("error_hash")
-    error_event_id = target_capture.get("event_id")
+    error_hash = target_capture["error_hash"]
+    error_event_id = target_capture["event_id"]
 
     # Generar fix_id único para referenciar este fix posteriormente
     fix_id = f"fix_{uuid.uuid4().hex[:12]}"
@@ -1320,7 +1266,7 @@ def cmd_fix(args: argparse.Namespace) -> int:
         },
     )
 
-    append_line(events_path, fix_event)
+    append_event(events_path, fix_event)
 
     print(f"Fix linkeado a error: {error_hash[:8]}...")
     print(f"Fix ID: {fix_id}")
@@ -1360,15 +1306,8 @@ def cmd_fix_commit(args: argparse.Namespace) -> int:
         print("Error: se requiere --commit <sha> o --last", file=sys.stderr)
         return 1
 
-    # Buscar el FixLinked por fix_id
-    events = list(read_json_lines(events_path))
-    fix_linked = None
-    for event in events:
-        if event.get("type") == "FixLinked":
-            payload = event.get("payload", {})
-            if payload.get("fix_id") == args.fix_id:
-                fix_linked = event
-                break
+    # Buscar el FixLinked por fix_id (proyección "errors", incluye su commit)
+    fix_linked = error_lifecycle.get_fix(events_path, args.fix_id)
 
     if not fix_linked:
         print(f"Fix {args.fix_id} no encontrado.", file=sys.stderr)
@@ -1381,7 +1320,7 @@ def cmd_fix_commit(args: argparse.Namespace) -> int:
         day_id_val = current["session"]["day_id"]
     else:
         # Usar sesión del FixLinked
-        fix_session = fix_linked.get("session", {})
+        fix_session = fix_linked["session"]
         session_id = fix_session.get("session_id")
         day_id_val = fix_session.get("day_id")
         if not session_id or not day_id_val:
@@ -1389,21 +1328,9 @@ def cmd_fix_commit(args: argparse.Namespace) -> int:
             return 1
 
     # Verificar que no esté ya linkeado
-    fix_event_id = fix_linked.get("event_id")
-    already_committed = any(
-        e.get("type") == "FixCommitted"
-        and e.get("payload", {}).get("fix_event_id") == fix_event_id
-        for e in events
-    )
-
-    if already_committed:
-        existing = next(
-            e for e in events
-            if e.get("type") == "FixCommitted"
-            and e.get("payload", {}).get("fix_event_id") == fix_event_id
-        )
-        existing_sha = existing.get("payload", {}).get("commit_sha")
-        print(f"Fix {args.fix_id} ya está linkeado al commit {existing_sha}")
+    fix_event_id = fix_linked["event_id"]
+    if fix_linked["commit_event_id"]:
+        print(f"Fix {args.fix_id} ya está linkeado al commit {fix_linked['commit_sha']}")
         return 0
 
     # Construir evento FixCommitted
@@ -1425,14 +1352,14 @@ def cmd_fix_commit(args: argparse.Namespace) -> int:
             "fix_event_id": fix_event_id,
             "fix_id": args.fix_id,
             "commit_sha": commit_sha,
-            "error_event_id": fix_linked.get("payload", {}).get("error_event_id"),
+            "error_event_id": fix_linked["error_event_id"],
         },
     )
 
-    append_line(events_path, fix_committed_event)
+    append_event(events_path, fix_committed_event)
 
     print(f"Fix {args.fix_id} linkeado al commit {commit_sha}")
-    print(f"Error event_id: {fix_linked.get('payload', {}).get('error_event_id')}")
+    print(f"Error event_id: {fix_linked['error_event_id']}")
     print(f"Commit SHA: {commit_sha}")
 
     return 0
@@ -1509,7 +1436,7 @@ def cmd_repo_snapshot(args: argparse.Namespace) -> int:
         links=[{"kind": "artifact", "ref": str(snapshot_file.relative_to(root))}],
     )
 
-    append_line(events_path, snapshot_event)
+    append_event(events_path, snapshot_event)
 
     print(f"Snapshot creado: {snapshot_file.name}")
     print(f"  Archivos trackeados: {len(tracked_paths)}")
@@ -1625,7 +1552,6 @@ def cmd_repo_audit(args: argparse.Namespace) -> int:
                         "suggestion": "Mover a docs_temp/ y clasificar",
                     },
                 )
-                append_line(events_path, violation_event)
                 violations.append(violation_event)
 
     # Regla 2: .md fuera de docs/ es sospechoso
@@ -1665,7 +1591,6 @@ def cmd_repo_audit(args: argparse.Namespace) -> int:
                         "suggestion": "Revisar y proponer mover/copy a docs_temp/",
                     },
                 )
-                append_line(events_path, violation_event)
                 violations.append(violation_event)
 
     # Regla 3: Cambios en docs/ → alerta
@@ -1686,7 +1611,6 @@ def cmd_repo_audit(args: argparse.Namespace) -> int:
                     "suggestion": "Revisar cambios en Zona Indeleble",
                 },
             )
-            append_line(events_path, violation_event)
             violations.append(violation_event)
 
     # Crear evento de resumen
@@ -1704,7 +1628,11 @@ def cmd_repo_audit(args: argparse.Namespace) -> int:
             "modified_files_count": len(modified_files),
         },
     )
-    append_line(events_path, audit_event)
+    # Violaciones + resumen en un solo lote: la auditoría queda completa o no queda
+    with event_writer(events_path) as writer:
+        for violation_event in violations:
+            append_event(events_path, violation_event, writer=writer)
+        append_event(events_path, audit_event, writer=writer)
 
     # Mostrar resultados
     print(f"Auditoría completada contra snapshot: {snapshot_file.name}")
@@ -1722,6 +1650,284 @@ def cmd_repo_audit(args: argparse.Namespace) -> int:
     return 0
 
 
+def cmd_storage_migrate(args: argparse.Namespace) -> int:
+    """Migra el log de eventos a otro layout de almacenamiento (streaming)."""
+    from .storage import is_daily, migrate_to_daily
+
+    root = config.data_root(args.data_root)
+    config.ensure_data_dirs(root)
+    events_path = _events_path(root)
+
+    if args.layout == "daily":
+        if is_daily(events_path):
+            print("El log ya usa layout daily.", file=sys.stderr)
+            return 0
+        stats = migrate_to_daily(events_path)
+        print(f"Log migrado a layout daily: {stats['events']} eventos en {stats['days']} día(s).")
+        print(f"  Directorio: {config.index_dir(root) / 'events'}")
+        if stats["events"]:
+            print(f"  Original: {events_path.with_name('events.ndjson.migrated')}")
+        return 0
+
+    print(f"Layout inválido: {args.layout}", file=sys.stderr)
+    return 1
+
+
+def cmd_storage_rotate(args: argparse.Namespace) -> int:
+    """Sella los archivos activos del log que superaron los límites de rotación."""
+    from .storage import rotate_logs
+
+    root = config.data_root(args.data_root)
+    config.ensure_data_dirs(root)
+    events_path = _events_path(root)
+
+    sealed = rotate_logs(events_path, force=args.force)
+    if not sealed:
+        print("Nada para rotar.")
+        return 0
+    for header in sealed:
+        print(
+            f"Segmento sellado: {header['path']} "
+            f"({header['count']} eventos, {header['min_ts']} -> {header['max_ts']})"
+        )
+    return 0
+
+
+def cmd_storage_mirror(args: argparse.Namespace) -> int:
+    """Activa, desactiva o reconstruye el espejo SQLite del log de eventos."""
+    from .storage import load_config, save_config
+
+    root = config.data_root(args.data_root)
+    config.ensure_data_dirs(root)
+    events_path = _events_path(root)
+    index_dir = config.index_dir(root)
+
+    if args.action in ("enable", "disable"):
+        storage_config = load_config(index_dir)
+        storage_config["sqlite_mirror"] = args.action == "enable"
+        save_config(index_dir, storage_config)
+        if args.action == "disable":
+            print("Espejo SQLite desactivado (las consultas leen el NDJSON).")
+            return 0
+
+    if not sqlite_mirror.is_enabled(events_path):
+        print("El espejo SQLite no está activo. Usa 'dia storage mirror enable'.", file=sys.stderr)
+        return 1
+    count = sqlite_mirror.rebuild(events_path)
+    print(f"Espejo SQLite al día: {count} eventos en {sqlite_mirror.mirror_path(events_path)}")
+    return 0
+
+
+def cmd_storage_refs(args: argparse.Namespace) -> int:
+    """Activa o desactiva el formato compacto (actor/project/repo en refs.ndjson)."""
+    from . import refs
+    from .storage import load_config, save_config
+
+    root = config.data_root(args.data_root)
+    config.ensure_data_dirs(root)
+    index_dir = config.index_dir(root)
+
+    if args.action in ("enable", "disable"):
+        storage_config = load_config(index_dir)
+        storage_config["compact_refs"] = args.action == "enable"
+        save_config(index_dir, storage_config)
+    state = "activo" if load_config(index_dir).get("compact_refs") else "inactivo"
+    entries = refs.load(index_dir)["table"]
+    print(f"Formato compacto {state}: {len(entries)} sub-documentos en {refs.refs_path(index_dir)}")
+    if args.action == "enable":
+        print("Los eventos nuevos referencian actor/project/repo; las líneas existentes no cambian.")
+    return 0
+
+
+def cmd_storage_columns(args: argparse.Namespace) -> int:
+    """Pone al día (o reconstruye) el cache columnar de métricas y muestra conteos por tipo."""
+    from . import columnar
+
+    if not columnar.is_available():
+        print("El cache columnar requiere numpy (pip install numpy).", file=sys.stderr)
+        return 1
+    root = config.data_root(args.data_root)
+    config.ensure_data_dirs(root)
+    events_path = _events_path(root)
+
+    columns = columnar.rebuild(events_path) if args.rebuild else columnar.load(events_path)
+    print(f"Cache columnar: {columns['rows']} eventos en {columnar.columns_dir(events_path)}")
+    by_type = columnar.counts_by(columns, "type")
+    for event_type, total in sorted(by_type.items(), key=lambda item: -item[1]):
+        print(f"  {event_type}: {total}")
+    return 0
+
+
+def cmd_storage_views(args: argparse.Namespace) -> int:
+    """Pone al día (o reconstruye) las vistas por tipo del log (sesiones, resúmenes)."""
+    from . import type_views
+
+    root = config.data_root(args.data_root)
+    config.ensure_data_dirs(root)
+    events_path = _events_path(root)
+
+    if args.rebuild:
+        type_views.rebuild(events_path)
+    for name, info in type_views.status(events_path).items():
+        print(f"Vista {name}: {info['events']} eventos ({info['bytes']} bytes) en {info['path']}")
+    return 0
+
+
+def cmd_storage_keys(args: argparse.Namespace) -> int:
+    """Pone al día (o reconstruye) el índice por claves del log (event_id, capture_id, fix_id...)."""
+    root = config.data_root(args.data_root)
+    config.ensure_data_dirs(root)
+    events_path = _events_path(root)
+
+    if not key_index.is_enabled(events_path):
+        print("Índice por claves desactivado (\"key_index\": false en storage.json).")
+        return 0
+    if args.rebuild:
+        key_index.rebuild(events_path)
+    for name, count in key_index.status(events_path).items():
+        print(f"{name}: {count}")
+    print(f"Índice: {key_index.keys_path(events_path)}")
+    return 0
+
+
+def cmd_storage_projections(args: argparse.Namespace) -> int:
+    """Pone al día (o reconstruye) las proyecciones del log (estado de sesiones, etc.)."""
+    root = config.data_root(args.data_root)
+    config.ensure_data_dirs(root)
+    events_path = _events_path(root)
+
+    if args.rebuild:
+        for name in projections.PROJECTIONS:
+            projections.rebuild(events_path, name)
+    for name, info in projections.status(events_path).items():
+        print(f"{name}: v{info['version']}, {info['applied_bytes']} bytes aplicados, checkpoint {info['bytes']} bytes")
+        print(f"  {info['path']}")
+        print(f"  snapshots as-of: {info['snapshots']} ({info['snapshot_bytes']} bytes)")
+    return 0
+
+
+def cmd_storage_locks(args: argparse.Namespace) -> int:
+    """Muestra las esperas registradas por el lock de index/ (contención CLI/server)."""
+    from .locking import WAIT_LOG_MS, wait_log_path, wait_stats
+
+    root = config.data_root(args.data_root)
+    config.ensure_data_dirs(root)
+    index_dir = config.index_dir(root)
+
+    stats = wait_stats(index_dir)
+    if not stats["count"]:
+        print(f"Sin esperas de lock >= {WAIT_LOG_MS:.0f} ms registradas.")
+        return 0
+    print(f"Esperas de lock >= {WAIT_LOG_MS:.0f} ms: {stats['count']} ({wait_log_path(index_dir)})")
+    print(f"  p50: {stats['p50_ms']:.1f} ms  p95: {stats['p95_ms']:.1f} ms  max: {stats['max_ms']:.1f} ms")
+    for label, count in sorted(stats["labels"].items(), key=lambda item: -item[1]):
+        print(f"  {label}: {count}")
+    return 0
+
+
+def cmd_query(args: argparse.Namespace) -> int:
+    """Consulta el log con filtros (tipo, días, sesión, repo, proyecto, actor, campos)."""
+    import time
+    from datetime import date, timedelta
+
+    from . import codec, query
+
+    root = config.data_root(args.data_root)
+    config.ensure_data_dirs(root)
+    events_path = _events_path(root)
+
+    from_day = args.from_day
+    if args.last_days:
+        from_day = (date.fromisoformat(day_id()) - timedelta(days=args.last_days - 1)).isoformat()
+    repo_path = str(Path(args.repo).expanduser().resolve()) if args.repo else None
+    try:
+        spec = query.build_query(
+            types=args.type,
+            day=args.day,
+            from_day=from_day,
+            to_day=args.to_day,
+            since=args.since,
+            until=args.until,
+            session_id=args.session,
+            repo_path=repo_path,
+            project=args.project,
+            actor=args.actor,
+            conditions=args.where or (),
+        )
+    except ValueError as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        return 1
+
+    stats: dict[str, Any] = {}
+    started = time.perf_counter()
+    results = query.execute(events_path, spec, limit=args.limit, newest_first=args.newest_first, stats=stats)
+    if args.format == "count":
+        print(sum(1 for _ in results))
+    elif args.format == "table":
+        rows = [query.table_row(event) for event in results]
+        print(query.format_table(rows))
+    else:
+        for event in results:
+            sys.stdout.write(codec.dumps_str(event) + "\n")
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    # Costo de la consulta por stderr: no se mezcla con el NDJSON de stdout
+    print(
+        f"Plan: {', '.join(stats['plan'])} | eventos tocados: {stats['read']} "
+        f"(decodificados: {stats['parsed']}) | coincidencias: {stats['matched']} | {elapsed_ms:.1f} ms",
+        file=sys.stderr,
+    )
+    return 0
+
+
+def cmd_events_tail(args: argparse.Namespace) -> int:
+    """Últimos N eventos del log y, con --follow, los que se van agregando."""
+    from . import codec, follow
+
+    root = config.data_root(args.data_root)
+    config.ensure_data_dirs(root)
+    events_path = _events_path(root)
+    types = [t.strip() for item in args.type or () for t in item.split(",") if t.strip()] or None
+
+    def emit(event: dict[str, Any]) -> None:
+        if args.format == "ndjson":
+            sys.stdout.write(codec.dumps_str(event) + "\n")
+        else:
+            sys.stdout.write(follow.format_line(event) + "\n")
+
+    def on_rewrite() -> None:
+        print("Aviso: el log se truncó o se reescribió; se sigue desde el final", file=sys.stderr)
+
+    try:
+        # El cursor se toma antes de leer la cola: lo que llegue en el medio
+        # aparece en ambas y se descarta por event_id
+        with storage.locked(events_path, "tail"):
+            cursor = storage.end_cursor(events_path)
+        recent = storage.newest_events(events_path, args.lines, types=types)
+        for event in recent:
+            emit(event)
+        sys.stdout.flush()
+        if not args.follow:
+            return 0
+        shown = {event.get("event_id") for event in recent}
+        watcher = follow.LogWatcher(events_path, interval=args.interval)
+        print(f"Siguiendo {events_path} ({watcher.backend}); Ctrl+C para salir", file=sys.stderr)
+        for batch in follow.follow(events_path, cursor, types, watcher=watcher, on_rewrite=on_rewrite):
+            for event in batch:
+                if shown and event.get("event_id") in shown:
+                    continue
+                emit(event)
+            shown = set()
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        return 0
+    except BrokenPipeError:
+        # Salida cortada (ej: | head): no reportar el error al cerrar stdout
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+    return 0
+
+
 def cmd_update(args: argparse.Namespace) -> int:
     cli_root = Path(__file__).resolve().parents[1]
     print("Reinstalando CLI en modo editable...")
@@ -1797,6 +2003,9 @@ def build_parser() -> argparse.ArgumentParser:
     day_status_parser = day_subparsers.add_parser(
         "status", help="Muestra estado del día actual", parents=[common]
     )
+    day_status_parser.add_argument(
+        "--at", help="Estado a un momento pasado (timestamp ISO 8601; sin zona: hora de Buenos Aires)"
+    )
     day_status_parser.set_defaults(func=cmd_day_status)
     
     day_close_parser = day_subparsers.add_parser(
@@ -1832,6 +2041,145 @@ def build_parser() -> argparse.ArgumentParser:
     )
     summary_nightly_parser.set_defaults(func=cmd_summary_nightly)
 
+    # Namespace: storage
+    storage_parser = subparsers.add_parser(
+        "storage", help="Mantenimiento del almacenamiento de eventos", parents=[common]
+    )
+    storage_subparsers = storage_parser.add_subparsers(dest="storage_command", required=True)
+
+    storage_migrate_parser = storage_subparsers.add_parser(
+        "migrate", help="Migra events.ndjson a otro layout (streaming)", parents=[common]
+    )
+    storage_migrate_parser.add_argument(
+        "--layout", choices=["daily"], required=True,
+        help="daily: un archivo por día en index/events/YYYY-MM-DD.ndjson"
+    )
+    storage_migrate_parser.set_defaults(func=cmd_storage_migrate)
+
+    storage_rotate_parser = storage_subparsers.add_parser(
+        "rotate", help="Sella segmentos comprimidos según rotation en storage.json", parents=[common]
+    )
+    storage_rotate_parser.add_argument(
+        "--force", action="store_true",
+        help="Sellar los archivos activos aunque no superen los límites"
+    )
+    storage_rotate_parser.set_defaults(func=cmd_storage_rotate)
+
+    storage_mirror_parser = storage_subparsers.add_parser(
+        "mirror", help="Espejo SQLite de consultas (index/mirror.sqlite3)", parents=[common]
+    )
+    storage_mirror_parser.add_argument(
+        "action", choices=["enable", "disable", "rebuild"],
+        help="enable: activar y poblar; disable: volver a leer el NDJSON; rebuild: reconstruir"
+    )
+    storage_mirror_parser.set_defaults(func=cmd_storage_mirror)
+
+    storage_refs_parser = storage_subparsers.add_parser(
+        "refs", help="Formato compacto: actor/project/repo en index/refs.ndjson", parents=[common]
+    )
+    storage_refs_parser.add_argument(
+        "action", choices=["enable", "disable", "status"],
+        help="enable/disable: formato de los eventos nuevos; status: estado y tamaño del diccionario"
+    )
+    storage_refs_parser.set_defaults(func=cmd_storage_refs)
+
+    storage_columns_parser = storage_subparsers.add_parser(
+        "columns", help="Cache columnar de métricas (index/columns/, requiere numpy)", parents=[common]
+    )
+    storage_columns_parser.add_argument(
+        "--rebuild", action="store_true", help="Descartar el cache y reconstruirlo desde el log"
+    )
+    storage_columns_parser.set_defaults(func=cmd_storage_columns)
+
+    storage_views_parser = storage_subparsers.add_parser(
+        "views", help="Vistas por tipo del log (index/views/: sesiones, resúmenes)", parents=[common]
+    )
+    storage_views_parser.add_argument(
+        "--rebuild", action="store_true", help="Descartar las vistas y reconstruirlas desde el log"
+    )
+    storage_views_parser.set_defaults(func=cmd_storage_views)
+
+    storage_keys_parser = storage_subparsers.add_parser(
+        "keys", help="Índice por claves del log (index/keys.sqlite3)", parents=[common]
+    )
+    storage_keys_parser.add_argument(
+        "--rebuild", action="store_true", help="Descartar el índice y reconstruirlo desde el log"
+    )
+    storage_keys_parser.set_defaults(func=cmd_storage_keys)
+
+    storage_projections_parser = storage_subparsers.add_parser(
+        "projections", help="Proyecciones del log (index/projections/)", parents=[common]
+    )
+    storage_projections_parser.add_argument(
+        "--rebuild", action="store_true", help="Descartar los checkpoints y reconstruir desde el log"
+    )
+    storage_projections_parser.set_defaults(func=cmd_storage_projections)
+
+    storage_locks_parser = storage_subparsers.add_parser(
+        "locks", help="Esperas registradas del lock de index/ (contención)", parents=[common]
+    )
+    storage_locks_parser.set_defaults(func=cmd_storage_locks)
+
+    # Namespace: events
+    events_parser = subparsers.add_parser("events", help="Lectura del log de eventos", parents=[common])
+    events_subparsers = events_parser.add_subparsers(dest="events_command", required=True)
+
+    events_tail_parser = events_subparsers.add_parser(
+        "tail", help="Últimos eventos del log (con --follow, en vivo)", parents=[common]
+    )
+    events_tail_parser.add_argument(
+        "-n", "--lines", type=int, default=10, help="Eventos a mostrar al empezar (default: 10)"
+    )
+    events_tail_parser.add_argument(
+        "-f", "--follow", action="store_true", help="Seguir mostrando los eventos que se agregan"
+    )
+    events_tail_parser.add_argument(
+        "--type", action="append", help="Tipo de evento (repetible o separado por comas)"
+    )
+    events_tail_parser.add_argument(
+        "--format", choices=("text", "ndjson"), default="text", help="Formato de salida"
+    )
+    events_tail_parser.add_argument(
+        "--interval",
+        type=float,
+        default=1.0,
+        help="Segundos entre chequeos si no hay inotify (polling por stat)",
+    )
+    events_tail_parser.set_defaults(func=cmd_events_tail)
+
+    # Namespace: query
+    query_parser = subparsers.add_parser(
+        "query", help="Consulta el log de eventos con filtros (NDJSON, tabla o conteo)"
+    )
+    # Sin `common`: --actor y --project son filtros acá, no los datos del evento a escribir
+    query_parser.add_argument("--data-root", help="Ruta base de data/", default=None)
+    query_parser.add_argument(
+        "--type", action="append", help="Tipo de evento (repetible o separado por comas)"
+    )
+    query_parser.add_argument("--day", help="Día (YYYY-MM-DD, día de la sesión)")
+    query_parser.add_argument("--from-day", help="Desde el día (YYYY-MM-DD, inclusive)")
+    query_parser.add_argument("--to-day", help="Hasta el día (YYYY-MM-DD, inclusive)")
+    query_parser.add_argument("--last-days", type=int, help="Últimos N días (incluye hoy)")
+    query_parser.add_argument("--since", help="Desde el ts (ISO 8601, inclusive)")
+    query_parser.add_argument("--until", help="Hasta el ts (ISO 8601, inclusive)")
+    query_parser.add_argument("--session", help="ID de sesión (S01...)")
+    query_parser.add_argument("--repo", help="Ruta del repo")
+    query_parser.add_argument("--project", help="Tag de proyecto")
+    query_parser.add_argument("--actor", help="user_id del actor")
+    query_parser.add_argument(
+        "--where",
+        action="append",
+        help="Condición sobre un campo (repetible): payload.error_hash=abc, payload.title~timeout, actor.role!=bot",
+    )
+    query_parser.add_argument("--limit", type=int, help="Máximo de eventos")
+    query_parser.add_argument(
+        "--newest-first", action="store_true", help="Del evento más nuevo al más viejo"
+    )
+    query_parser.add_argument(
+        "--format", choices=("ndjson", "table", "count"), default="ndjson", help="Formato de salida"
+    )
+    query_parser.set_defaults(func=cmd_query)
+
     # Aliases legacy (mantener compatibilidad)
     start_parser = subparsers.add_parser(
         "start", help="[LEGACY] Alias de 'dia session start'", parents=[common]
@@ -1,10 +1,426 @@
-import json
+import os
+from contextlib import nullcontext
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, Iterator, Optional
+
+from . import codec, event_index, locking, segments
+
+# Tamaño de bloque para leer un NDJSON desde el final
+REVERSE_BLOCK_SIZE = 64 * 1024
+
+# Lote de varias líneas a medio confirmar (ver EventWriter.commit y finish_batch)
+BATCH_INTENT_NAME = "batch.intent"
+
+# Orden canónico de claves: la cabecera primero, así los lectores filtran por
+# prefijo de bytes ({"type":"X","ts":"...","session":{"day_id":...,"session_id":...)
+LINE_HEADER = ("type", "ts", "session", "event_id")
+SESSION_HEADER = ("day_id", "session_id")
+
+
+def canonical_order(payload: dict[str, Any]) -> dict[str, Any]:
+    """Copia del evento con las claves de cabecera primero (el resto en su orden)."""
+    if "type" not in payload:
+        return payload
+    ordered = {key: payload[key] for key in LINE_HEADER if key in payload}
+    session = ordered.get("session")
+    if isinstance(session, dict):
+        head = {key: session[key] for key in SESSION_HEADER if key in session}
+        head.update(session)
+        ordered["session"] = head
+    for key, value in payload.items():
+        if key not in ordered:
+            ordered[key] = value
+    return ordered
+
+
+def encode_line(payload: dict[str, Any]) -> bytes:
+    """Serializa un evento como línea NDJSON (UTF-8, orden canónico, con `\\n` final)."""
+    return codec.dumps_line(canonical_order(payload))
 
 
 def append_line(path: Path, payload: dict[str, Any]) -> None:
+    """Agrega una línea sin tomar lock (las escrituras de eventos van por storage)."""
     path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("a", encoding="utf-8") as handle:
-        handle.write(json.dumps(payload, ensure_ascii=True))
-        handle.write("\n")
+    line = encode_line(payload)
+    with path.open("ab") as handle:
+        offset = handle.tell()
+        handle.write(line)
+    # Mantener el índice sidecar (events.idx) al día con el log
+    event_index.record_append(path, offset, len(line), payload)
+
+
+def repair_tail(path: Path) -> int:
+    """
+    Corta una línea final sin `\\n` (escritura interrumpida) para que el próximo
+    append no quede pegado a ella. Los bytes cortados se guardan en
+    `<archivo>.torn`. Retorna la cantidad de bytes cortados.
+
+    Solo es seguro con el lock tomado: sin lock la línea podría ser una
+    escritura en curso de otro proceso.
+    """
+    if not path.exists():
+        return 0
+    with path.open("r+b") as handle:
+        size = handle.seek(0, os.SEEK_END)
+        if size == 0:
+            return 0
+        handle.seek(size - 1)
+        if handle.read(1) == b"\n":
+            return 0
+        # Buscar el último fin de línea hacia atrás
+        position = size
+        cut = 0
+        while position > 0:
+            start = max(0, position - REVERSE_BLOCK_SIZE)
+            handle.seek(start)
+            newline = handle.read(position - start).rfind(b"\n")
+            if newline != -1:
+                cut = start + newline + 1
+                break
+            position = start
+        handle.seek(cut)
+        torn = handle.read()
+        with path.with_name(path.name + ".torn").open("ab") as out:
+            out.write(torn + b"\n")
+        handle.truncate(cut)
+    return size - cut
+
+
+def _valid_line(raw_line: bytes) -> bool:
+    """Línea completa y sana: CRC correcto o, sin CRC (líneas viejas), JSON válido."""
+    if not raw_line.endswith(b"\n"):
+        return False
+    if not raw_line.strip():
+        return True
+    valid = codec.check_line(raw_line)
+    if valid is not None:
+        return valid
+    try:
+        codec.loads(raw_line)
+    except ValueError:
+        return False
+    return True
+
+
+def _ends_line(path: Path, offset: int) -> bool:
+    if offset == 0:
+        return True
+    with path.open("rb") as handle:
+        handle.seek(offset - 1)
+        return handle.read(1) == b"\n"
+
+
+def _is_intact(path: Path) -> bool:
+    """Sin bytes posteriores a la última línea indexada (el caso normal)."""
+    return not path.exists() or event_index.indexed_bytes(path) == path.stat().st_size
+
+
+def _recover_tail(path: Path) -> int:
+    """Valida desde el último offset indexado y pone en cuarentena las líneas dañadas."""
+    if not path.exists():
+        return 0
+    size = path.stat().st_size
+    start = event_index.indexed_bytes(path)
+    if start > size or not _ends_line(path, start):
+        # Índice desfasado (log reescrito): se valida el archivo completo
+        start = 0
+    if start == size:
+        return 0
+    first_bad: Optional[int] = None
+    kept: list[bytes] = []
+    bad: list[bytes] = []
+    with path.open("rb") as handle:
+        handle.seek(start)
+        position = start
+        for raw_line in handle:
+            valid = _valid_line(raw_line)
+            if not valid and first_bad is None:
+                first_bad = position
+            if first_bad is not None:
+                (kept if valid else bad).append(raw_line)
+            position += len(raw_line)
+    if first_bad is not None:
+        torn_path = path.with_name(path.name + ".torn")
+        with torn_path.open("ab") as out:
+            out.write(b"".join(line.rstrip(b"\n") + b"\n" for line in bad))
+        if not kept:
+            # Caso común: solo la cola está dañada (escritura interrumpida)
+            with path.open("r+b") as handle:
+                handle.truncate(first_bad)
+        else:
+            # Líneas sanas después de una dañada: se reescribe y se reemplaza atómicamente
+            tmp_path = path.with_name(f"{path.name}.{os.getpid()}.recover")
+            with path.open("rb") as source, tmp_path.open("wb") as out:
+                remaining = first_bad
+                while remaining > 0:
+                    chunk = source.read(min(REVERSE_BLOCK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    out.write(chunk)
+                    remaining -= len(chunk)
+                out.write(b"".join(kept))
+            os.replace(tmp_path, path)
+    event_index.ensure_index(path)
+    return sum(len(line) for line in bad)
+
+
+def batch_intent_path(lock_dir: Path) -> Path:
+    """Intención del lote en curso de los logs que se escriben con el lock de `lock_dir`."""
+    return lock_dir / BATCH_INTENT_NAME
+
+
+def _write_batch_intent(lock_dir: Path, pending: dict[Path, Any], fsync: bool) -> Path:
+    """Registra el tamaño de cada archivo del lote antes de escribirlo (tmp + rename)."""
+    path = batch_intent_path(lock_dir)
+    files = {
+        os.path.relpath(log_path, lock_dir): log_path.stat().st_size if log_path.exists() else 0
+        for log_path in pending
+    }
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with tmp_path.open("wb") as handle:
+        handle.write(codec.dumps({"files": files}))
+        if fsync:
+            handle.flush()
+            os.fsync(handle.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+
+def finish_batch(lock_dir: Path) -> int:
+    """
+    Deshace un lote interrumpido (llamar con el lock de `lock_dir` tomado):
+    cada archivo del lote vuelve al tamaño que tenía antes del commit y lo
+    escrito después se mueve a `<archivo>.torn`, así no queda una parte del
+    lote aunque sus líneas estén completas. Retorna los bytes puestos en
+    cuarentena.
+    """
+    path = batch_intent_path(lock_dir)
+    try:
+        intent = codec.loads(path.read_bytes())
+    except FileNotFoundError:
+        return 0
+    except ValueError:
+        # Se escribe con tmp + rename antes de escribir el lote: ilegible
+        # solo tras un corte de luz sin fsync
+        intent = None
+    quarantined = 0
+    for name, size in ((intent or {}).get("files") or {}).items():
+        log_path = lock_dir / name
+        if not log_path.exists() or log_path.stat().st_size <= size:
+            continue
+        with log_path.open("r+b") as handle:
+            handle.seek(size)
+            torn = handle.read()
+            with log_path.with_name(log_path.name + ".torn").open("ab") as out:
+                out.write(torn if torn.endswith(b"\n") else torn + b"\n")
+            handle.truncate(size)
+        event_index.ensure_index(log_path)
+        quarantined += len(torn)
+    for stale in lock_dir.glob(f"{BATCH_INTENT_NAME}.*.tmp"):
+        stale.unlink(missing_ok=True)
+    path.unlink(missing_ok=True)
+    return quarantined
+
+
+def recover(path: Path, lock_dir: Optional[Path] = None) -> int:
+    """
+    Recuperación al abrir un NDJSON: valida solo la cola posterior al último
+    offset conocido como sano (fin de la última línea del índice sidecar) y
+    mueve las líneas dañadas o cortadas a `<archivo>.torn`. Retorna los bytes
+    puestos en cuarentena.
+
+    El chequeo rápido (índice al día con el archivo, sin lote ni sellado
+    pendiente) no toma lock; si no, se toma el lock de `lock_dir` (una línea
+    final incompleta puede ser una escritura en curso de otro proceso). Con
+    el lock tomado se deshace un lote interrumpido (ver `finish_batch`) y se
+    completa un sellado interrumpido (ver segments.finish_seal).
+    """
+    if (
+        _is_intact(path)
+        and not segments.intent_path(path).exists()
+        and not (lock_dir is not None and batch_intent_path(lock_dir).exists())
+    ):
+        return 0
+    guard = locking.locked(lock_dir, "recover") if lock_dir is not None else nullcontext()
+    with guard:
+        quarantined = finish_batch(lock_dir) if lock_dir is not None else 0
+        segments.finish_seal(path)
+        return quarantined + _recover_tail(path)
+
+
+class EventWriter:
+    """
+    Escritor por lotes (group commit) para logs NDJSON.
+
+    Los eventos se acumulan en memoria y se escriben al confirmar el lote con
+    un solo write() por archivo (y, con `fsync=True`, un fsync por archivo).
+    Usado como context manager: si el bloque termina con una excepción no se
+    escribe nada, así un comando que emite varios eventos no deja la mitad en
+    disco.
+
+        with EventWriter() as writer:
+            writer.append(events_path, start_event)
+            writer.append(events_path, baseline_event)
+
+    Los archivos se escriben en el orden en que recibieron su primer evento.
+
+    Con `lock_dir` el commit se hace con el lock de ese directorio tomado (ver
+    locking.py) y antes de escribir se recupera la cola del archivo (líneas
+    cortadas o dañadas a `<archivo>.torn`, ver `recover`). Un lote de varias
+    líneas registra antes el tamaño de cada archivo en
+    `<lock_dir>/batch.intent` y la borra al terminar de escribir: si el
+    proceso muere (o se corta la luz, con `fsync=True`) a mitad del lote,
+    `recover` lo deshace completo (ver `finish_batch`).
+
+    `before_write` / `after_commit` registran acciones que corren dentro del
+    commit (con el lock tomado) antes y después de escribir el lote.
+    """
+
+    def __init__(
+        self, fsync: bool = False, lock_dir: Optional[Path] = None, label: str = "append"
+    ) -> None:
+        self.fsync = fsync
+        self.lock_dir = lock_dir
+        self.label = label
+        self._pending: dict[Path, list[tuple[bytes, dict[str, Any]]]] = {}
+        self._before_write: dict[Any, Callable[[], None]] = {}
+        self._after_commit: dict[Any, Callable[[], None]] = {}
+
+    def append(self, path: Path, payload: dict[str, Any]) -> None:
+        """Agrega un evento al lote (se serializa ya, para fallar antes de escribir)."""
+        self._pending.setdefault(path, []).append((encode_line(payload), payload))
+
+    def before_write(self, key: Any, callback: Callable[[], None]) -> None:
+        """Registra una acción a correr antes de escribir el lote (una por `key`)."""
+        self._before_write.setdefault(key, callback)
+
+    def after_commit(self, key: Any, callback: Callable[[], None]) -> None:
+        """Registra una acción a correr después de confirmar el lote (una por `key`)."""
+        self._after_commit.setdefault(key, callback)
+
+    def __len__(self) -> int:
+        return sum(len(lines) for lines in self._pending.values())
+
+    def commit(self) -> int:
+        """Escribe el lote. Retorna la cantidad de eventos escritos."""
+        written = 0
+        pending, self._pending = self._pending, {}
+        preparers, self._before_write = self._before_write, {}
+        callbacks, self._after_commit = self._after_commit, {}
+        if not pending and not callbacks:
+            return 0
+        if self.lock_dir is not None:
+            guard = locking.locked(self.lock_dir, self.label)
+        else:
+            guard = nullcontext()
+        with guard:
+            for prepare in preparers.values():
+                prepare()
+            intent = None
+            if self.lock_dir is not None:
+                finish_batch(self.lock_dir)
+                for path in pending:
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    recover(path)
+                if sum(len(lines) for lines in pending.values()) > 1:
+                    intent = _write_batch_intent(self.lock_dir, pending, self.fsync)
+            try:
+                for path, lines in pending.items():
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    with path.open("ab") as handle:
+                        offset = handle.tell()
+                        handle.write(b"".join(line for line, _ in lines))
+                        if self.fsync:
+                            handle.flush()
+                            os.fsync(handle.fileno())
+                    event_index.record_appends(
+                        path, offset, [(len(line), payload) for line, payload in lines]
+                    )
+                    written += len(lines)
+            except BaseException:
+                # Ej: disco lleno a mitad del lote
+                if intent is not None:
+                    finish_batch(self.lock_dir)
+                raise
+            if intent is not None:
+                # Punto de confirmación del lote
+                intent.unlink()
+            # Dentro del lock: la rotación reescribe el archivo activo
+            for callback in callbacks.values():
+                callback()
+        return written
+
+    def discard(self) -> None:
+        """Descarta el lote sin escribir."""
+        self._pending = {}
+        self._before_write = {}
+        self._after_commit = {}
+
+    def __enter__(self) -> "EventWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+        return False
+
+
+def read_lines_reverse(path: Path, block_size: int = REVERSE_BLOCK_SIZE) -> Iterator[bytes]:
+    """
+    Itera las líneas completas de un NDJSON desde el final hacia el principio,
+    leyendo bloques de `block_size` bytes hacia atrás. Cortar la iteración deja
+    sin leer el resto del archivo: el costo depende de cuántas líneas se piden,
+    no del tamaño del archivo.
+
+    Una línea final sin `\\n` (escritura en curso) se ignora.
+    """
+    if not path.exists():
+        return
+    with path.open("rb") as handle:
+        handle.seek(0, os.SEEK_END)
+        position = handle.tell()
+        if position == 0:
+            return
+        handle.seek(position - 1)
+        skip_partial = handle.read(1) != b"\n"
+        remainder = b""
+        while position > 0:
+            size = min(block_size, position)
+            position -= size
+            handle.seek(position)
+            lines = (handle.read(size) + remainder).split(b"\n")
+            # La primera parte puede ser el final de una línea que empieza en el bloque anterior
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if skip_partial:
+                    skip_partial = False
+                    continue
+                if line.strip():
+                    yield line + b"\n"
+        if remainder.strip() and not skip_partial:
+            yield remainder + b"\n"
+
+
+def last_line_end(handle: Any, size: int) -> int:
+    """Offset después del último `\\n` de un archivo abierto (lo que sigue es una línea a medio escribir)."""
+    position = size
+    while position > 0:
+        step = min(64 * 1024, position)
+        position -= step
+        handle.seek(position)
+        newline = handle.read(step).rfind(b"\n")
+        if newline != -1:
+            return position + newline + 1
+    return 0
+
+
+def read_json_lines_reverse(path: Path) -> Iterator[dict[str, Any]]:
+    """
+    Itera los objetos de un NDJSON del más nuevo (última línea) al más viejo.
+    Antes recupera la cola del archivo (ver `recover`, lock de su directorio).
+    """
+    recover(path, path.parent)
+    for raw_line in read_lines_reverse(path):
+        yield codec.loads_line(raw_line)
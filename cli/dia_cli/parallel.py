@@ -0,0 +1,194 @@
+"""
+Lectura en paralelo del log de eventos, por rangos de bytes.
+
+Reconstruir índices (key_index, columnar) o recorrer el historial completo
+es una pasada por todo el log en un solo core. `split` parte cada archivo
+del log en rangos alineados a fin de línea (offsets lógicos; un segmento
+sellado es un rango, porque comprimido no se puede partir) y `map_chunks`
+los procesa en un ProcessPoolExecutor:
+
+    mapper(events_path, chunk, lines) -> resultado   # en el worker
+    map_chunks(...)      -> (chunk, resultado), en el orden del log
+    map_reduce(...)      -> reducer(acumulado, resultado), en orden
+
+`lines` son pares (offset_lógico_fin_de_línea, línea_cruda) del rango. El
+mapper tiene que ser una función de módulo (se pasa por pickle) y conviene
+que retorne poco (tuplas, contadores): devolver eventos completos cuesta
+tanto como parsearlos.
+
+Con pocos bytes o un solo worker se corre en el proceso, sin pool.
+"""
+from __future__ import annotations
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+from . import codec, refs, segments, storage
+from .ndjson import last_line_end, recover
+
+CHUNK_BYTES = 8 * 1024 * 1024
+# Por debajo de esto el costo de levantar el pool supera la ganancia
+MIN_PARALLEL_BYTES = 32 * 1024 * 1024
+
+# (archivo: clave de storage.file_key, offset lógico inicial, offset lógico final)
+Chunk = tuple[str, int, int]
+
+
+def worker_count(events_path: Path) -> int:
+    """Workers según `parallel_workers` en storage.json (default: un proceso por CPU)."""
+    configured = storage.load_config(events_path.parent)["parallel_workers"]
+    return max(int(configured or os.cpu_count() or 1), 1)
+
+
+def _aligned(handle: Any, position: int, size: int) -> int:
+    """Primer inicio de línea en `position` o después (o `size`)."""
+    if position <= 0:
+        return 0
+    handle.seek(position - 1)
+    while True:
+        block = handle.read(64 * 1024)
+        if not block:
+            return size
+        newline = block.find(b"\n")
+        if newline != -1:
+            return min(handle.tell() - len(block) + newline + 1, size)
+
+
+def split(
+    events_path: Path, chunk_bytes: int = CHUNK_BYTES, cursor: Optional[dict[str, int]] = None
+) -> list[Chunk]:
+    """
+    Rangos del log (desde `cursor`, si se pasa) en orden de lectura. Cada
+    rango empieza y termina en fin de línea; la cola incompleta del archivo
+    activo (escritura en curso) queda afuera.
+    """
+    cursor = cursor or {}
+    chunks: list[Chunk] = []
+    for path in storage.log_files(events_path):
+        recover(path, events_path.parent)
+        key = storage.file_key(events_path, path)
+        start = cursor.get(key, 0)
+        headers = segments.list_segments(path)
+        for header in headers:
+            if header["end"] > start:
+                chunks.append((key, max(start, header["start"]), header["end"]))
+        base = headers[-1]["end"] if headers else 0
+        if not path.exists():
+            continue
+        with path.open("rb") as handle:
+            end = last_line_end(handle, os.fstat(handle.fileno()).st_size)
+            position = max(start - base, 0)
+            while position < end:
+                limit = min(_aligned(handle, position + chunk_bytes, end), end)
+                chunks.append((key, base + position, base + limit))
+                position = limit
+    return chunks
+
+
+def chunk_lines(events_path: Path, chunk: Chunk) -> Iterator[tuple[int, bytes]]:
+    """Líneas de un rango como (offset_lógico_fin_de_línea, línea_cruda)."""
+    key, start, end = chunk
+    path = events_path.parent / key
+    base = segments.base_offset(path)
+    if start >= base:
+        with path.open("rb") as handle:
+            handle.seek(start - base)
+            data = handle.read(end - start)
+        position = start
+        for raw_line in data.splitlines(keepends=True):
+            position += len(raw_line)
+            yield position, raw_line
+        return
+    for line_end, raw_line in segments.iter_raw(path, start):
+        if line_end > end:
+            return
+        yield line_end, raw_line
+
+
+Mapper = Callable[[Path, Chunk, Iterator[tuple[int, bytes]]], Any]
+
+
+def _run(events_path: str, chunk: Chunk, mapper: Mapper) -> Any:
+    path = Path(events_path)
+    return mapper(path, chunk, chunk_lines(path, chunk))
+
+
+def map_chunks(
+    events_path: Path,
+    mapper: Mapper,
+    chunks: Optional[list[Chunk]] = None,
+    workers: Optional[int] = None,
+) -> Iterator[tuple[Chunk, Any]]:
+    """
+    Aplica `mapper` a cada rango y retorna (rango, resultado) en el orden del
+    log. Como mucho 2 rangos por worker están en vuelo: el consumidor lento
+    no acumula resultados en memoria.
+    """
+    if chunks is None:
+        chunks = split(events_path)
+    workers = workers or worker_count(events_path)
+    total = sum(end - start for _, start, end in chunks)
+    if workers <= 1 or len(chunks) <= 1 or total < MIN_PARALLEL_BYTES:
+        for chunk in chunks:
+            yield chunk, _run(str(events_path), chunk, mapper)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending: deque = deque()
+        queued = iter(chunks)
+        for chunk in queued:
+            pending.append((chunk, executor.submit(_run, str(events_path), chunk, mapper)))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            chunk, future = pending.popleft()
+            following = next(queued, None)
+            if following is not None:
+                pending.append((following, executor.submit(_run, str(events_path), following, mapper)))
+            yield chunk, future.result()
+
+
+def map_reduce(
+    events_path: Path,
+    mapper: Mapper,
+    reducer: Callable[[Any, Any], Any],
+    initial: Any,
+    chunks: Optional[list[Chunk]] = None,
+    workers: Optional[int] = None,
+) -> Any:
+    """Reduce los resultados de `mapper` en el orden del log: reducer(acumulado, resultado)."""
+    result = initial
+    for _, value in map_chunks(events_path, mapper, chunks, workers):
+        result = reducer(result, value)
+    return result
+
+
+def parse_lines(
+    events_path: Path, chunk: Chunk, lines: Iterator[tuple[int, bytes]]
+) -> list[tuple[int, dict[str, Any]]]:
+    """Mapper: eventos parseados del rango como (offset_fin, evento), líneas inválidas salteadas."""
+    parsed = []
+    for end, raw_line in lines:
+        if not raw_line.strip():
+            continue
+        try:
+            parsed.append((end, codec.loads_line(raw_line)))
+        except ValueError:
+            continue
+    return parsed
+
+
+def iter_events(
+    events_path: Path, cursor: Optional[dict[str, int]] = None, workers: Optional[int] = None
+) -> Iterator[tuple[str, int, dict[str, Any]]]:
+    """
+    Como storage.read_since pero parseando en paralelo: (archivo,
+    offset_lógico_fin_de_línea, evento) en orden, con las referencias de
+    líneas compactas expandidas.
+    """
+    ref_table = refs.load(events_path.parent) if refs.refs_path(events_path.parent).exists() else None
+    for chunk, parsed in map_chunks(events_path, parse_lines, split(events_path, cursor=cursor), workers):
+        for end, event in parsed:
+            yield chunk[0], end, refs.expand(event, ref_table) if ref_table else event
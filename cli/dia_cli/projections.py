@@ -0,0 +1,459 @@
+"""
+Proyecciones incrementales del log de eventos (estado derivado con checkpoint).
+
+Una proyección es un fold del log: un estado inicial y una función que
+aplica un evento al estado, en el orden del log. El motor guarda el estado
+junto con el cursor hasta donde se aplicó ({archivo: offset lógico}) en
+index/projections/<nombre>.json y, en cada consulta, aplica solo las líneas
+escritas después del cursor:
+
+    register("sessions", version, initial, apply, types=(...))
+    load(events_path, "sessions")  -> estado al día con el log
+
+CLI y server leen la misma proyección: el estado se calcula una vez (y se
+cachea en memoria por proceso) en lugar de recorrer el log en cada llamada.
+
+El estado retornado es compartido: no se modifica. Al avanzar se aplica
+sobre una copia de los contenedores de primer nivel (`apply` reemplaza los
+registros que cambia en lugar de modificarlos), así un hilo que todavía lo
+está leyendo no ve cambios y avanzar no cuesta una copia del historial.
+Si el checkpoint falta, cambió la versión de la proyección o el cursor ya no
+corresponde al log (truncado/migrado), se reconstruye desde el inicio.
+
+Avanzar, escribir el checkpoint o un snapshot y descartarlos se hace con el
+lock de index/projections/ (CLI y server): dos procesos no asignan el mismo
+número de snapshot ni borran los del otro a mitad de escritura.
+
+El checkpoint no se reescribe en cada consulta con líneas nuevas (sería
+O(estado) por evento): se persiste cada CHECKPOINT_EVERY_EVENTS eventos
+aplicados o CHECKPOINT_EVERY_BYTES bytes del log, y al escribir un snapshot.
+Un proceso nuevo aplica por su cuenta el tramo corto que quedó sin persistir.
+
+Consultas as-of (`load_at`, el estado a un ts dado): al avanzar se guardan
+snapshots del estado en index/projections/<nombre>.asof/, al cambiar el día
+del ts de los eventos aplicados y cada `every_events` eventos
+("projection_snapshots" en storage.json). `load_at` parte del último
+snapshot anterior a `at` y aplica solo el tramo siguiente, con los eventos
+de ts <= at.
+"""
+from __future__ import annotations
+
+import bisect
+import gzip
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Any, Callable, Iterable, Optional
+
+from . import codec, locking, refs, segments, storage
+from .utils import ts_epoch
+
+PROJECTIONS_DIR = "projections"
+# Forma del checkpoint (independiente de la versión de cada proyección)
+CHECKPOINT_FORMAT = 2
+
+# nombre -> {"version", "initial", "apply", "needles", "types"}
+PROJECTIONS: dict[str, dict[str, Any]] = {}
+
+# Eventos aplicados / bytes del log desde el último checkpoint persistido
+# a partir de los cuales se reescribe
+CHECKPOINT_EVERY_EVENTS = 200
+CHECKPOINT_EVERY_BYTES = 1024 * 1024
+
+# (str(events_path), nombre) -> último estado cargado en este proceso
+_cache: dict[tuple[str, str], dict[str, Any]] = {}
+# (str(events_path), nombre) -> {"events": aplicados sin persistir,
+# "applied": bytes del log del checkpoint en disco, "signature": stat del archivo}
+_persisted: dict[tuple[str, str], dict[str, Any]] = {}
+_cache_lock = threading.Lock()
+
+
+def register(
+    name: str,
+    version: int,
+    initial: Callable[[], dict[str, Any]],
+    apply: Callable[[dict[str, Any], dict[str, Any]], None],
+    types: Optional[Iterable[str]] = None,
+    legacy: Iterable[str] = (),
+) -> None:
+    """
+    Registra una proyección. `apply(state, event)` modifica `state` en el
+    lugar: agrega, reemplaza o quita entradas de sus contenedores de primer
+    nivel, pero no modifica los registros que ya estaban (los reemplaza por
+    una copia; el estado anterior puede estar en uso). Con `types` solo
+    recibe eventos de esos tipos (las demás líneas se descartan sin parsear). Subir `version` al cambiar la forma del estado
+    descarta los checkpoints viejos. `legacy`: archivos de index/ que la
+    proyección reemplaza (checkpoints de un formato anterior); se borran al
+    construirla desde el inicio.
+    """
+    type_set = frozenset(types) if types else None
+    PROJECTIONS[name] = {
+        "version": version,
+        "initial": initial,
+        "apply": apply,
+        "types": type_set,
+        # Un tipo aparece en la línea como string JSON (con o sin escapes)
+        "needles": tuple(codec.dumps(t) for t in type_set) if type_set else (),
+        "legacy": tuple(legacy),
+    }
+
+
+def checkpoint_path(events_path: Path, name: str) -> Path:
+    """Ruta del checkpoint de una proyección (index/projections/<nombre>.json)."""
+    return events_path.parent / PROJECTIONS_DIR / f"{name}.json"
+
+
+def snapshots_dir(events_path: Path, name: str) -> Path:
+    """Directorio de los snapshots as-of de una proyección (index/projections/<nombre>.asof/)."""
+    return events_path.parent / PROJECTIONS_DIR / f"{name}.asof"
+
+
+def _snapshot_path(events_path: Path, name: str, seq: int) -> Path:
+    return snapshots_dir(events_path, name) / f"{seq:06d}.json.gz"
+
+
+def _locked(events_path: Path):
+    """Lock de index/projections/ (checkpoints, snapshots y su reinicio)."""
+    return locking.locked(events_path.parent / PROJECTIONS_DIR, "projections")
+
+
+def _empty(projection: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "format": CHECKPOINT_FORMAT,
+        "version": projection["version"],
+        "cursor": {},
+        "state": projection["initial"](),
+        # Catálogo de snapshots as-of y el tramo aplicado desde el último
+        "asof": {
+            "seq": 0,
+            # Eventos aplicados desde el último snapshot y día (ts) del último
+            "count": 0,
+            "day": None,
+            # Máximo epoch de todo lo aplicado y mínimo del tramo desde el último snapshot
+            "max_epoch": 0.0,
+            "gap_min": None,
+            # [{"seq", "max_epoch", "gap_min", "day"}], en orden
+            "snapshots": [],
+        },
+    }
+
+
+def _signature(path: Path) -> Optional[tuple[int, int, int]]:
+    """Identidad del archivo (inodo, tamaño, mtime) para saber si otro proceso lo reescribió."""
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def _read_checkpoint(events_path: Path, name: str) -> Optional[dict[str, Any]]:
+    """Checkpoint persistido, o None si falta, es ilegible o de otra versión."""
+    try:
+        checkpoint = codec.loads(checkpoint_path(events_path, name).read_bytes())
+    except (OSError, ValueError):
+        return None
+    if (
+        not isinstance(checkpoint, dict)
+        or checkpoint.get("version") != PROJECTIONS[name]["version"]
+        or checkpoint.get("format") != CHECKPOINT_FORMAT
+    ):
+        return None
+    return checkpoint
+
+
+def _write_checkpoint(events_path: Path, name: str, checkpoint: dict[str, Any]) -> None:
+    """Escritura atómica (tmp + rename) para no dejar checkpoints a medias."""
+    path = checkpoint_path(events_path, name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # tmp por proceso e hilo: el server escribe desde varios hilos
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp_path.write_bytes(codec.dumps(checkpoint))
+    os.replace(tmp_path, path)
+    _persisted[(str(events_path), name)] = {
+        "events": 0,
+        "applied": _applied(checkpoint),
+        "signature": _signature(path),
+    }
+
+
+def _applied(checkpoint: Optional[dict[str, Any]]) -> int:
+    """Bytes del log ya aplicados (para elegir el checkpoint más avanzado)."""
+    return sum(checkpoint["cursor"].values()) if checkpoint else -1
+
+
+def _parse(
+    events_path: Path, projection: dict[str, Any], raw_line: bytes, ref_table: Any
+) -> Optional[dict[str, Any]]:
+    """
+    Evento de la línea si es de los tipos de la proyección (sin parsear las
+    demás). Una línea dañada se saltea (ver storage.skip_damaged).
+    """
+    needles = projection["needles"]
+    if not raw_line.strip() or (needles and not any(n in raw_line for n in needles)):
+        return None
+    try:
+        event = codec.loads_line(raw_line)
+    except ValueError:
+        storage.skip_damaged(events_path)
+        return None
+    if projection["types"] and event.get("type") not in projection["types"]:
+        return None
+    return refs.expand(event, ref_table) if ref_table else event
+
+
+def _needs_write(events_path: Path, name: str, checkpoint: dict[str, Any]) -> bool:
+    """True si lo aplicado desde el checkpoint en disco amerita reescribirlo."""
+    persisted = _persisted.get((str(events_path), name))
+    if persisted is None or not checkpoint_path(events_path, name).exists():
+        return True
+    return (
+        persisted["events"] >= CHECKPOINT_EVERY_EVENTS
+        or _applied(checkpoint) - persisted["applied"] >= CHECKPOINT_EVERY_BYTES
+    )
+
+
+def _write_snapshot(events_path: Path, name: str, checkpoint: dict[str, Any]) -> None:
+    """Guarda el estado actual como snapshot as-of y lo agrega al catálogo."""
+    asof = checkpoint["asof"]
+    seq = asof["seq"] + 1
+    path = _snapshot_path(events_path, name, seq)
+    # Un proceso con el checkpoint más avanzado en memoria que en disco no
+    # conoce los snapshots que escribió otro desde entonces: no se pisan
+    while path.exists():
+        seq += 1
+        path = _snapshot_path(events_path, name, seq)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Cursor en la primera línea: `load_at` lo lee sin descomprimir el estado
+    body = codec.dumps({"cursor": checkpoint["cursor"]}) + b"\n" + codec.dumps(checkpoint["state"])
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp_path.write_bytes(gzip.compress(body, compresslevel=1))
+    os.replace(tmp_path, path)
+    asof["snapshots"].append(
+        {"seq": seq, "max_epoch": asof["max_epoch"], "gap_min": asof["gap_min"], "day": asof["day"]}
+    )
+    asof.update(seq=seq, count=0, gap_min=None)
+
+
+def _fork(checkpoint: dict[str, Any]) -> dict[str, Any]:
+    """
+    Checkpoint para avanzar sin tocar el que otros hilos pueden estar
+    leyendo: copia superficial del cursor, el catálogo y los contenedores de
+    primer nivel del estado (los registros se comparten, ver `register`).
+    """
+    asof = dict(checkpoint["asof"], snapshots=list(checkpoint["asof"]["snapshots"]))
+    state = {
+        key: value.copy() if isinstance(value, (dict, list)) else value
+        for key, value in checkpoint["state"].items()
+    }
+    return dict(checkpoint, cursor=dict(checkpoint["cursor"]), asof=asof, state=state)
+
+
+def _advance(
+    events_path: Path, name: str, checkpoint: dict[str, Any], ends: dict[str, int]
+) -> tuple[int, bool]:
+    """
+    Aplica las líneas posteriores al cursor hasta `ends` (final confirmado
+    de cada archivo, ver storage.committed_end). Retorna (eventos aplicados,
+    si se escribió algún snapshot).
+    """
+    projection = PROJECTIONS[name]
+    apply = projection["apply"]
+    state, cursor, asof = checkpoint["state"], checkpoint["cursor"], checkpoint["asof"]
+    settings = storage.load_config(events_path.parent)["projection_snapshots"]
+    every, daily = settings.get("every_events"), settings.get("daily")
+    ref_table = refs.load(events_path.parent) if refs.refs_path(events_path.parent).exists() else None
+    applied = 0
+    snapshotted = False
+    for path in storage.pending_files(events_path, cursor):
+        key = storage.file_key(events_path, path)
+        if key not in ends:
+            # Sin su final confirmado (apareció después de medir): se sigue
+            # en la próxima consulta, sin saltear archivos del orden del log
+            break
+        cut = False
+        for end_offset, raw_line in segments.iter_raw(path, cursor.get(key, 0)):
+            if end_offset > ends[key]:
+                cut = True
+                break
+            event = _parse(events_path, projection, raw_line, ref_table)
+            if event is not None:
+                ts = event.get("ts")
+                day = str(ts or "")[:10]
+                # El snapshot es el estado antes de este evento (cursor todavía sin avanzar)
+                if asof["count"] and (
+                    (every and asof["count"] >= every) or (daily and day > (asof["day"] or ""))
+                ):
+                    _write_snapshot(events_path, name, checkpoint)
+                    snapshotted = True
+                apply(state, event)
+                applied += 1
+                epoch = ts_epoch(ts)
+                asof["count"] += 1
+                asof["day"] = max(day, asof["day"] or "")
+                asof["max_epoch"] = max(epoch, asof["max_epoch"])
+                asof["gap_min"] = epoch if asof["gap_min"] is None else min(epoch, asof["gap_min"])
+            cursor[key] = end_offset
+        if cut:
+            break
+    return applied, snapshotted
+
+
+def load(events_path: Path, name: str) -> dict[str, Any]:
+    """
+    Estado de la proyección `name` al día con el log. Sin líneas nuevas
+    retorna el estado cacheado sin leer el checkpoint ni tomar lock; si hay,
+    avanza con el lock de index/projections/. El checkpoint se relee solo si
+    otro proceso lo reescribió y se persiste cada CHECKPOINT_EVERY_EVENTS
+    eventos o CHECKPOINT_EVERY_BYTES bytes aplicados.
+    """
+    cache_key = (str(events_path), name)
+    checkpoint = _cache.get(cache_key)
+    if checkpoint is not None and not storage.pending_files(events_path, checkpoint["cursor"]):
+        return checkpoint["state"]
+    # Antes del lock de projections/: la recuperación puede tomar el de
+    # index/, y quien tiene el de index/ lee proyecciones (sesión activa)
+    cursor = (
+        checkpoint["cursor"]
+        if checkpoint is not None and storage.cursor_is_valid(events_path, checkpoint["cursor"])
+        else {}
+    )
+    ends = {
+        storage.file_key(events_path, path): storage.committed_end(events_path, path)
+        for path in storage.pending_files(events_path, cursor)
+    }
+    with _locked(events_path):
+        stored = None
+        persisted = _persisted.get(cache_key)
+        signature = _signature(checkpoint_path(events_path, name))
+        if checkpoint is None or persisted is None or persisted["signature"] != signature:
+            # Otro proceso pudo haber avanzado el checkpoint en disco
+            stored = _read_checkpoint(events_path, name)
+            unsaved = persisted["events"] if persisted else 0
+            if _applied(stored) > _applied(checkpoint):
+                checkpoint = stored
+                unsaved = 0
+            _persisted[cache_key] = {"events": unsaved, "applied": _applied(stored), "signature": signature}
+        reset = checkpoint is None or not storage.cursor_is_valid(events_path, checkpoint["cursor"])
+        if reset:
+            checkpoint = _empty(PROJECTIONS[name])
+            # Los snapshots de un checkpoint descartado ya no corresponden al log
+            shutil.rmtree(snapshots_dir(events_path, name), ignore_errors=True)
+            for legacy_name in PROJECTIONS[name]["legacy"]:
+                (events_path.parent / legacy_name).unlink(missing_ok=True)
+        elif checkpoint is not stored:
+            # El estado cacheado puede estar en uso por otro hilo: se avanza una
+            # copia (el recién leído del disco no lo comparte nadie)
+            checkpoint = _fork(checkpoint)
+        applied, snapshotted = _advance(events_path, name, checkpoint, ends)
+        with _cache_lock:
+            if cache_key in _persisted:
+                _persisted[cache_key]["events"] += applied
+        # Un tramo corto queda sin persistir: el próximo proceso lo vuelve a aplicar
+        if reset or snapshotted or _needs_write(events_path, name, checkpoint):
+            _write_checkpoint(events_path, name, checkpoint)
+    with _cache_lock:
+        if _applied(checkpoint) >= _applied(_cache.get(cache_key)):
+            _cache[cache_key] = checkpoint
+    return checkpoint["state"]
+
+
+def _read_snapshot(events_path: Path, name: str, seq: int, state: bool = True) -> dict[str, Any]:
+    """{"cursor", "state"} de un snapshot (`state=False`: solo el cursor)."""
+    with gzip.open(_snapshot_path(events_path, name, seq), "rb") as handle:
+        snapshot = codec.loads(handle.readline())
+        if state:
+            snapshot["state"] = codec.loads(handle.read())
+    return snapshot
+
+
+def load_at(events_path: Path, name: str, at: str) -> dict[str, Any]:
+    """
+    Estado de la proyección `name` con los eventos de ts <= `at` (aplicados
+    en orden del log). Parte del último snapshot cuyo máximo ts no supera
+    `at` y aplica el tramo siguiente hasta el primer snapshot después del
+    cual todos los eventos son posteriores a `at` (el tramo más corto que
+    alcanza aunque los ts del log no estén ordenados).
+    """
+    projection = PROJECTIONS[name]
+    state = load(events_path, name)
+    checkpoint = _cache[(str(events_path), name)]
+    asof = checkpoint["asof"]
+    at_epoch = ts_epoch(at)
+    if asof["max_epoch"] <= at_epoch:
+        return state
+    snapshots = asof["snapshots"]
+    # El máximo de lo aplicado es monótono: bisección sobre el catálogo
+    start = bisect.bisect_right([s["max_epoch"] for s in snapshots], at_epoch)
+    suffix_min = asof["gap_min"] if asof["gap_min"] is not None else float("inf")
+    stop: Optional[dict[str, Any]] = None
+    for snapshot in reversed(snapshots[start:]):
+        if suffix_min <= at_epoch:
+            break
+        stop = snapshot
+        if snapshot["gap_min"] is not None:
+            suffix_min = min(suffix_min, snapshot["gap_min"])
+    try:
+        base = _read_snapshot(events_path, name, snapshots[start - 1]["seq"]) if start else None
+        limit = _read_snapshot(events_path, name, stop["seq"], state=False)["cursor"] if stop else None
+    except (OSError, ValueError, EOFError):
+        # Snapshots borrados o dañados: se reproduce desde el inicio
+        base = limit = None
+    if base is None:
+        base = {"cursor": {}, "state": projection["initial"]()}
+    if limit is None:
+        limit = checkpoint["cursor"]
+    state, cursor = base["state"], base["cursor"]
+    ref_table = refs.load(events_path.parent) if refs.refs_path(events_path.parent).exists() else None
+    for path in storage.log_files(events_path):
+        key = storage.file_key(events_path, path)
+        end = limit.get(key, 0)
+        if cursor.get(key, 0) >= end:
+            continue
+        for end_offset, raw_line in segments.iter_raw(path, cursor.get(key, 0)):
+            if end_offset > end:
+                break
+            event = _parse(events_path, projection, raw_line, ref_table)
+            if event is not None and ts_epoch(event.get("ts")) <= at_epoch:
+                projection["apply"](state, event)
+    return state
+
+
+def rebuild(events_path: Path, name: str) -> dict[str, Any]:
+    """Descarta el checkpoint de la proyección y la reconstruye desde el log."""
+    with _cache_lock:
+        _cache.pop((str(events_path), name), None)
+        _persisted.pop((str(events_path), name), None)
+    with _locked(events_path):
+        checkpoint_path(events_path, name).unlink(missing_ok=True)
+        shutil.rmtree(snapshots_dir(events_path, name), ignore_errors=True)
+    return load(events_path, name)
+
+
+def status(events_path: Path) -> dict[str, dict[str, Any]]:
+    """
+    Por proyección registrada: versión, bytes aplicados, tamaño del
+    checkpoint y snapshots as-of (al día).
+    """
+    result = {}
+    for name, projection in PROJECTIONS.items():
+        load(events_path, name)
+        path = checkpoint_path(events_path, name)
+        checkpoint = _cache.get((str(events_path), name))
+        persisted = _persisted.get((str(events_path), name))
+        if checkpoint is not None and (persisted is None or _applied(checkpoint) > persisted["applied"]):
+            # El tramo pendiente de persistir se escribe para reportar el tamaño real
+            with _locked(events_path):
+                _write_checkpoint(events_path, name, checkpoint)
+        directory = snapshots_dir(events_path, name)
+        snapshot_files = list(directory.glob("*.json.gz")) if directory.exists() else []
+        result[name] = {
+            "version": projection["version"],
+            "applied_bytes": _applied(checkpoint),
+            "bytes": path.stat().st_size if path.exists() else 0,
+            "path": str(path),
+            "snapshots": len(snapshot_files),
+            "snapshot_bytes": sum(snapshot.stat().st_size for snapshot in snapshot_files),
+        }
+    return result
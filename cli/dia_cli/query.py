@@ -0,0 +1,278 @@
+"""
+Consultas ad hoc sobre el log de eventos (`dia query`).
+
+Una consulta es un dict de filtros (ver `build_query`): tipos, rango de días
+o de ts, sesión, repo, tag de proyecto, actor y condiciones sobre campos
+(`payload.error_hash=abc`, `payload.title~timeout`, `actor.role!=bot`...).
+
+`plan` elige cómo leerla con los índices que existan:
+
+- una condición `=` sobre una clave de key_index (event_id, error_hash,
+  fix_id...) se resuelve con el índice y un seek por evento,
+- el resto va a storage.iter_events con los filtros que sabe empujar (tipo,
+  día, sesión, repo, since/until: vistas por tipo, archivo del día, índice
+  de ts, segmentos, espejo SQLite) y lo demás se evalúa sobre cada evento.
+
+`execute` cuenta lo que tocó (líneas o filas leídas, eventos decodificados,
+coincidencias) para que la consulta explique su costo.
+"""
+from __future__ import annotations
+
+import itertools
+import re
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Iterable, Iterator, Optional
+
+from . import codec, key_index, storage
+from .utils import parse_ts, ts_epoch
+
+OPERATORS = ("!=", ">=", "<=", "=", "~", ">", "<")
+_CONDITION = re.compile(r"^\s*([A-Za-z0-9_$.\-]+)\s*(!=|>=|<=|=|~|>|<)(.*)$")
+
+# campo -> clave de key_index (solo para `=`; ver `plan`)
+INDEXED_FIELDS = {
+    "event_id": "event_id",
+    "payload.error_hash": "error_hash",
+    "payload.fix_id": "fix_id",
+    "payload.error_event_id": "error_event_id",
+    "payload.fix_event_id": "fix_event_id",
+}
+
+
+def parse_condition(text: str) -> tuple[str, str, str]:
+    """`campo<op>valor` -> (campo, op, valor). Campos con puntos (`payload.title`)."""
+    match = _CONDITION.match(text)
+    if not match:
+        raise ValueError(
+            f"Condición inválida: {text!r} (usar campo=valor, campo!=valor, campo~texto, "
+            "campo>valor, campo>=valor, campo<valor o campo<=valor)"
+        )
+    field, op, value = match.groups()
+    return field, op, value.strip()
+
+
+def field_value(event: Any, field: str) -> Any:
+    """Valor de un campo con puntos (`payload.error_hash`), o None si falta."""
+    value = event
+    for part in field.split("."):
+        if isinstance(value, dict) or hasattr(value, "get"):
+            value = value.get(part)
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return None
+        if value is None:
+            return None
+    return value
+
+
+def _as_text(value: Any) -> str:
+    return value if isinstance(value, str) else codec.dumps_str(value)
+
+
+def _as_number(text: str) -> Optional[float]:
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def condition_matches(value: Any, op: str, expected: str) -> bool:
+    """
+    Compara el valor de un campo con el de la condición. `~` es "contiene"
+    (sin distinguir mayúsculas); `<`/`>` comparan como número si ambos lo son
+    y si no como texto (ts ISO y day_id ordenan bien como texto).
+    """
+    if value is None:
+        return op == "!=" and expected not in ("", "null")
+    text = _as_text(value)
+    if op == "=":
+        return text == expected
+    if op == "!=":
+        return text != expected
+    if op == "~":
+        return expected.lower() in text.lower()
+    number, wanted = _as_number(text), _as_number(expected)
+    left, right = (number, wanted) if number is not None and wanted is not None else (text, expected)
+    if op == ">":
+        return left > right
+    if op == ">=":
+        return left >= right
+    if op == "<":
+        return left < right
+    return left <= right
+
+
+def _normalize_ts(value: Optional[str]) -> Optional[str]:
+    """Timestamp de `--since`/`--until` con zona (ts_epoch daría 0.0 para uno inválido)."""
+    if not value:
+        return None
+    try:
+        return parse_ts(value)
+    except ValueError:
+        raise ValueError(f"Timestamp inválido: {value!r} (usar ISO 8601, ej: 2026-01-18T10:00)") from None
+
+
+def build_query(
+    types: Optional[Iterable[str]] = None,
+    day: Optional[str] = None,
+    from_day: Optional[str] = None,
+    to_day: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    session_id: Optional[str] = None,
+    repo_path: Optional[str] = None,
+    project: Optional[str] = None,
+    actor: Optional[str] = None,
+    conditions: Iterable[str] = (),
+) -> dict[str, Any]:
+    """
+    Consulta normalizada. `types` acepta listas separadas por coma; `day`
+    equivale a from_day = to_day; `since`/`until` se normalizan con zona (sin
+    zona, hora de Buenos Aires). ValueError si un día, un timestamp o una
+    condición no son válidos.
+    """
+    type_list = [t.strip() for item in types or () for t in item.split(",") if t.strip()]
+    if day:
+        from_day = to_day = day
+    for value in (from_day, to_day):
+        if value:
+            date.fromisoformat(value)
+    since, until = (_normalize_ts(value) for value in (since, until))
+    return {
+        "types": type_list or None,
+        "from_day": from_day,
+        "to_day": to_day,
+        "since": since,
+        "until": until,
+        "session_id": session_id,
+        "repo_path": repo_path,
+        "project": project,
+        "actor": actor,
+        "conditions": [parse_condition(text) for text in conditions],
+    }
+
+
+def _day_bound(day: str, days: int) -> str:
+    """Inicio (hora local) de `day` corrido `days` días: cota gruesa de ts para un rango de días."""
+    return (date.fromisoformat(day) + timedelta(days=days)).isoformat() + "T00:00:00"
+
+
+def matches(event: Any, query: dict[str, Any]) -> bool:
+    """Chequeo completo de la consulta sobre un evento (lo que no se empujó al almacenamiento)."""
+    if query["types"] and event.get("type") not in query["types"]:
+        return False
+    session = event.get("session") or {}
+    day = storage.event_day(event)
+    if query["from_day"] and day < query["from_day"]:
+        return False
+    if query["to_day"] and day > query["to_day"]:
+        return False
+    if query["since"] or query["until"]:
+        epoch = ts_epoch(event.get("ts"))
+        if query["since"] and epoch < ts_epoch(query["since"]):
+            return False
+        if query["until"] and epoch > ts_epoch(query["until"]):
+            return False
+    if query["session_id"] and session.get("session_id") != query["session_id"]:
+        return False
+    if query["repo_path"] and (event.get("repo") or {}).get("path") != query["repo_path"]:
+        return False
+    if query["project"] and (event.get("project") or {}).get("tag") != query["project"]:
+        return False
+    if query["actor"] and (event.get("actor") or {}).get("user_id") != query["actor"]:
+        return False
+    return all(condition_matches(field_value(event, field), op, value) for field, op, value in query["conditions"])
+
+
+def plan(events_path: Path, query: dict[str, Any]) -> dict[str, Any]:
+    """
+    Estrategia de lectura: {"strategy": "key_index", "key": (clave, valor)}
+    o {"strategy": "scan", "pushdown": filtros para storage.iter_events}.
+    """
+    types = set(query["types"] or ())
+    if key_index.is_enabled(events_path):
+        for field, op, value in query["conditions"]:
+            name = INDEXED_FIELDS.get(field)
+            if op != "=" or not name or not value:
+                continue
+            key_types = set(key_index.KEYS[name][0])
+            # Una clave de payload solo se indexa en sus tipos: sirve si la
+            # consulta no pide otros
+            if key_types and not (types and types <= key_types):
+                continue
+            return {"strategy": "key_index", "key": (name, value)}
+    single_day = query["from_day"] if query["from_day"] and query["from_day"] == query["to_day"] else None
+    # El día de un evento es el de inicio de su sesión: su ts no es anterior
+    # (un día de margen por zona horaria), pero una sesión abierta varios días
+    # escribe con ts posteriores, así que to_day no acota el ts
+    since = query["since"] or (_day_bound(query["from_day"], -1) if query["from_day"] else None)
+    return {
+        "strategy": "scan",
+        "pushdown": {
+            "types": query["types"],
+            "day_id": single_day,
+            "session_id": query["session_id"],
+            "repo_path": query["repo_path"],
+            "since": since,
+            "until": query["until"],
+        },
+    }
+
+
+def execute(
+    events_path: Path,
+    query: dict[str, Any],
+    limit: Optional[int] = None,
+    newest_first: bool = False,
+    stats: Optional[dict[str, Any]] = None,
+) -> Iterator[Any]:
+    """
+    Eventos que cumplen la consulta, en orden del log (o del más nuevo al más
+    viejo). `stats` acumula "read", "parsed", "matched" y "plan".
+    """
+    stats = stats if stats is not None else {}
+    stats.update({"read": 0, "parsed": 0, "matched": 0, "plan": []})
+    chosen = plan(events_path, query)
+    if chosen["strategy"] == "key_index":
+        name, value = chosen["key"]
+        stats["plan"].append(f"key_index:{name}")
+        found = key_index.lookup(events_path, name, value, newest_first)
+        stats["read"] = stats["parsed"] = len(found)
+        events: Iterable[Any] = found
+    else:
+        events = storage.iter_events(events_path, newest_first=newest_first, stats=stats, **chosen["pushdown"])
+    selected = (event for event in events if matches(event, query))
+    for event in itertools.islice(selected, limit) if limit else selected:
+        stats["matched"] += 1
+        yield event
+    # storage.iter_events anota el plan al empezar a leer: sin notas, recorrió todo
+    if not stats["plan"]:
+        stats["plan"].append("full_scan")
+
+
+TABLE_COLUMNS = ("ts", "type", "day", "session", "repo", "event_id")
+
+
+def table_row(event: Any) -> tuple[str, ...]:
+    """Fila de `dia query --format table`."""
+    session = event.get("session") or {}
+    repo = (event.get("repo") or {}).get("path") or ""
+    return (
+        str(event.get("ts") or ""),
+        str(event.get("type") or ""),
+        str(storage.event_day(event)),
+        str(session.get("session_id") or ""),
+        Path(repo).name if repo else "",
+        str(event.get("event_id") or ""),
+    )
+
+
+def format_table(rows: list[tuple[str, ...]]) -> str:
+    """Tabla alineada con encabezado (columnas de TABLE_COLUMNS)."""
+    widths = [max([len(column)] + [len(row[i]) for row in rows]) for i, column in enumerate(TABLE_COLUMNS)]
+    lines = ["  ".join(column.ljust(widths[i]) for i, column in enumerate(TABLE_COLUMNS))]
+    lines.append("  ".join("-" * width for width in widths))
+    lines.extend("  ".join(value.ljust(widths[i]) for i, value in enumerate(row)) for row in rows)
+    return "\n".join(line.rstrip() for line in lines)
@@ -0,0 +1,133 @@
+"""
+Diccionario de sub-documentos repetidos del log de eventos (formato compacto).
+
+Casi todas las líneas repiten los mismos objetos `actor`, `project` y `repo`.
+Con `compact_refs` en storage.json, storage.append_event los guarda una vez en
+index/refs.ndjson y la línea del evento los referencia por ID:
+
+    {"event_id": ..., "repo": {"$ref": "5f2c1a9e03b7"}, ...}
+    refs.ndjson: {"id": "5f2c1a9e03b7", "field": "repo", "value": {"path": ..., ...}}
+
+El ID es un hash del contenido: el mismo objeto siempre tiene el mismo ID, sin
+coordinar entre procesos. Las lecturas (storage.iter_events, read_since)
+expanden las referencias al formato de siempre, así que las líneas compactas
+y las completas conviven en el mismo log.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Optional
+
+from . import codec
+
+REFS_NAME = "refs.ndjson"
+REF_FIELDS = ("actor", "project", "repo")
+REF_KEY = "$ref"
+ID_SIZE = 12
+
+# str(refs.ndjson) -> tabla leída (ver `_refresh`)
+_cache: dict[str, dict[str, Any]] = {}
+
+
+def refs_path(index_dir: Path) -> Path:
+    return index_dir / REFS_NAME
+
+
+def ref_id(value: dict[str, Any]) -> str:
+    """ID estable de un sub-documento (hash del JSON con claves ordenadas)."""
+    canonical = json.dumps(value, sort_keys=True, ensure_ascii=True, separators=(",", ":"))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()[:ID_SIZE]
+
+
+def _refresh(entry: dict[str, Any]) -> dict[str, Any]:
+    """Extiende la tabla con las líneas agregadas a refs.ndjson desde la última lectura."""
+    path: Path = entry["path"]
+    try:
+        size = path.stat().st_size
+    except FileNotFoundError:
+        size = 0
+    if size < entry["size"]:
+        entry.update(size=0, table={}, fields={})
+    if size == entry["size"]:
+        return entry
+    with path.open("rb") as handle:
+        handle.seek(entry["size"])
+        for raw_line in handle:
+            if not raw_line.endswith(b"\n"):
+                break
+            entry["size"] += len(raw_line)
+            try:
+                record = codec.loads_line(raw_line)
+            except ValueError:
+                continue
+            entry["table"][record["id"]] = record["value"]
+            entry["fields"][record["id"]] = record.get("field")
+    return entry
+
+
+def load(index_dir: Path) -> dict[str, Any]:
+    """
+    Tabla de index/refs.ndjson al día: dict con `table` ({id: sub-documento})
+    y `fields` ({id: campo}). Se cachea por proceso y se lee incrementalmente.
+    """
+    path = refs_path(index_dir)
+    entry = _cache.get(str(path))
+    if entry is None:
+        entry = _cache[str(path)] = {"path": path, "size": 0, "table": {}, "fields": {}}
+    return _refresh(entry)
+
+
+def ids_matching(index_dir: Path, field: str, key: str, value: Any) -> list[str]:
+    """IDs de `field` cuyo sub-documento tiene `key == value` (ej: repo con ese path)."""
+    entry = load(index_dir)
+    return [
+        ref for ref, ref_field in entry["fields"].items()
+        if ref_field == field and entry["table"][ref].get(key) == value
+    ]
+
+
+def compact(event: dict[str, Any]) -> tuple[dict[str, Any], dict[str, tuple[str, dict[str, Any]]]]:
+    """
+    Reemplaza actor/project/repo por referencias. Retorna (evento compacto,
+    {id: (campo, sub-documento)}) con los sub-documentos referenciados.
+    """
+    compacted = dict(event)
+    used: dict[str, tuple[str, dict[str, Any]]] = {}
+    for field in REF_FIELDS:
+        value = event.get(field)
+        if not isinstance(value, dict) or not value or REF_KEY in value:
+            continue
+        ref = ref_id(value)
+        compacted[field] = {REF_KEY: ref}
+        used[ref] = (field, value)
+    return compacted, used
+
+
+def publish(index_dir: Path, ref: str, field: str, value: dict[str, Any]) -> None:
+    """
+    Agrega el sub-documento a refs.ndjson si todavía no está. Debe correr con
+    el lock de index/ tomado y antes de escribir los eventos que lo referencian.
+    """
+    if ref in load(index_dir)["table"]:
+        return
+    with refs_path(index_dir).open("ab") as handle:
+        handle.write(codec.dumps_line({"id": ref, "field": field, "value": value}))
+
+
+def expand(event: dict[str, Any], refs: dict[str, Any]) -> dict[str, Any]:
+    """
+    Reemplaza (en el mismo dict) las referencias por una copia del sub-documento.
+    `refs` es la tabla de `load()`; si falta un ID se relee refs.ndjson (otro
+    proceso pudo agregarlo) y, si sigue sin estar, la referencia queda como está.
+    """
+    for field in REF_FIELDS:
+        value = event.get(field)
+        if type(value) is dict and len(value) == 1 and REF_KEY in value:
+            resolved: Optional[dict[str, Any]] = refs["table"].get(value[REF_KEY])
+            if resolved is None:
+                resolved = _refresh(refs)["table"].get(value[REF_KEY])
+            if resolved is not None:
+                event[field] = dict(resolved)
+    return event
@@ -0,0 +1,346 @@
+"""
+Segmentos sellados (rotación) de un log NDJSON.
+
+Cuando el archivo activo supera el tamaño/antigüedad configurados se sella:
+sus líneas completas pasan a un segmento comprimido e inmutable en
+segments/<stem>.<seq>.ndjson.gz y el archivo activo queda solo con lo nuevo.
+
+Cada segmento empieza con una línea de header ({"_segment": {...}}) con
+rango de offsets lógicos, cantidad de eventos, min/max ts y días presentes,
+así las lecturas acotadas descartan segmentos sin descomprimirlos.
+
+Offsets lógicos: el primer byte del archivo activo equivale al `end` del
+último segmento. Los cursores persistidos (ej: checkpoint de sesiones)
+siguen siendo válidos después de rotar.
+
+Sellar publica el segmento y recorta el archivo activo con dos renames.
+Antes del primero se escribe una intención (segments/<stem>.seal con el
+corte y el inode del activo): si el proceso muere entre los dos, el
+próximo `finish_seal` (lo llama ndjson.recover al abrir el log) recorta el
+activo, así las líneas selladas no quedan duplicadas.
+"""
+from __future__ import annotations
+
+import gzip
+import io
+import os
+import re
+from pathlib import Path
+from typing import Any, BinaryIO, Iterator, Optional
+
+from . import codec, event_index
+from .utils import now_iso, ts_epoch
+
+SEGMENTS_DIR = "segments"
+HEADER_KEY = "_segment"
+HEADER_VERSION = 1
+COMPRESSIONS = ("gzip", "zstd", "none")
+SEAL_INTENT_SUFFIX = ".seal"
+COPY_CHUNK = 1024 * 1024
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst", "none": ""}
+
+_NAME_RE = re.compile(r"^(?P<stem>.+)\.(?P<seq>\d{6})\.ndjson(?P<suffix>\.gz|\.zst)?$")
+
+# Cache de headers por ruta: (mtime_ns, header). Los segmentos son inmutables.
+_HEADER_CACHE: dict[str, tuple[int, dict[str, Any]]] = {}
+
+
+def _zstd():
+    """Retorna el módulo zstandard si está instalado (dependencia opcional)."""
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def resolve_compression(requested: Optional[str]) -> str:
+    """Compresión efectiva: zstd cae a gzip si zstandard no está instalado."""
+    if requested not in COMPRESSIONS:
+        return "gzip"
+    if requested == "zstd" and _zstd() is None:
+        return "gzip"
+    return requested
+
+
+def segments_dir(log_path: Path) -> Path:
+    return log_path.parent / SEGMENTS_DIR
+
+
+def segment_path(log_path: Path, seq: int, compression: str) -> Path:
+    """Ruta de un segmento: segments/<stem>.<seq>.ndjson[.gz|.zst]."""
+    return segments_dir(log_path) / f"{log_path.stem}.{seq:06d}.ndjson{SUFFIXES[compression]}"
+
+
+def _open_read(path: Path) -> BinaryIO:
+    if path.suffix == ".gz":
+        return gzip.open(path, "rb")
+    if path.suffix == ".zst":
+        zstandard = _zstd()
+        if zstandard is None:
+            raise RuntimeError(
+                f"El segmento {path.name} está comprimido con zstd; instalar 'zstandard'."
+            )
+        raw = zstandard.ZstdDecompressor().stream_reader(path.open("rb"), closefd=True)
+        return io.BufferedReader(raw)
+    return path.open("rb")
+
+
+def _copy_range(source: BinaryIO, out: BinaryIO, length: Optional[int] = None) -> None:
+    """Copia `length` bytes (o hasta el final) de `source` a `out` por bloques."""
+    while length is None or length > 0:
+        chunk = source.read(COPY_CHUNK if length is None else min(COPY_CHUNK, length))
+        if not chunk:
+            break
+        out.write(chunk)
+        if length is not None:
+            length -= len(chunk)
+
+
+def _write_segment(path: Path, compression: str, header: dict[str, Any], log_path: Path, cut: int) -> None:
+    """Escribe header + los primeros `cut` bytes del activo, en streaming."""
+    header_line = codec.dumps_line({HEADER_KEY: header})
+    with log_path.open("rb") as source, path.open("wb") as raw:
+        if compression == "gzip":
+            with gzip.GzipFile(fileobj=raw, mode="wb") as handle:
+                handle.write(header_line)
+                _copy_range(source, handle, cut)
+        elif compression == "zstd":
+            with _zstd().ZstdCompressor().stream_writer(raw, closefd=False) as handle:
+                handle.write(header_line)
+                _copy_range(source, handle, cut)
+        else:
+            raw.write(header_line)
+            _copy_range(source, raw, cut)
+
+
+def _copy_tail(log_path: Path, cut: int) -> Path:
+    """Archivo temporal con lo que sigue al corte (las líneas que quedan en el activo)."""
+    tmp_active = log_path.with_name(f"{log_path.name}.{os.getpid()}.tmp")
+    with log_path.open("rb") as source, tmp_active.open("wb") as out:
+        source.seek(cut)
+        _copy_range(source, out)
+    return tmp_active
+
+
+def intent_path(log_path: Path) -> Path:
+    """Intención de sellado en curso de un log (segments/<stem>.seal)."""
+    return segments_dir(log_path) / f"{log_path.stem}{SEAL_INTENT_SUFFIX}"
+
+
+def finish_seal(log_path: Path) -> bool:
+    """
+    Completa un sellado interrumpido (llamar con el lock de index/ tomado).
+    Si el segmento se publicó pero el activo sigue siendo el de antes del
+    sellado (mismo inode), se le quitan los bytes ya sellados. Retorna True
+    si hubo que recortar el activo.
+    """
+    path = intent_path(log_path)
+    try:
+        intent = codec.loads(path.read_bytes())
+    except FileNotFoundError:
+        return False
+    except ValueError:
+        # Se escribe con tmp + rename: ilegible solo si se dañó después
+        intent = None
+    trimmed = False
+    if intent and log_path.exists() and (segments_dir(log_path) / intent["segment"]).exists():
+        stat = log_path.stat()
+        if (stat.st_ino, stat.st_dev) == (intent["ino"], intent["dev"]) and stat.st_size >= intent["cut"]:
+            os.replace(_copy_tail(log_path, intent["cut"]), log_path)
+            event_index.rebuild_index(log_path)
+            trimmed = True
+    # Temporales del sellado interrumpido (se escriben solo con el lock tomado)
+    for stale in segments_dir(log_path).glob(f"{log_path.stem}.*.tmp"):
+        stale.unlink(missing_ok=True)
+    for stale in log_path.parent.glob(f"{log_path.name}.*.tmp"):
+        stale.unlink(missing_ok=True)
+    path.unlink(missing_ok=True)
+    return trimmed
+
+
+def read_header(path: Path) -> dict[str, Any]:
+    """Header de un segmento (primera línea). Agrega `path` al dict retornado."""
+    mtime = path.stat().st_mtime_ns
+    cached = _HEADER_CACHE.get(str(path))
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with _open_read(path) as handle:
+        header = codec.loads(handle.readline())[HEADER_KEY]
+    header["path"] = str(path)
+    _HEADER_CACHE[str(path)] = (mtime, header)
+    return header
+
+
+def list_segments(log_path: Path) -> list[dict[str, Any]]:
+    """Headers de los segmentos sellados de un log, en orden (seq ascendente)."""
+    directory = segments_dir(log_path)
+    if not directory.exists():
+        return []
+    found: list[tuple[int, Path]] = []
+    for path in directory.glob(f"{log_path.stem}.*.ndjson*"):
+        match = _NAME_RE.match(path.name)
+        if match and match.group("stem") == log_path.stem:
+            found.append((int(match.group("seq")), path))
+    return [read_header(path) for _, path in sorted(found)]
+
+
+def base_offset(log_path: Path) -> int:
+    """Offset lógico del primer byte del archivo activo (fin del último segmento)."""
+    segments = list_segments(log_path)
+    return segments[-1]["end"] if segments else 0
+
+
+def segment_matches(
+    header: dict[str, Any],
+    day_id: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+) -> bool:
+    """False si el segmento no puede contener eventos del día/rango pedido (epochs)."""
+    if day_id and day_id not in header.get("days", []):
+        return False
+    if since is not None and header.get("max_epoch", 0.0) < since:
+        return False
+    if until is not None and header.get("min_epoch", 0.0) > until:
+        return False
+    return True
+
+
+def iter_segment_lines(header: dict[str, Any]) -> Iterator[tuple[int, bytes]]:
+    """Líneas de un segmento sellado como (offset_lógico_fin_de_línea, línea_cruda)."""
+    position = header["start"]
+    with _open_read(Path(header["path"])) as handle:
+        handle.readline()  # header
+        for raw_line in handle:
+            position += len(raw_line)
+            yield position, raw_line
+
+
+def segment_body(header: dict[str, Any]) -> bytes:
+    """Líneas de un segmento sellado (sin el header), descomprimidas en un solo bloque."""
+    with _open_read(Path(header["path"])) as handle:
+        handle.readline()  # header
+        return handle.read()
+
+
+def iter_raw(log_path: Path, start: int = 0) -> Iterator[tuple[int, bytes]]:
+    """
+    Líneas completas del log (segmentos + archivo activo) desde el offset lógico
+    `start`. Retorna (offset_lógico_fin_de_línea, línea_cruda).
+    """
+    segments = list_segments(log_path)
+    for header in segments:
+        if header["end"] <= start:
+            continue
+        for end, raw_line in iter_segment_lines(header):
+            if end > start:
+                yield end, raw_line
+    base = segments[-1]["end"] if segments else 0
+    if not log_path.exists():
+        return
+    with log_path.open("rb") as handle:
+        physical = max(start - base, 0)
+        handle.seek(physical)
+        position = physical
+        for raw_line in handle:
+            if not raw_line.endswith(b"\n"):
+                break
+            position += len(raw_line)
+            yield base + position, raw_line
+
+
+def should_seal(log_path: Path, rotation: dict[str, Any]) -> bool:
+    """True si el archivo activo superó max_bytes o su primer evento es más viejo que max_age_hours."""
+    if not log_path.exists() or log_path.stat().st_size == 0:
+        return False
+    max_bytes = rotation.get("max_bytes")
+    if max_bytes and log_path.stat().st_size >= max_bytes:
+        return True
+    max_age_hours = rotation.get("max_age_hours")
+    if max_age_hours:
+        event_index.ensure_index(log_path)
+        first = event_index.read_entry(log_path, 0)
+        if first and first["ts"] and ts_epoch(now_iso()) - first["ts"] >= max_age_hours * 3600:
+            return True
+    return False
+
+
+def seal(log_path: Path, compression: str = "gzip") -> Optional[dict[str, Any]]:
+    """
+    Sella las líneas completas del archivo activo en un segmento nuevo.
+    Retorna el header del segmento, o None si no había nada para sellar.
+    """
+    from .storage import event_day
+
+    if not log_path.exists():
+        return None
+    finish_seal(log_path)
+
+    # Primera pasada: estadísticas del header y corte (fin de la última línea completa)
+    cut = 0
+    count = 0
+    min_ts: Optional[str] = None
+    max_ts: Optional[str] = None
+    min_epoch = max_epoch = 0.0
+    days: set[str] = set()
+    canonical = True
+    with log_path.open("rb") as handle:
+        for raw_line in handle:
+            if not raw_line.endswith(b"\n"):
+                break
+            cut += len(raw_line)
+            if not raw_line.strip():
+                continue
+            event = codec.loads_line(raw_line)
+            canonical = canonical and raw_line.startswith(event_index.CANONICAL_PREFIX)
+            count += 1
+            days.add(event_day(event))
+            epoch = ts_epoch(event.get("ts"))
+            if min_ts is None or epoch < min_epoch:
+                min_ts, min_epoch = event.get("ts"), epoch
+            if max_ts is None or epoch > max_epoch:
+                max_ts, max_epoch = event.get("ts"), epoch
+    if cut == 0:
+        return None
+
+    compression = resolve_compression(compression)
+    segments = list_segments(log_path)
+    seq = segments[-1]["seq"] + 1 if segments else 1
+    start = segments[-1]["end"] if segments else 0
+    header = {
+        "version": HEADER_VERSION,
+        "seq": seq,
+        "start": start,
+        "end": start + cut,
+        "count": count,
+        "min_ts": min_ts,
+        "max_ts": max_ts,
+        "min_epoch": min_epoch,
+        "max_epoch": max_epoch,
+        "days": sorted(days),
+        # Todas las líneas en orden canónico (ver storage._scan_lines)
+        "canonical": canonical,
+        "compression": compression,
+        "sealed_at": now_iso(),
+    }
+
+    path = segment_path(log_path, seq, compression)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_segment = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    _write_segment(tmp_segment, compression, header, log_path, cut)
+    # Lo que queda después del corte (una línea final incompleta)
+    tmp_active = _copy_tail(log_path, cut)
+
+    stat = log_path.stat()
+    intent = intent_path(log_path)
+    tmp_intent = intent.with_name(f"{intent.name}.{os.getpid()}.tmp")
+    tmp_intent.write_bytes(
+        codec.dumps({"segment": path.name, "cut": cut, "ino": stat.st_ino, "dev": stat.st_dev})
+    )
+    os.replace(tmp_intent, intent)
+    os.replace(tmp_segment, path)
+    os.replace(tmp_active, log_path)
+    intent.unlink()
+    event_index.rebuild_index(log_path)
+    return read_header(path)
@@ -3,18 +3,189 @@ from __future__ import annotations
 from pathlib import Path
 from typing import Any, Optional
 
-from .utils import read_json_lines
+from . import projections
+from .utils import ts_epoch
 
+SESSION_START_TYPES = ("SessionStarted", "SessionStartedAfterDayClosed")
+SESSION_END_TYPES = ("SessionEnded", "SessionForceClosed")
+SESSION_EVENT_TYPES = SESSION_START_TYPES + SESSION_END_TYPES + (
+    "SessionPaused",
+    "SessionResumed",
+    "DayClosed",
+)
+STATE_VERSION = 3
 
-def next_session_id(day_id: str, sessions_path: Path) -> str:
+# Estados de una sesión: active -> paused -> active ... -> ended | force_closed
+OPEN_STATUSES = ("active", "paused")
+
+
+def _empty_state() -> dict[str, Any]:
+    return {
+        # Todas las sesiones (abiertas y cerradas): "day_id:session_id" -> registro
+        "sessions": {},
+        # Evento de inicio de las sesiones abiertas, en orden de inicio
+        "open": {},
+        # Sesiones iniciadas por día (para next_session_id)
+        "started_per_day": {},
+        # Días cerrados: day_id -> closed_at (el primer DayClosed)
+        "closed_days": {},
+    }
+
+
+def _session_key(event: dict[str, Any]) -> str:
+    session = event.get("session") or {}
+    return f"{session.get('day_id')}:{session.get('session_id')}"
+
+
+def _session_record(event: dict[str, Any]) -> dict[str, Any]:
+    session = event.get("session") or {}
+    return {
+        "day_id": session.get("day_id"),
+        "session_id": session.get("session_id"),
+        "intent": session.get("intent"),
+        "dod": session.get("dod"),
+        "mode": session.get("mode"),
+        "start_ts": event.get("ts"),
+        "end_ts": None,
+        "result": None,
+        "repo": event.get("repo"),
+        "project": event.get("project"),
+        "actor": event.get("actor"),
+        "started_after_close": event.get("type") == "SessionStartedAfterDayClosed",
+        "paused_ts": None,
+        "resumed_ts": None,
+        "status": "active",
+    }
+
+
+def apply_session_event(state: dict[str, Any], event: dict[str, Any]) -> None:
+    """
+    Aplica un evento a la máquina de estados de sesiones, en orden del log.
+
+    - Started/StartedAfterDayClosed: abre la sesión (un reinicio con la misma
+      clave la reemplaza).
+    - Paused / Resumed: solo sobre sesiones abiertas. El estado lo decide el
+      último de los dos en el log, no la comparación de timestamps.
+    - Ended / ForceClosed: cierran una sesión abierta; el primero gana (close
+      forzado escribe ForceClosed + Ended).
+    """
+    event_type = event.get("type")
+    sessions = state["sessions"]
+    key = _session_key(event)
+    if event_type in SESSION_START_TYPES:
+        day = (event.get("session") or {}).get("day_id")
+        state["started_per_day"][day] = state["started_per_day"].get(day, 0) + 1
+        if not (event.get("session") or {}).get("session_id"):
+            return
+        sessions[key] = _session_record(event)
+        state["open"].pop(key, None)
+        state["open"][key] = event
+        return
+    if event_type == "DayClosed":
+        day = (event.get("session") or {}).get("day_id")
+        state["closed_days"].setdefault(
+            day, (event.get("payload") or {}).get("closed_at") or event.get("ts")
+        )
+        return
+    record = sessions.get(key)
+    if record is None or record["status"] not in OPEN_STATUSES:
+        return
+    # El registro anterior puede estar en uso: se reemplaza por una copia
+    record = sessions[key] = dict(record)
+    if event_type == "SessionPaused":
+        record["paused_ts"] = event.get("ts")
+        record["status"] = "paused"
+    elif event_type == "SessionResumed":
+        record["resumed_ts"] = event.get("ts")
+        record["status"] = "active"
+    elif event_type in SESSION_END_TYPES:
+        record["end_ts"] = event.get("ts")
+        record["result"] = (event.get("session") or {}).get("result")
+        record["repo"] = event.get("repo") or record["repo"]
+        record["status"] = "ended" if event_type == "SessionEnded" else "force_closed"
+        state["open"].pop(key, None)
+
+
+projections.register(
+    "sessions",
+    STATE_VERSION,
+    _empty_state,
+    apply_session_event,
+    types=SESSION_EVENT_TYPES,
+    # Checkpoint propio anterior a la proyección (junto al log)
+    legacy=("events.state.json",),
+)
+
+
+def load_session_state(log_path: Path, at: Optional[str] = None) -> dict[str, Any]:
+    """
+    Retorna el estado de sesiones al día con el log (proyección "sessions",
+    ver projections.py): solo se aplican los eventos escritos después del
+    checkpoint. Con `at` (ts ISO), el estado a ese momento (desde el snapshot
+    as-of anterior). El estado es compartido; no modificarlo.
+    """
+    if at:
+        return projections.load_at(log_path, "sessions", at)
+    return projections.load(log_path, "sessions")
+
+
+def session_is_paused(entry: dict[str, Any]) -> bool:
+    """Una sesión está pausada si su último pause/resume en el log fue un pause."""
+    return entry.get("status") == "paused"
+
+
+def list_sessions(events_path: Path) -> list[dict[str, Any]]:
+    """Todas las sesiones (registros de la proyección) ordenadas por inicio descendente."""
+    records = list(load_session_state(events_path)["sessions"].values())
+    records.sort(key=lambda record: ts_epoch(record["start_ts"]), reverse=True)
+    return records
+
+
+def open_sessions(
+    events_path: Path, day_id: Optional[str] = None, at: Optional[str] = None
+) -> list[dict[str, Any]]:
+    """
+    Sesiones sin cerrar (activas o pausadas) en orden de inicio, opcionalmente
+    de un día y al momento `at`. Cada una es su registro más `started` (el
+    evento de inicio).
+    """
+    state = load_session_state(events_path, at)
+    entries = []
+    for key, started in state["open"].items():
+        record = state["sessions"][key]
+        if day_id and record["day_id"] != day_id:
+            continue
+        entries.append({**record, "started": started})
+    return entries
+
+
+def latest_open_session(
+    events_path: Path,
+    repo_path: Optional[str] = None,
+    status: Optional[str] = None,
+) -> Optional[dict[str, Any]]:
+    """
+    La sesión abierta iniciada más recientemente (opcionalmente de un repo o
+    en un estado, "active" o "paused"), o None.
+    """
+    for entry in reversed(open_sessions(events_path)):
+        if status and entry["status"] != status:
+            continue
+        if repo_path and (entry["repo"] or {}).get("path") != repo_path:
+            continue
+        return entry
+    return None
+
+
+def is_day_closed(events_path: Path, day_id: str, at: Optional[str] = None) -> bool:
+    """True si existe un DayClosed para el día (hasta `at`, si se pasa)."""
+    return day_id in load_session_state(events_path, at)["closed_days"]
+
+
+def next_session_id(day_id: str, events_path: Path) -> str:
     """Genera el siguiente ID de sesión para un día, contando todas las sesiones iniciadas."""
-    counter = 0
-    for entry in read_json_lines(sessions_path):
-        session = entry.get("session", {})
-        event_type = entry.get("type")
-        # Contar tanto SessionStarted como SessionStartedAfterDayClosed
-        if session.get("day_id") == day_id and event_type in ("SessionStarted", "SessionStartedAfterDayClosed"):
-            counter += 1
+    # Cuenta tanto SessionStarted como SessionStartedAfterDayClosed
+    counter = load_session_state(events_path)["started_per_day"].get(day_id, 0)
     return f"S{counter + 1:02d}"
 
 
@@ -22,95 +193,19 @@ def current_session(
     events_path: Path, repo_path: Optional[str] = None
 ) -> Optional[dict[str, Any]]:
     """Retorna la sesión actual (activa o paused) para un repo específico o global."""
-    sessions: dict[str, dict[str, Any]] = {}
-    for event in read_json_lines(events_path):
-        event_type = event.get("type")
-        # Manejar tanto SessionStarted como SessionStartedAfterDayClosed
-        if event_type in ("SessionStarted", "SessionStartedAfterDayClosed"):
-            session_id = event["session"]["session_id"]
-            sessions[session_id] = {
-                "started": event,
-                "ended": None,
-                "paused": None,
-                "resumed": None,
-            }
-        if event_type == "SessionEnded":
-            session_id = event["session"]["session_id"]
-            if session_id in sessions:
-                sessions[session_id]["ended"] = event
-        if event_type == "SessionPaused":
-            session_id = event["session"]["session_id"]
-            if session_id in sessions:
-                sessions[session_id]["paused"] = event
-                sessions[session_id]["resumed"] = None  # Reset resumed cuando se pausa
-        if event_type == "SessionResumed":
-            session_id = event["session"]["session_id"]
-            if session_id in sessions:
-                sessions[session_id]["resumed"] = event
-    
-    for session_id in reversed(list(sessions.keys())):
-        entry = sessions[session_id]
-        if entry["ended"] is None:  # Sesión no terminada
-            if repo_path:
-                repo = entry["started"].get("repo") or {}
-                if repo.get("path") != repo_path:
-                    continue
-            return entry["started"]
-    return None
+    entry = latest_open_session(events_path, repo_path=repo_path)
+    return entry["started"] if entry else None
 
 
 def active_session(
     events_path: Path, repo_path: Optional[str] = None
 ) -> Optional[dict[str, Any]]:
     """Retorna la sesión activa (no paused) para un repo específico o global.
-    
+
     Una sesión está activa si:
     - Tiene SessionStarted/SessionStartedAfterDayClosed
-    - No tiene SessionEnded
-    - No tiene SessionPaused, o tiene SessionPaused pero también tiene SessionResumed más reciente
+    - No tiene SessionEnded ni SessionForceClosed
+    - No tiene SessionPaused, o el último SessionPaused tiene un SessionResumed después
     """
-    sessions: dict[str, dict[str, Any]] = {}
-    for event in read_json_lines(events_path):
-        event_type = event.get("type")
-        if event_type in ("SessionStarted", "SessionStartedAfterDayClosed"):
-            session_id = event["session"]["session_id"]
-            sessions[session_id] = {
-                "started": event,
-                "ended": None,
-                "paused": None,
-                "resumed": None,
-            }
-        if event_type == "SessionEnded":
-            session_id = event["session"]["session_id"]
-            if session_id in sessions:
-                sessions[session_id]["ended"] = event
-        if event_type == "SessionPaused":
-            session_id = event["session"]["session_id"]
-            if session_id in sessions:
-                sessions[session_id]["paused"] = event
-        if event_type == "SessionResumed":
-            session_id = event["session"]["session_id"]
-            if session_id in sessions:
-                sessions[session_id]["resumed"] = event
-    
-    for session_id in reversed(list(sessions.keys())):
-        entry = sessions[session_id]
-        if entry["ended"] is None:  # Sesión no terminada
-            # Verificar si está paused (tiene pause pero no resume más reciente)
-            if entry["paused"]:
-                if not entry["resumed"]:
-                    # Está paused, no es activa
-                    continue
-                # Tiene resume, verificar que resume sea más reciente que pause
-                paused_ts = entry["paused"].get("ts", "")
-                resumed_ts = entry["resumed"].get("ts", "")
-                if paused_ts > resumed_ts:
-                    # Pause es más reciente, está paused
-                    continue
-            
-            if repo_path:
-                repo = entry["started"].get("repo") or {}
-                if repo.get("path") != repo_path:
-                    continue
-            return entry["started"]
-    return None
+    entry = latest_open_session(events_path, repo_path=repo_path, status="active")
+    return entry["started"] if entry else None
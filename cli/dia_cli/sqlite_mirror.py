@@ -0,0 +1,270 @@
+"""
+Espejo SQLite (opcional) del log de eventos.
+
+El NDJSON sigue siendo la fuente de verdad: index/mirror.sqlite3 es una
+proyección derivada que se pone al día incrementalmente desde el cursor
+({archivo: offset lógico}, igual que los checkpoints de projections.py) guardado en
+la propia base. Si el cursor deja de corresponder al log (truncado,
+migración de layout), se reconstruye desde cero.
+
+Se activa con `"sqlite_mirror": true` en index/storage.json
+(`dia storage mirror enable`). Desactivado, las funciones de consulta de
+este módulo caen al recorrido en streaming de `storage`.
+"""
+from __future__ import annotations
+
+import contextlib
+import json
+import sqlite3
+from pathlib import Path
+from typing import Any, Iterable, Iterator, Optional
+
+from . import codec, storage
+from .event import Event
+from .utils import ts_epoch
+
+MIRROR_NAME = "mirror.sqlite3"
+SCHEMA_VERSION = 4
+
+SUMMARY_MODES = {"RollingSummaryGenerated": "rolling", "DailySummaryGenerated": "nightly"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    event_id TEXT,
+    ts TEXT,
+    ts_epoch REAL,
+    type TEXT,
+    day_id TEXT,
+    session_id TEXT,
+    repo_path TEXT,
+    raw TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_type ON events (type, id);
+CREATE INDEX IF NOT EXISTS events_day ON events (day_id, id);
+CREATE INDEX IF NOT EXISTS events_session ON events (session_id, id);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts_epoch);
+CREATE INDEX IF NOT EXISTS events_event_id ON events (event_id);
+CREATE TABLE IF NOT EXISTS summaries (
+    event_id TEXT PRIMARY KEY,
+    ts TEXT,
+    day_id TEXT,
+    mode TEXT
+);
+CREATE INDEX IF NOT EXISTS summaries_day ON summaries (day_id, mode, ts);
+"""
+
+PROJECTION_TABLES = ("events", "summaries")
+# Tablas de versiones anteriores del esquema (se borran al reconstruir)
+OBSOLETE_TABLES = ("sessions", "fixes", "captures")
+
+
+def mirror_path(events_path: Path) -> Path:
+    return events_path.parent / MIRROR_NAME
+
+
+def is_enabled(events_path: Path) -> bool:
+    return bool(storage.load_config(events_path.parent).get("sqlite_mirror"))
+
+
+def _connect(path: Any) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(path), timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _get_meta(conn: sqlite3.Connection, key: str) -> Optional[str]:
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row["value"] if row else None
+
+
+def _set_meta(conn: sqlite3.Connection, key: str, value: str) -> None:
+    conn.execute(
+        "INSERT INTO meta (key, value) VALUES (?, ?) "
+        "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+        (key, value),
+    )
+
+
+def _clear(conn: sqlite3.Connection) -> None:
+    """Vacía el espejo y recrea las tablas con el esquema actual (dentro de la transacción)."""
+    for table in OBSOLETE_TABLES + PROJECTION_TABLES:
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+    for statement in SCHEMA.split(";"):
+        if statement.strip():
+            conn.execute(statement)
+    conn.execute("DELETE FROM meta")
+
+
+def apply_event(conn: sqlite3.Connection, event: dict[str, Any], raw: Optional[str] = None) -> None:
+    """Aplica un evento a las tablas de proyección."""
+    event_type = event.get("type")
+    session = event.get("session") or {}
+    payload = event.get("payload") or {}
+    day_id = session.get("day_id")
+    session_id = session.get("session_id")
+    conn.execute(
+        "INSERT INTO events (event_id, ts, ts_epoch, type, day_id, session_id, repo_path, raw) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            event.get("event_id"),
+            event.get("ts"),
+            ts_epoch(event.get("ts")),
+            event_type,
+            day_id,
+            session_id,
+            (event.get("repo") or {}).get("path"),
+            raw if raw is not None else codec.dumps_str(event),
+        ),
+    )
+
+    if event_type in SUMMARY_MODES:
+        conn.execute(
+            "INSERT OR REPLACE INTO summaries (event_id, ts, day_id, mode) VALUES (?, ?, ?, ?)",
+            (
+                event.get("event_id"),
+                event.get("ts"),
+                day_id,
+                payload.get("mode") or SUMMARY_MODES[event_type],
+            ),
+        )
+
+
+def sync(conn: sqlite3.Connection, events_path: Path) -> int:
+    """
+    Pone el espejo al día con el log. Retorna la cantidad de eventos aplicados.
+
+    Sin líneas nuevas después del cursor no abre transacción (las lecturas
+    no esperan a otro writer). Si hay, corre en una transacción IMMEDIATE:
+    si dos procesos sincronizan a la vez, el segundo espera y re-lee el
+    cursor ya avanzado por el primero.
+    """
+    cursor = _get_meta(conn, "cursor")
+    if (
+        cursor is not None
+        and _get_meta(conn, "schema_version") == str(SCHEMA_VERSION)
+        and not storage.pending_files(events_path, json.loads(cursor))
+    ):
+        return 0
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cursor = json.loads(_get_meta(conn, "cursor") or "{}")
+        version = _get_meta(conn, "schema_version")
+        if version != str(SCHEMA_VERSION) or not storage.cursor_is_valid(events_path, cursor):
+            _clear(conn)
+            _set_meta(conn, "schema_version", str(SCHEMA_VERSION))
+            cursor = {}
+        applied = 0
+        for key, end_offset, event in storage.read_since(events_path, cursor):
+            apply_event(conn, event)
+            cursor[key] = end_offset
+            applied += 1
+        if applied or _get_meta(conn, "cursor") is None:
+            _set_meta(conn, "cursor", json.dumps(cursor))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return applied
+
+
+@contextlib.contextmanager
+def opened(events_path: Path) -> Iterator[Optional[sqlite3.Connection]]:
+    """Conexión al espejo ya sincronizado, o None si el espejo está desactivado."""
+    if not is_enabled(events_path):
+        yield None
+        return
+    conn = _connect(mirror_path(events_path))
+    try:
+        sync(conn, events_path)
+        yield conn
+    finally:
+        conn.close()
+
+
+def rebuild(events_path: Path) -> int:
+    """Reconstruye el espejo desde cero. Retorna la cantidad de eventos."""
+    conn = _connect(mirror_path(events_path))
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        _clear(conn)
+        conn.execute("COMMIT")
+        return sync(conn, events_path)
+    finally:
+        conn.close()
+
+
+def query_events(
+    conn: sqlite3.Connection,
+    types: Optional[Iterable[str]] = None,
+    day_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    repo_path: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    newest_first: bool = False,
+) -> Iterator[dict[str, Any]]:
+    """Eventos filtrados por columnas indexadas, en orden del log (o inverso)."""
+    clauses: list[str] = []
+    params: list[Any] = []
+    if types:
+        types = list(types)
+        clauses.append(f"type IN ({', '.join('?' for _ in types)})")
+        params.extend(types)
+    for column, value in (("day_id", day_id), ("session_id", session_id), ("repo_path", repo_path)):
+        if value:
+            clauses.append(f"{column} = ?")
+            params.append(value)
+    if since:
+        clauses.append("ts_epoch >= ?")
+        params.append(ts_epoch(since))
+    if until:
+        clauses.append("ts_epoch <= ?")
+        params.append(ts_epoch(until))
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    order = "DESC" if newest_first else "ASC"
+    for row in conn.execute(f"SELECT raw FROM events {where} ORDER BY id {order}", params):
+        yield Event(row["raw"])
+
+
+def _first_raw(conn: sqlite3.Connection, sql: str, params: tuple) -> Optional[dict[str, Any]]:
+    row = conn.execute(sql, params).fetchone()
+    return Event(row["raw"]) if row else None
+
+
+def count_events(events_path: Path, types: Optional[Iterable[str]] = None) -> int:
+    """Cantidad de eventos (opcionalmente de ciertos tipos)."""
+    with opened(events_path) as conn:
+        if conn is None:
+            if not types:
+                return storage.count_events(events_path)
+            return sum(1 for _ in storage.iter_events(events_path, types=types))
+        if not types:
+            return conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+        types = list(types)
+        return conn.execute(
+            f"SELECT COUNT(*) FROM events WHERE type IN ({', '.join('?' for _ in types)})",
+            types,
+        ).fetchone()[0]
+
+
+def latest_summary(events_path: Path, day_id: str, mode: str) -> Optional[dict[str, Any]]:
+    """
+    Último resumen del día en ese modo (requiere el espejo activo). Ordena por
+    ts_epoch (los ts ISO con distinto offset no se comparan como texto) y,
+    a igual instante, por orden del log.
+    """
+    with opened(events_path) as conn:
+        if conn is None:
+            return None
+        return _first_raw(
+            conn,
+            "SELECT e.raw FROM summaries s JOIN events e ON e.event_id = s.event_id "
+            "WHERE s.day_id = ? AND s.mode = ? ORDER BY e.ts_epoch DESC, e.id DESC LIMIT 1",
+            (day_id, mode),
+        )
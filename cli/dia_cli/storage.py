@@ -0,0 +1,953 @@
+"""
+Layout de almacenamiento del log de eventos.
+
+Dos layouts soportados (configurados en index/storage.json):
+- "single" (default): todo en index/events.ndjson.
+- "daily": un archivo por día en index/events/YYYY-MM-DD.ndjson. Las consultas
+  acotadas a un día abren solo ese archivo.
+
+En ambos layouts el archivo activo puede rotarse en segmentos comprimidos
+(ver segments.py) según `rotation` en storage.json.
+
+Sesiones y resúmenes se leen del mismo log (vistas de type_views.py).
+Todas las lecturas/escrituras del log de eventos pasan por este módulo para
+que el layout sea transparente para comandos y vistas del servidor.
+"""
+from __future__ import annotations
+
+import functools
+import itertools
+import json
+import mmap
+import os
+import re
+import shutil
+import sys
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from . import blobs, codec, event_index, locking, refs, segments
+from .event import Event
+from .ndjson import EventWriter, batch_intent_path, last_line_end, read_lines_reverse, recover
+from .utils import ts_epoch
+
+EVENTS_LOG = "events.ndjson"
+DAILY_DIR = "events"
+CONFIG_NAME = "storage.json"
+LAYOUTS = ("single", "daily")
+
+DEFAULT_ROTATION: dict[str, Any] = {
+    # Sin límites configurados no se rota
+    "max_bytes": None,
+    "max_age_hours": None,
+    "compression": "gzip",
+}
+
+DEFAULT_PROJECTION_SNAPSHOTS: dict[str, Any] = {
+    # Un snapshot cada tantos eventos aplicados (None: no) y al cambiar el día del ts
+    "every_events": 10000,
+    "daily": True,
+}
+
+DEFAULT_CONFIG: dict[str, Any] = {
+    "layout": "single",
+    "rotation": DEFAULT_ROTATION,
+    # Espejo SQLite de consultas (index/mirror.sqlite3), ver sqlite_mirror.py
+    "sqlite_mirror": False,
+    # fsync al confirmar cada lote de EventWriter
+    "fsync": False,
+    # actor/project/repo como referencias a index/refs.ndjson, ver refs.py
+    "compact_refs": False,
+    # Campos del payload más grandes que esto (bytes) van a artifacts/blobs/,
+    # ver blobs.py (None: no mover)
+    "offload_bytes": 16384,
+    # Índice por event_id/capture_id/error_hash/fix_id (index/keys.sqlite3),
+    # ver key_index.py
+    "key_index": True,
+    # Procesos para reconstrucciones en paralelo (None: uno por CPU), ver parallel.py
+    "parallel_workers": None,
+    # Snapshots as-of de las proyecciones (consultas `--at`), ver projections.py
+    "projection_snapshots": DEFAULT_PROJECTION_SNAPSHOTS,
+}
+
+
+def config_path(index_dir: Path) -> Path:
+    return index_dir / CONFIG_NAME
+
+
+def load_config(index_dir: Path) -> dict[str, Any]:
+    """Carga index/storage.json mergeado sobre los defaults."""
+    config = dict(DEFAULT_CONFIG)
+    path = config_path(index_dir)
+    if path.exists():
+        with path.open("r", encoding="utf-8") as handle:
+            config.update(json.load(handle))
+    config["rotation"] = {**DEFAULT_ROTATION, **(config.get("rotation") or {})}
+    config["projection_snapshots"] = {
+        **DEFAULT_PROJECTION_SNAPSHOTS,
+        **(config.get("projection_snapshots") or {}),
+    }
+    return config
+
+
+def save_config(index_dir: Path, config: dict[str, Any]) -> None:
+    path = config_path(index_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(config, indent=2, ensure_ascii=True), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def is_daily(events_path: Path) -> bool:
+    """True si el log de eventos usa layout particionado por día."""
+    if events_path.name != EVENTS_LOG:
+        return False
+    return load_config(events_path.parent)["layout"] == "daily"
+
+
+def daily_dir(events_path: Path) -> Path:
+    return events_path.parent / DAILY_DIR
+
+
+def day_log_path(events_path: Path, day: str) -> Path:
+    """Archivo del día en layout daily: index/events/YYYY-MM-DD.ndjson."""
+    return daily_dir(events_path) / f"{day}.ndjson"
+
+
+def event_day(event: dict[str, Any]) -> str:
+    """Día al que pertenece un evento (session.day_id, o fecha del ts como fallback)."""
+    day = (event.get("session") or {}).get("day_id")
+    if day:
+        return day
+    ts = event.get("ts") or ""
+    return ts[:10] if len(ts) >= 10 else "undated"
+
+
+# Líneas dañadas (CRC o JSON inválido) salteadas al leer, por log. recover
+# solo pone en cuarentena la cola sin indexar; una línea dañada en la parte
+# ya indexada se saltea (y cuenta) en cada lectura
+DAMAGED_LINES: dict[str, int] = {}
+
+
+def skip_damaged(events_path: Path) -> None:
+    """Cuenta una línea dañada salteada al leer el log; avisa por stderr solo la primera vez."""
+    key = str(events_path)
+    DAMAGED_LINES[key] = DAMAGED_LINES.get(key, 0) + 1
+    if DAMAGED_LINES[key] == 1:
+        print(
+            f"Aviso: se saltean líneas dañadas (CRC o JSON inválido) de {events_path}",
+            file=sys.stderr,
+        )
+
+
+def decode_event(
+    events_path: Path, raw_line: bytes, ref_table: Optional[dict[str, Any]] = None
+) -> Optional[Event]:
+    """`Event` de una línea cruda, o None si está dañada (ver `skip_damaged`)."""
+    if codec.check_line(raw_line) is False:
+        skip_damaged(events_path)
+        return None
+    try:
+        return Event(raw_line.rstrip(b"\r\n"), ref_table)
+    except ValueError:
+        skip_damaged(events_path)
+        return None
+
+
+def locked(events_path: Path, label: str = "") -> Iterator[float]:
+    """
+    Lock entre procesos (CLI y server) del directorio index/ del log, para
+    secuencias leer-modificar-escribir. Ver locking.locked.
+    """
+    return locking.locked(events_path.parent, label)
+
+
+def event_writer(events_path: Path, label: str = "append") -> EventWriter:
+    """EventWriter que confirma con el lock de index/ tomado y fsync según storage.json."""
+    return EventWriter(
+        fsync=bool(load_config(events_path.parent).get("fsync")),
+        lock_dir=events_path.parent,
+        label=label,
+    )
+
+
+def _seal_if_needed(path: Path, rotation: dict[str, Any]) -> None:
+    if segments.should_seal(path, rotation):
+        segments.seal(path, rotation["compression"])
+
+
+def append_event(
+    events_path: Path, event: dict[str, Any], writer: Optional[EventWriter] = None
+) -> None:
+    """
+    Agrega un evento al log respetando el layout y la rotación configurados.
+    Con `writer` el evento se suma al lote y se escribe al confirmarlo; sin
+    `writer` se escribe ya, como un lote de un evento (con lock).
+
+    Con `compact_refs` la línea referencia actor/project/repo en refs.ndjson;
+    los sub-documentos nuevos se publican antes de escribir el lote.
+
+    Los campos del payload de más de `offload_bytes` se guardan como blobs y
+    la línea lleva la referencia (ver blobs.py y `resolve_blobs`).
+
+    Los índices derivados (key_index, vistas, proyecciones) no se tocan acá:
+    cada uno se pone al día al consultarlo, fuera del lock de escritura.
+    """
+    if writer is None:
+        with event_writer(events_path) as single:
+            append_event(events_path, event, single)
+        return
+    index_dir = events_path.parent
+    config = load_config(index_dir)
+    if config["layout"] == "daily" and events_path.name == EVENTS_LOG:
+        path = day_log_path(events_path, event_day(event))
+    else:
+        path = events_path
+    rotation = config["rotation"]
+    threshold = config.get("offload_bytes")
+    if threshold and isinstance(event.get("payload"), dict):
+        payload = blobs.offload(index_dir, event["payload"], threshold)
+        if payload is not event["payload"]:
+            event = dict(event, payload=payload)
+    if config.get("compact_refs"):
+        event, used = refs.compact(event)
+        known = refs.load(index_dir)["table"]
+        for ref, (field, value) in used.items():
+            if ref not in known:
+                writer.before_write(
+                    ("ref", index_dir, ref), functools.partial(refs.publish, index_dir, ref, field, value)
+                )
+    writer.append(path, event)
+    writer.after_commit(("seal", path), lambda: _seal_if_needed(path, rotation))
+
+
+def resolve_blobs(events_path: Path, value: Any) -> Any:
+    """Reemplaza las referencias a blobs de `value` (ej: un payload) por su contenido."""
+    return blobs.resolve(events_path.parent, value)
+
+
+def _has_log(path: Path) -> bool:
+    return path.exists() or bool(segments.list_segments(path))
+
+
+def log_files(events_path: Path, day_ids: Optional[Iterable[str]] = None) -> list[Path]:
+    """
+    Archivos activos que componen un log, en orden de lectura. Cada uno puede
+    tener segmentos sellados (se incluye aunque el activo no exista).
+
+    En layout daily retorna el legacy events.ndjson (si quedó sin migrar) y los
+    archivos de día; si se pasan `day_ids`, solo los de esos días.
+    """
+    if not is_daily(events_path):
+        return [events_path] if _has_log(events_path) else []
+    files: list[Path] = []
+    if events_path.exists():
+        files.append(events_path)
+    if day_ids is not None:
+        for day in sorted(set(day_ids)):
+            path = day_log_path(events_path, day)
+            if _has_log(path):
+                files.append(path)
+        return files
+    directory = daily_dir(events_path)
+    days: set[str] = set()
+    if directory.exists():
+        days.update(path.stem for path in directory.glob("*.ndjson"))
+        sealed_dir = directory / segments.SEGMENTS_DIR
+        if sealed_dir.exists():
+            days.update(path.name.split(".", 1)[0] for path in sealed_dir.glob("*.ndjson*"))
+    files.extend(day_log_path(events_path, day) for day in sorted(days))
+    return files
+
+
+_TYPE_PREFIX = event_index.CANONICAL_PREFIX
+_TS_KEY = b',"ts":"'
+
+
+def _needle_forms(key: str, value: str) -> tuple[bytes, ...]:
+    """
+    Formas en que `"key": value` puede aparecer en una línea cruda: con no-ASCII
+    escapado y separador `": "` (líneas escritas con json.dumps) o compacto en
+    UTF-8 (codec). Incluir la clave evita candidatos falsos (el mismo valor en
+    otro campo del payload).
+    """
+    values = {json.dumps(value, ensure_ascii=True).encode("utf-8"), codec.dumps(value)}
+    quoted_key = codec.dumps(key)
+    return tuple(quoted_key + separator + form for form in values for separator in (b":", b": "))
+
+
+def _canonical_form(key: str, value: str) -> bytes:
+    """Única forma de `"key": value` en líneas escritas por ndjson.encode_line."""
+    return codec.dumps(key) + b":" + codec.dumps(value)
+
+
+def _filter(
+    types: Optional[Iterable[str]],
+    day_id: Optional[str],
+    session_id: Optional[str],
+    repo_path: Optional[str],
+    since_epoch: Optional[float],
+    until_epoch: Optional[float],
+    where: Optional[Callable[[dict[str, Any]], bool]],
+    repo_refs: Iterable[str] = (),
+) -> tuple[
+    Callable[[bytes], bool], Callable[[dict[str, Any]], bool], tuple[tuple[bytes, ...], tuple[bytes, ...]]
+]:
+    """
+    Arma el predicado en dos niveles:
+    - prefiltro sobre la línea cruda (descarta sin parsear): en líneas con orden
+      canónico (ver ndjson.canonical_order) tipo y ts se comparan por prefijo;
+      en las demás, substrings que el JSON debe contener,
+    - chequeo exacto sobre el evento parseado.
+
+    Retorna también los substrings a buscar en el archivo para encontrar las
+    líneas candidatas (ver `_scan_lines`): (todas las formas, solo la forma
+    canónica), vacíos si no hay filtro de tipo ni de valor.
+
+    `repo_refs` son los IDs de refs.ndjson del repo buscado: una línea compacta
+    contiene el ID en vez del path.
+    """
+    type_set = set(types) if types else None
+    type_needles = tuple(form for t in type_set for form in _needle_forms("type", t)) if type_set else ()
+    type_prefixes = tuple(_TYPE_PREFIX + codec.dumps(t) + b"," for t in type_set) if type_set else ()
+    needles = [
+        _needle_forms(key, value)
+        for key, value in (("day_id", day_id), ("session_id", session_id))
+        if value
+    ]
+    if repo_path:
+        needles.append(
+            _needle_forms("path", repo_path)
+            + tuple(form for ref in repo_refs for form in _needle_forms(refs.REF_KEY, ref))
+        )
+    check_ts = since_epoch is not None or until_epoch is not None
+    if type_set:
+        scan = (type_needles, type_prefixes)
+    elif day_id or session_id:
+        key, value = ("day_id", day_id) if day_id else ("session_id", session_id)
+        scan = (needles[0], (_canonical_form(key, value),))
+    elif repo_path:
+        scan = (needles[0], tuple(_canonical_form(*pair) for pair in (
+            [("path", repo_path)] + [(refs.REF_KEY, ref) for ref in repo_refs]
+        )))
+    else:
+        scan = ((), ())
+
+    def raw_ok(raw_line: bytes) -> bool:
+        if raw_line.startswith(_TYPE_PREFIX):
+            if type_prefixes and not raw_line.startswith(type_prefixes):
+                return False
+            if check_ts:
+                epoch = _line_ts(raw_line)
+                if epoch is not None and (
+                    (since_epoch is not None and epoch < since_epoch)
+                    or (until_epoch is not None and epoch > until_epoch)
+                ):
+                    return False
+        elif type_needles and not any(needle in raw_line for needle in type_needles):
+            return False
+        return all(any(form in raw_line for form in forms) for forms in needles)
+
+    def event_ok(event: dict[str, Any]) -> bool:
+        if type_set and event.get("type") not in type_set:
+            return False
+        session = event.get("session") or {}
+        if day_id and session.get("day_id") != day_id:
+            return False
+        if session_id and session.get("session_id") != session_id:
+            return False
+        if repo_path and (event.get("repo") or {}).get("path") != repo_path:
+            return False
+        if since_epoch is not None or until_epoch is not None:
+            epoch = ts_epoch(event.get("ts"))
+            if since_epoch is not None and epoch < since_epoch:
+                return False
+            if until_epoch is not None and epoch > until_epoch:
+                return False
+        return where(event) if where else True
+
+    return raw_ok, event_ok, scan
+
+
+def _line_ts(raw_line: bytes) -> Optional[float]:
+    """ts de una línea con orden canónico, sin parsear el JSON. None si no está en su lugar."""
+    type_end = raw_line.find(b'"', len(_TYPE_PREFIX) + 1)
+    if type_end == -1 or not raw_line.startswith(_TS_KEY, type_end + 1):
+        return None
+    start = type_end + 1 + len(_TS_KEY)
+    end = raw_line.find(b'"', start)
+    if end == -1:
+        return None
+    return ts_epoch(raw_line[start:end].decode("ascii", errors="replace"))
+
+
+def _scan_lines(
+    buffer: Any,
+    scan: tuple[tuple[bytes, ...], tuple[bytes, ...]],
+    start: int = 0,
+    canonical: bool = False,
+) -> Iterator[bytes]:
+    """
+    Líneas completas de `buffer` (bytes o mmap), desde el inicio de línea
+    `start`, que contienen alguno de los substrings de `scan` (ver `_filter`).
+    Los busca con find() (en C) y solo arma las líneas donde hay
+    coincidencia: las demás no se recorren en Python.
+
+    Con `canonical` (todas las líneas del buffer en orden canónico, según la
+    metadata del índice o el header del segmento) alcanza con buscar la forma
+    canónica; si no, todas las formas: `dia storage migrate` copia líneas
+    viejas tal cual a archivos de día que ya tienen líneas canónicas.
+    """
+    needles = scan[1] if canonical else scan[0]
+    if len(needles) == 1:
+        needle = needles[0]
+
+        def search(position: int) -> int:
+            return buffer.find(needle, position)
+    else:
+        # Una sola pasada por el buffer para varios substrings
+        pattern = re.compile(b"|".join(re.escape(needle) for needle in needles))
+
+        def search(position: int) -> int:
+            match = pattern.search(buffer, position)
+            return match.start() if match else -1
+
+    position = start
+    while True:
+        hit = search(position)
+        if hit == -1:
+            return
+        line_start = buffer.rfind(b"\n", position, hit) + 1 or position
+        line_end = buffer.find(b"\n", hit)
+        if line_end == -1:
+            # Línea final incompleta (escritura en curso)
+            return
+        yield buffer[line_start:line_end + 1]
+        position = line_end + 1
+
+
+def _active_lines(
+    path: Path,
+    types: Optional[Iterable[str]],
+    since_epoch: Optional[float],
+    until_epoch: Optional[float],
+    newest_first: bool,
+    scan: tuple[tuple[bytes, ...], tuple[bytes, ...]] = ((), ()),
+    start: int = 0,
+) -> Iterator[bytes]:
+    """
+    Líneas del archivo activo desde el offset físico `start` (inicio de
+    línea; ver ts_index). Hacia adelante y con `scan` (filtro de tipo o
+    de valor) busca los substrings sobre un mmap del archivo y solo arma las
+    líneas candidatas. Con filtro de tipo/ts usa el índice sidecar: descarta
+    por tipo/ts sin leer la línea y salta a su offset. Sin filtros se lee
+    secuencialmente (hacia atrás por bloques con `newest_first`).
+    """
+    if not path.exists():
+        return
+    if scan[0] and not newest_first:
+        # Antes de medir el archivo: lo agregado después no se verificó
+        canonical_end = event_index.canonical_bytes(path)
+        with path.open("rb") as handle:
+            size = os.fstat(handle.fileno()).st_size
+            if size <= start:
+                return
+            with mmap.mmap(handle.fileno(), size, access=mmap.ACCESS_READ) as buffer:
+                yield from _scan_lines(buffer, scan, start, canonical=size <= canonical_end)
+        return
+    if not (types or since_epoch is not None or until_epoch is not None):
+        if newest_first:
+            yield from read_lines_reverse(path)
+            return
+        with path.open("rb") as handle:
+            handle.seek(start)
+            for raw_line in handle:
+                if not raw_line.endswith(b"\n"):
+                    break
+                yield raw_line
+        return
+    event_index.ensure_index(path)
+    index_types = {t[:event_index.TYPE_SIZE] for t in types} if types else None
+    if newest_first:
+        entries = event_index.iter_entries_reverse(path)
+    else:
+        entries = event_index.iter_entries(path, event_index.line_at(path, start) if start else 0)
+    with path.open("rb") as handle:
+        for entry in entries:
+            if entry["offset"] < start:
+                # Hacia atrás: antes de `start` ninguna línea cumple since
+                break
+            if index_types and entry["type"] not in index_types:
+                continue
+            # ts inválidos se indexan como 0.0: solo se descartan con since
+            if since_epoch is not None and entry["ts"] < since_epoch:
+                continue
+            if until_epoch is not None and entry["ts"] and entry["ts"] > until_epoch:
+                continue
+            handle.seek(entry["offset"])
+            yield handle.read(entry["length"])
+
+
+def _ref_table(events_path: Path) -> Optional[dict[str, Any]]:
+    """Tabla de refs.ndjson para expandir líneas compactas, o None si no hay."""
+    if not refs.refs_path(events_path.parent).exists():
+        return None
+    return refs.load(events_path.parent)
+
+
+def _segment_lines(
+    header: dict[str, Any], scan: tuple[tuple[bytes, ...], tuple[bytes, ...]]
+) -> Iterator[bytes]:
+    """Líneas de un segmento sellado; con `scan`, solo las candidatas (ver `_scan_lines`)."""
+    if scan[0]:
+        return _scan_lines(segments.segment_body(header), scan, canonical=header.get("canonical", False))
+    return (raw for _, raw in segments.iter_segment_lines(header))
+
+
+def iter_events(
+    events_path: Path,
+    types: Optional[Iterable[str]] = None,
+    day_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    repo_path: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    where: Optional[Callable[[dict[str, Any]], bool]] = None,
+    newest_first: bool = False,
+    stats: Optional[dict[str, Any]] = None,
+) -> Iterator[Event]:
+    """
+    Itera eventos del log (segmentos sellados + archivos activos) que cumplen
+    los filtros, de a uno y sin cargar el log en memoria. Cada evento es un
+    `event.Event` (acceso tipo dict, payload decodificado al usarlo).
+
+    Filtros: `types` (cualquiera de), `day_id`, `session_id`, `repo_path`,
+    `since`/`until` (ISO 8601, inclusivos) y `where` (predicado libre).
+    Los filtros se aplican lo antes posible:
+    - en layout daily, `day_id` abre solo el archivo del día,
+    - segmentos cuyo header no coincide no se descomprimen,
+    - con filtro de tipo o de valor, las líneas candidatas se buscan por
+      substring sobre el archivo (mmap) o el segmento descomprimido,
+    - hacia atrás, tipo/ts se descartan desde el índice sidecar,
+    - con `since`, cada archivo se lee desde el offset que da el índice
+      disperso de ts (ver ts_index.py), salteando lo anterior al rango,
+    - las líneas se prefiltran (prefijo de tipo/ts en orden canónico,
+      substrings en las demás) antes de parsear el JSON,
+    - si los tipos pedidos están cubiertos por una vista (sesiones,
+      resúmenes; ver type_views.py) se leen solo las líneas de la vista.
+
+    Con `newest_first` recorre del evento más nuevo al más viejo; cortar la
+    iteración (ej: `next(...)`, `break`) evita leer el resto del log.
+
+    Con el espejo SQLite activo, los filtros de columna se resuelven con
+    índices de la base (ya sincronizada con el log) y `where` sobre el resultado.
+
+    `stats`, si se pasa, acumula lo que costó la lectura: "read" (líneas o
+    filas leídas del almacenamiento), "parsed" (eventos decodificados) y
+    "plan" (estrategias usadas), para `dia query`.
+    """
+    if stats is not None:
+        stats.setdefault("read", 0)
+        stats.setdefault("parsed", 0)
+        stats.setdefault("plan", [])
+    if load_config(events_path.parent).get("sqlite_mirror"):
+        from . import sqlite_mirror
+
+        if stats is not None:
+            stats["plan"].append("sqlite_mirror")
+        with sqlite_mirror.opened(events_path) as conn:
+            for event in sqlite_mirror.query_events(
+                conn, types, day_id, session_id, repo_path, since, until, newest_first
+            ):
+                if stats is not None:
+                    stats["read"] += 1
+                    stats["parsed"] += 1
+                if where is None or where(event):
+                    yield event
+        return
+
+    since_epoch = ts_epoch(since) if since else None
+    until_epoch = ts_epoch(until) if until else None
+    ref_table = _ref_table(events_path)
+    repo_refs = (
+        refs.ids_matching(events_path.parent, "repo", "path", repo_path)
+        if ref_table and repo_path else ()
+    )
+    raw_ok, event_ok, scan = _filter(
+        types, day_id, session_id, repo_path, since_epoch, until_epoch, where, repo_refs
+    )
+    types = tuple(types) if types else None
+
+    def matching(lines: Iterable[bytes]) -> Iterator[dict[str, Any]]:
+        for raw_line in lines:
+            if stats is not None:
+                stats["read"] += 1
+            if not raw_line.strip() or not raw_ok(raw_line):
+                continue
+            event = decode_event(events_path, raw_line, ref_table)
+            if event is None:
+                continue
+            if stats is not None:
+                stats["parsed"] += 1
+            if event_ok(event):
+                yield event
+
+    def note(step: str) -> None:
+        if stats is not None and step not in stats["plan"]:
+            stats["plan"].append(step)
+
+    files = log_files(events_path, [day_id] if day_id else None)
+    if day_id and is_daily(events_path):
+        note(f"daily:{day_id}")
+    # type_views y ts_index importan storage: import local
+    from . import ts_index, type_views
+
+    view = type_views.covering(types) if types else None
+    if view:
+        note(f"type_view:{view}")
+        keys = [file_key(events_path, path) for path in files]
+        yield from matching(type_views.iter_lines(events_path, view, keys, newest_first))
+        return
+    # Con since, cada archivo se lee desde la última marca del índice de ts
+    # anterior al rango (offset lógico)
+    starts = (
+        ts_index.start_offsets(events_path, since_epoch, [file_key(events_path, path) for path in files])
+        if since_epoch is not None else {}
+    )
+    if starts:
+        note("ts_index")
+    if scan[0]:
+        note("substring_scan")
+    if newest_first:
+        files.reverse()
+    for path in files:
+        recover(path, events_path.parent)
+        start = starts.get(file_key(events_path, path), 0)
+        headers = segments.list_segments(path)
+        base = headers[-1]["end"] if headers else 0
+        sealed = [
+            header
+            for header in headers
+            if header["end"] > start and segments.segment_matches(header, day_id, since_epoch, until_epoch)
+        ]
+        if len(sealed) < len(headers):
+            note("segment_pruning")
+        if not newest_first:
+            for header in sealed:
+                yield from matching(_segment_lines(header, scan))
+            yield from matching(
+                _active_lines(path, types, since_epoch, until_epoch, False, scan, max(start - base, 0))
+            )
+            continue
+        yield from matching(
+            _active_lines(path, types, since_epoch, until_epoch, True, start=max(start - base, 0))
+        )
+        for header in reversed(sealed):
+            # Un segmento comprimido solo se lee hacia adelante: se guardan las
+            # líneas que pasan el prefiltro y se recorren al revés
+            lines = [raw for raw in _segment_lines(header, scan) if raw.strip() and raw_ok(raw)]
+            yield from matching(reversed(lines))
+
+
+def read_events(
+    events_path: Path,
+    day_id: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    **filters: Any,
+) -> list[dict[str, Any]]:
+    """
+    Lee eventos del log como lista (ver `iter_events` para los filtros).
+    Preferir `iter_events`/`first_event`/`newest_events` si no hace falta
+    tener todos los eventos en memoria.
+    """
+    return list(iter_events(events_path, day_id=day_id, since=since, until=until, **filters))
+
+
+def first_event(events_path: Path, **filters: Any) -> Optional[dict[str, Any]]:
+    """Primer evento que cumple los filtros (el más nuevo con newest_first=True)."""
+    return next(iter_events(events_path, **filters), None)
+
+
+def newest_events(events_path: Path, limit: int, **filters: Any) -> list[dict[str, Any]]:
+    """Últimos `limit` eventos que cumplen los filtros, en orden cronológico."""
+    if limit <= 0:
+        return []
+    events = list(itertools.islice(iter_events(events_path, newest_first=True, **filters), limit))
+    events.reverse()
+    return events
+
+
+def count_events(events_path: Path) -> int:
+    """Cantidad de eventos del log (headers de segmentos + índice del activo, sin parsear)."""
+    total = 0
+    for path in log_files(events_path):
+        total += sum(header["count"] for header in segments.list_segments(path))
+        if path.exists():
+            total += event_index.ensure_index(path)
+    return total
+
+
+def read_tail(events_path: Path, limit: int) -> list[dict[str, Any]]:
+    """Últimos `limit` eventos del log (lee hacia atrás desde el final, ver `newest_events`)."""
+    return newest_events(events_path, limit)
+
+
+def file_key(events_path: Path, path: Path) -> str:
+    """Clave estable de un archivo del log (ruta relativa a index/)."""
+    return path.relative_to(events_path.parent).as_posix()
+
+
+def cursor_is_valid(events_path: Path, cursor: dict[str, int]) -> bool:
+    """
+    Un cursor ({archivo: offset lógico}) es válido si cada offset existe en su
+    log y cae justo después de un fin de línea. Offsets dentro de segmentos
+    sellados se aceptan (los segmentos son inmutables).
+    """
+    for key, offset in cursor.items():
+        path = events_path.parent / key
+        base = segments.base_offset(path)
+        if offset <= base:
+            continue
+        physical = offset - base
+        if not path.exists() or path.stat().st_size < physical:
+            return False
+        with path.open("rb") as handle:
+            handle.seek(physical - 1)
+            if handle.read(1) != b"\n":
+                return False
+    return True
+
+
+def pending_files(events_path: Path, cursor: dict[str, int]) -> list[Path]:
+    """Archivos del log con líneas escritas después de `cursor` ({archivo: offset lógico})."""
+    pending = []
+    for path in log_files(events_path):
+        start = cursor.get(file_key(events_path, path), 0)
+        base = segments.base_offset(path)
+        if start < base or (path.exists() and path.stat().st_size > start - base):
+            pending.append(path)
+    return pending
+
+
+def committed_end(events_path: Path, path: Path) -> int:
+    """
+    Recupera `path` y retorna su offset lógico final sin líneas de un lote
+    en curso. Para índices derivados que escanean con un lock propio (no el
+    de index/): lo anterior a este offset ya no puede deshacerse. Con un
+    lote en curso espera el lock de index/, que su escritor tiene hasta
+    confirmarlo.
+    """
+    intent = batch_intent_path(events_path.parent)
+    while True:
+        recover(path, events_path.parent)
+        end = segments.base_offset(path) + (path.stat().st_size if path.exists() else 0)
+        # El intent de un lote se escribe antes que sus líneas: si no existe
+        # después de medir, lo medido está confirmado
+        if not intent.exists():
+            return end
+        # Se espera al escritor en lugar de volver a medir en seguida; si se
+        # cortó, la próxima recuperación deshace su lote
+        with locked(events_path, "committed_end"):
+            pass
+
+
+def end_cursor(events_path: Path) -> dict[str, int]:
+    """Cursor al final del log: offset lógico después de la última línea completa de cada archivo."""
+    cursor = {}
+    for path in log_files(events_path):
+        end = segments.base_offset(path)
+        if path.exists():
+            with path.open("rb") as handle:
+                end += last_line_end(handle, os.fstat(handle.fileno()).st_size)
+        cursor[file_key(events_path, path)] = end
+    return cursor
+
+
+def lines_at(events_path: Path, pointers: Iterable[tuple[str, int, int]]) -> Iterator[bytes]:
+    """
+    Líneas crudas (sin `\\n`) en las posiciones `pointers`: (archivo, offset
+    lógico, largo), en el orden dado. Las del archivo activo se leen con seek;
+    las de un segmento sellado, del segmento descomprimido (se conserva el
+    último, así posiciones consecutivas del mismo segmento lo abren una vez).
+    """
+    handles: dict[str, Any] = {}
+    bases: dict[str, int] = {}
+    # Último segmento sellado descomprimido: (archivo, header, cuerpo)
+    sealed: Optional[tuple[str, dict[str, Any], bytes]] = None
+    try:
+        for key, offset, length in pointers:
+            path = events_path.parent / key
+            if key not in bases:
+                bases[key] = segments.base_offset(path)
+            if offset >= bases[key]:
+                if key not in handles:
+                    if not path.exists():
+                        continue
+                    handles[key] = path.open("rb")
+                handle = handles[key]
+                handle.seek(offset - bases[key])
+                raw_line = handle.read(length)
+            else:
+                if sealed is None or sealed[0] != key or not (
+                    sealed[1]["start"] <= offset < sealed[1]["end"]
+                ):
+                    header = next(
+                        (h for h in segments.list_segments(path) if h["start"] <= offset < h["end"]),
+                        None,
+                    )
+                    if header is None:
+                        continue
+                    sealed = (key, header, segments.segment_body(header))
+                start = offset - sealed[1]["start"]
+                raw_line = sealed[2][start:start + length]
+            yield raw_line.rstrip(b"\r\n")
+    finally:
+        for handle in handles.values():
+            handle.close()
+
+
+def events_at(events_path: Path, pointers: Iterable[tuple[str, int, int]]) -> Iterator[Event]:
+    """Como `lines_at`, como `Event` (referencias de líneas compactas expandidas)."""
+    ref_table = _ref_table(events_path)
+    for raw_line in lines_at(events_path, pointers):
+        if raw_line.strip():
+            event = decode_event(events_path, raw_line, ref_table)
+            if event is not None:
+                yield event
+
+
+def read_since(
+    events_path: Path, cursor: dict[str, int]
+) -> Iterator[tuple[str, int, dict[str, Any]]]:
+    """
+    Lee los eventos agregados después de `cursor` en todos los archivos del log
+    (incluye segmentos sellados que el cursor no cubre).
+    Retorna tuplas (archivo, offset_lógico_fin_de_línea, evento) para avanzar el cursor.
+    Las referencias de líneas compactas se expanden.
+    """
+    ref_table = _ref_table(events_path)
+    for path in pending_files(events_path, cursor):
+        recover(path, events_path.parent)
+        key = file_key(events_path, path)
+        start = cursor.get(key, 0)
+        for end_offset, raw_line in segments.iter_raw(path, start):
+            if raw_line.strip():
+                try:
+                    event = codec.loads_line(raw_line)
+                except ValueError:
+                    skip_damaged(events_path)
+                    continue
+                yield key, end_offset, refs.expand(event, ref_table) if ref_table else event
+
+
+def _split_by_day(source: Path, start: int, directory: Path) -> tuple[int, int]:
+    """
+    Copia líneas completas de `source` (segmentos + activo, desde el offset
+    lógico `start`) a `directory/<día>.ndjson`.
+    Retorna (offset_hasta_donde_copió, eventos_copiados).
+    """
+    handles: dict[str, Any] = {}
+    copied = 0
+    position = start
+    try:
+        for position, raw_line in segments.iter_raw(source, start):
+            if not raw_line.strip():
+                continue
+            day = event_day(codec.loads_line(raw_line))
+            out = handles.get(day)
+            if out is None:
+                out = (directory / f"{day}.ndjson").open("ab")
+                handles[day] = out
+            out.write(raw_line)
+            copied += 1
+    finally:
+        for out in handles.values():
+            out.close()
+    return position, copied
+
+
+def _retire_legacy(events_path: Path) -> None:
+    """Renombra el log single ya migrado (y sus segmentos) a *.migrated."""
+    if events_path.exists():
+        os.replace(events_path, events_path.with_name(f"{EVENTS_LOG}.migrated"))
+    legacy_idx = event_index.index_path(events_path)
+    if legacy_idx.exists():
+        legacy_idx.unlink()
+    event_index.meta_path(events_path).unlink(missing_ok=True)
+    sealed = segments.list_segments(events_path)
+    if sealed:
+        retired = events_path.parent / f"{segments.SEGMENTS_DIR}.migrated"
+        retired.mkdir(exist_ok=True)
+        for header in sealed:
+            source = Path(header["path"])
+            os.replace(source, retired / source.name)
+        if not any(segments.segments_dir(events_path).iterdir()):
+            segments.segments_dir(events_path).rmdir()
+
+
+def rotate_logs(events_path: Path, force: bool = False) -> list[dict[str, Any]]:
+    """
+    Sella los archivos activos que superaron los límites de rotación
+    (o todos los no vacíos con `force`). Retorna los headers de los segmentos nuevos.
+    """
+    rotation = load_config(events_path.parent)["rotation"]
+    sealed: list[dict[str, Any]] = []
+    with locked(events_path, "rotate"):
+        for path in log_files(events_path):
+            if force or segments.should_seal(path, rotation):
+                header = segments.seal(path, rotation["compression"])
+                if header:
+                    sealed.append(header)
+    return sealed
+
+
+def migrate_to_daily(events_path: Path) -> dict[str, int]:
+    """
+    Migra events.ndjson al layout daily en streaming (línea a línea, sin cargar
+    el log en memoria). Las líneas se copian tal cual a su archivo de día.
+
+    Se escribe en un directorio temporal y se publica al final, así una
+    migración interrumpida no deja el layout a medias. Lo que se haya agregado
+    al log durante la copia se enruta después de activar el layout. El log
+    original queda como events.ndjson.migrated.
+    """
+    index_dir = events_path.parent
+    target = daily_dir(events_path)
+    staging = index_dir / f"{DAILY_DIR}.migrating"
+    if staging.exists():
+        shutil.rmtree(staging)
+    staging.mkdir(parents=True)
+
+    stats = {"events": 0, "days": 0}
+    copied_until = 0
+    if _has_log(events_path):
+        copied_until, stats["events"] = _split_by_day(events_path, 0, staging)
+
+    # La copia corre sin lock; publicar y activar el layout, con lock
+    with locked(events_path, "migrate"):
+        # Publicar: mover archivos de día (mergeando con días ya existentes)
+        target.mkdir(parents=True, exist_ok=True)
+        for staged in sorted(staging.glob("*.ndjson")):
+            destination = target / staged.name
+            if destination.exists():
+                with destination.open("ab") as out, staged.open("rb") as src:
+                    shutil.copyfileobj(src, out)
+                staged.unlink()
+            else:
+                os.replace(staged, destination)
+            stats["days"] += 1
+        shutil.rmtree(staging)
+
+        config = load_config(index_dir)
+        config["layout"] = "daily"
+        save_config(index_dir, config)
+
+        if _has_log(events_path):
+            # Eventos escritos durante la copia (antes de activar el layout)
+            _, late = _split_by_day(events_path, copied_until, target)
+            stats["events"] += late
+            _retire_legacy(events_path)
+        for path in target.glob("*.ndjson"):
+            event_index.ensure_index(path)
+    return stats
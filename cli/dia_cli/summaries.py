@@ -5,8 +5,10 @@ from datetime import datetime
 from pathlib import Path
 from typing import Any, Optional
 
-from . import config
-from .utils import day_id, now_iso, read_json_lines, read_text
+from . import config, storage
+from .utils import day_id, now_iso, read_text, ts_epoch
+
+SUMMARY_EVENT_TYPES = ("RollingSummaryGenerated", "DailySummaryGenerated")
 
 
 def extract_objective(jornada_path: Path) -> str:
@@ -151,13 +153,14 @@ def compute_delta(
             "assessment_changed": False,
         }
     
-    # Obtener timestamp del último resumen
-    last_ts = previous_summary.get("ts", "")
+    # Obtener timestamp del último resumen (epoch: los ts ISO pueden tener
+    # offsets de zona distintos y no se comparan como texto)
+    last_epoch = ts_epoch(previous_summary.get("ts"))
     
     # Filtrar eventos nuevos (después del último resumen)
     new_events = [
         e for e in current_events
-        if e.get("ts", "") > last_ts
+        if ts_epoch(e.get("ts")) > last_epoch
     ]
     
     previous_assessment = previous_summary.get("payload", {}).get("assessment")
@@ -179,27 +182,17 @@ def compute_delta(
 
 
 def find_last_rolling_summary(
-    summaries_path: Path, day_id_val: str
+    events_path: Path, day_id_val: str
 ) -> Optional[dict[str, Any]]:
-    """Encuentra el último resumen rolling del día."""
-    if not summaries_path.exists():
-        return None
-    
-    summaries = list(read_json_lines(summaries_path))
-    
-    # Filtrar resúmenes del día y modo rolling
-    day_rolling = [
-        s for s in summaries
-        if s.get("session", {}).get("day_id") == day_id_val
-        and s.get("payload", {}).get("mode") == "rolling"
-    ]
-    
-    if not day_rolling:
-        return None
-    
-    # Ordenar por timestamp y retornar el más reciente
-    day_rolling.sort(key=lambda s: s.get("ts", ""), reverse=True)
-    return day_rolling[0]
+    """Encuentra el último resumen rolling del día (vista `summaries` del log)."""
+    # Desde el final: el primero que coincide es el más reciente
+    return storage.first_event(
+        events_path,
+        types=SUMMARY_EVENT_TYPES,
+        day_id=day_id_val,
+        where=lambda summary: summary.get("payload", {}).get("mode") == "rolling",
+        newest_first=True,
+    )
 
 
 def build_summary_payload(
@@ -239,7 +232,7 @@ def generate_summary(
     mode: str,
     events: list[dict[str, Any]],
     objective: str,
-    summaries_path: Path,
+    events_path: Path,
 ) -> dict[str, Any]:
     """
     Genera un resumen completo (artefactos + evento).
@@ -249,8 +242,8 @@ def generate_summary(
     
     # Calcular ventana temporal
     if events:
-        window_start = min(e.get("ts", "") for e in events)
-        window_end = max(e.get("ts", "") for e in events)
+        window_start = min((e.get("ts", "") for e in events), key=ts_epoch)
+        window_end = max((e.get("ts", "") for e in events), key=ts_epoch)
     else:
         window_start = now_iso()
         window_end = now_iso()
@@ -263,7 +256,7 @@ def generate_summary(
     # Buscar último resumen rolling para delta
     previous_summary = None
     if mode == "rolling":
-        previous_summary = find_last_rolling_summary(summaries_path, day_id_val)
+        previous_summary = find_last_rolling_summary(events_path, day_id_val)
     
     # Crear directorio de artefactos
     artifacts_dir = config.summaries_artifacts_dir(root, day_id_val)
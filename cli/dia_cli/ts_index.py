@@ -0,0 +1,200 @@
+"""
+Índice disperso de timestamps del log de eventos (ts -> offset).
+
+`ts` es un string ISO con offset de zona: compararlo como texto falla entre
+offsets distintos y filtrar por rango (`since`) obligaba a leer el log desde
+el principio. index/views/ts.off guarda, cada MARK_BYTES bytes de cada
+archivo del log, una marca con el máximo epoch de las líneas anteriores:
+
+    (archivo, offset lógico, máximo epoch antes del offset)
+
+Ese máximo es monótono aunque los ts del log no lo sean (escritores
+concurrentes, relojes), así que se puede buscar con bisección: las líneas
+antes de la última marca con máximo < since no pueden cumplir `since`, y
+storage.iter_events empieza a leer desde ahí.
+
+Se mantiene como las vistas de type_views: se pone al día al consultarlo
+(desde el cursor, con el lock de index/) y se reconstruye si el cursor deja
+de corresponder al log.
+"""
+from __future__ import annotations
+
+import bisect
+import os
+import struct
+import threading
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+from . import codec, segments, storage
+from .type_views import locked, views_dir
+from .utils import ts_epoch
+
+META_VERSION = 1
+MARK_BYTES = 64 * 1024
+# archivo (posición en meta["files"]), offset lógico, máximo epoch antes del offset
+RECORD = struct.Struct("<IQd")
+
+_TS_PREFIX = b',"ts":"'
+
+
+def _paths(events_path: Path) -> tuple[Path, Path]:
+    directory = views_dir(events_path)
+    return directory / "ts.off", directory / "ts.json"
+
+
+def _line_epoch(raw_line: bytes) -> float:
+    """Epoch del ts de una línea cruda: por posición en orden canónico, si no parseando."""
+    type_end = raw_line.find(b'"', 9)
+    if raw_line.startswith(b'{"type":"') and raw_line.startswith(_TS_PREFIX, type_end + 1):
+        start = type_end + 1 + len(_TS_PREFIX)
+        end = raw_line.find(b'"', start)
+        if end != -1:
+            return ts_epoch(raw_line[start:end].decode("ascii", errors="replace"))
+    try:
+        event = codec.loads_line(raw_line)
+    except ValueError:
+        return 0.0
+    return ts_epoch(event.get("ts")) if isinstance(event, dict) else 0.0
+
+
+def _empty_meta() -> dict[str, Any]:
+    return {
+        "version": META_VERSION,
+        "mark_bytes": MARK_BYTES,
+        "files": [],
+        "cursor": {},
+        # {archivo: [máximo epoch hasta el cursor, offset de la última marca]}
+        "state": {},
+        "count": 0,
+    }
+
+
+def _read_meta(events_path: Path) -> dict[str, Any]:
+    """Metadata del índice, o una vacía si falta o no corresponde al log."""
+    off_path, meta_path = _paths(events_path)
+    try:
+        meta = codec.loads(meta_path.read_bytes())
+    except (OSError, ValueError):
+        return _empty_meta()
+    if (
+        not isinstance(meta, dict)
+        or meta.get("version") != META_VERSION
+        or meta.get("mark_bytes") != MARK_BYTES
+        or not storage.cursor_is_valid(events_path, meta.get("cursor", {}))
+    ):
+        return _empty_meta()
+    if not off_path.exists() or off_path.stat().st_size < meta["count"] * RECORD.size:
+        return _empty_meta()
+    return meta
+
+
+def _write_meta(path: Path, meta: dict[str, Any]) -> None:
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp_path.write_bytes(codec.dumps(meta))
+    os.replace(tmp_path, path)
+
+
+def load(events_path: Path) -> dict[str, Any]:
+    """
+    Pone el índice al día con el log y retorna su metadata. Sin líneas nuevas
+    no toma lock; si hay, las escanea desde el cursor con el lock de views/,
+    como type_views.load.
+    """
+    meta = _read_meta(events_path)
+    pending = storage.pending_files(events_path, meta["cursor"])
+    if not pending:
+        return meta
+    ends = {
+        storage.file_key(events_path, path): storage.committed_end(events_path, path)
+        for path in pending
+    }
+    with locked(events_path, "ts_index"):
+        meta = _read_meta(events_path)
+        pending = storage.pending_files(events_path, meta["cursor"])
+        if not pending:
+            return meta
+        off_path, meta_path = _paths(events_path)
+        files = meta["files"]
+        with off_path.open("r+b" if off_path.exists() else "wb") as handle:
+            handle.truncate(meta["count"] * RECORD.size)
+            handle.seek(0, os.SEEK_END)
+            for path in pending:
+                key = storage.file_key(events_path, path)
+                if key not in ends:
+                    continue
+                if key not in files:
+                    files.append(key)
+                number = files.index(key)
+                position = meta["cursor"].get(key, 0)
+                highest, last_mark = meta["state"].get(key, [0.0, 0])
+                records = []
+                for end, raw_line in segments.iter_raw(path, position):
+                    if end > ends[key]:
+                        break
+                    start = end - len(raw_line)
+                    if start - last_mark >= MARK_BYTES:
+                        records.append(RECORD.pack(number, start, highest))
+                        last_mark = start
+                    if raw_line.strip():
+                        highest = max(highest, _line_epoch(raw_line))
+                    position = end
+                handle.write(b"".join(records))
+                meta["count"] += len(records)
+                meta["cursor"][key] = position
+                meta["state"][key] = [highest, last_mark]
+        _write_meta(meta_path, meta)
+    return meta
+
+
+def start_offsets(
+    events_path: Path, since_epoch: float, keys: Optional[Iterable[str]] = None
+) -> dict[str, int]:
+    """
+    Por archivo del log (claves de storage.file_key; por default, todos), el
+    offset lógico desde el que puede haber líneas con ts >= `since_epoch`.
+    Un archivo cuyo máximo no llega a `since_epoch` empieza en su cursor.
+    """
+    meta = load(events_path)
+    wanted = set(keys) if keys is not None else None
+    marks: dict[int, tuple[list[float], list[int]]] = {}
+    if meta["count"]:
+        off_path, _ = _paths(events_path)
+        with off_path.open("rb") as handle:
+            data = handle.read(meta["count"] * RECORD.size)
+        for number, offset, highest in RECORD.iter_unpack(data):
+            epochs, offsets = marks.setdefault(number, ([], []))
+            epochs.append(highest)
+            offsets.append(offset)
+    result = {}
+    for number, key in enumerate(meta["files"]):
+        if wanted is not None and key not in wanted:
+            continue
+        highest, _ = meta["state"].get(key, [0.0, 0])
+        if highest < since_epoch:
+            result[key] = meta["cursor"].get(key, 0)
+            continue
+        epochs, offsets = marks.get(number, ([], []))
+        # Última marca con máximo < since (bisect_left: primera con máximo >= since)
+        position = bisect.bisect_left(epochs, since_epoch)
+        result[key] = offsets[position - 1] if position else 0
+    return result
+
+
+def rebuild(events_path: Path) -> dict[str, Any]:
+    """Descarta el índice y lo reconstruye desde el log."""
+    with locked(events_path, "ts_index"):
+        for path in _paths(events_path):
+            path.unlink(missing_ok=True)
+    return load(events_path)
+
+
+def status(events_path: Path) -> dict[str, Any]:
+    """Marcas y tamaño del índice (al día con el log)."""
+    meta = load(events_path)
+    off_path, _ = _paths(events_path)
+    return {
+        "marks": meta["count"],
+        "bytes": off_path.stat().st_size if off_path.exists() else 0,
+        "path": str(off_path),
+    }
@@ -0,0 +1,246 @@
+"""
+Vistas por tipo derivadas del log de eventos (listas de offsets).
+
+Reemplazan a index/sessions.ndjson e index/summaries.ndjson, que repetían
+los eventos de sesión y de resumen ya escritos en el log: el log es la única
+copia y cada vista guarda dónde están las líneas de sus tipos, en
+index/views/:
+
+    <vista>.off   registros (archivo, offset lógico, largo) de 16 bytes
+    <vista>.json  tipos, archivos del log, cursor ({archivo: offset}) y
+                  cantidad de registros
+
+La vista se pone al día al leerla (solo se escanea lo escrito después del
+cursor, con el lock de index/) y se reconstruye si el cursor deja de ser
+válido (log migrado o reescrito). Los offsets son lógicos, así que sellar el
+archivo activo en segmentos no la invalida.
+
+storage.iter_events usa la vista cuando los tipos pedidos están cubiertos
+por ella: lee solo esas líneas en lugar de escanear el log.
+"""
+from __future__ import annotations
+
+import os
+import struct
+import threading
+from pathlib import Path
+from typing import Any, Iterable, Iterator, Optional
+
+from . import codec, locking, segments, storage
+
+VIEWS_DIR = "views"
+META_VERSION = 1
+# archivo (posición en meta["files"]), offset lógico, largo (con el \n)
+RECORD = struct.Struct("<IQI")
+
+VIEWS = {
+    "sessions": (
+        "SessionStarted",
+        "SessionStartedAfterDayClosed",
+        "SessionEnded",
+        "SessionForceClosed",
+        "SessionPaused",
+        "SessionResumed",
+    ),
+    "summaries": ("RollingSummaryGenerated", "DailySummaryGenerated"),
+}
+
+_TYPE_PREFIX = b'{"type":"'
+
+
+def views_dir(events_path: Path) -> Path:
+    return events_path.parent / VIEWS_DIR
+
+
+def locked(events_path: Path, label: str = "views") -> Any:
+    """
+    Lock propio de views/ (no el de index/): ponerse al día escanea el log
+    sin frenar los appends del CLI y del server. Lo comparte ts_index.
+    """
+    directory = views_dir(events_path)
+    directory.mkdir(parents=True, exist_ok=True)
+    return locking.locked(directory, label)
+
+
+def _paths(events_path: Path, name: str) -> tuple[Path, Path]:
+    directory = views_dir(events_path)
+    return directory / f"{name}.off", directory / f"{name}.json"
+
+
+def covering(types: Iterable[str]) -> Optional[str]:
+    """Nombre de la vista que contiene todos los `types`, o None."""
+    wanted = set(types)
+    for name, view_types in VIEWS.items():
+        if wanted and wanted <= set(view_types):
+            return name
+    return None
+
+
+def _line_type(raw_line: bytes) -> Optional[str]:
+    """Tipo de una línea cruda: por prefijo en orden canónico, si no parseando."""
+    if raw_line.startswith(_TYPE_PREFIX):
+        end = raw_line.find(b'"', len(_TYPE_PREFIX))
+        value = raw_line[len(_TYPE_PREFIX):end]
+        if end > 0 and b"\\" not in value:
+            return value.decode("utf-8")
+    try:
+        event = codec.loads_line(raw_line)
+    except ValueError:
+        return None
+    return event.get("type") if isinstance(event, dict) else None
+
+
+def _empty_meta(name: str) -> dict[str, Any]:
+    return {
+        "version": META_VERSION,
+        "types": list(VIEWS[name]),
+        # Claves de archivo (storage.file_key) referenciadas por los registros
+        "files": [],
+        "cursor": {},
+        "count": 0,
+    }
+
+
+def _read_meta(events_path: Path, name: str) -> dict[str, Any]:
+    """Metadata de la vista, o una vacía si falta o no corresponde al log."""
+    off_path, meta_path = _paths(events_path, name)
+    try:
+        meta = codec.loads(meta_path.read_bytes())
+    except (OSError, ValueError):
+        return _empty_meta(name)
+    if (
+        not isinstance(meta, dict)
+        or meta.get("version") != META_VERSION
+        or meta.get("types") != list(VIEWS[name])
+        or not storage.cursor_is_valid(events_path, meta.get("cursor", {}))
+    ):
+        return _empty_meta(name)
+    # Registros escritos por un refresh que no llegó a guardar la metadata
+    # quedan después de `count` y se descartan
+    if not off_path.exists() or off_path.stat().st_size < meta["count"] * RECORD.size:
+        return _empty_meta(name)
+    return meta
+
+
+def _write_meta(path: Path, meta: dict[str, Any]) -> None:
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp_path.write_bytes(codec.dumps(meta))
+    os.replace(tmp_path, path)
+
+
+def load(events_path: Path, name: str) -> dict[str, Any]:
+    """
+    Pone la vista al día con el log y retorna su metadata. Sin líneas nuevas
+    no toma lock; si hay, las escanea desde el cursor con el lock de views/
+    (dos procesos no agregan los mismos registros), hasta el final
+    confirmado de cada archivo (ver storage.committed_end).
+    """
+    meta = _read_meta(events_path, name)
+    pending = storage.pending_files(events_path, meta["cursor"])
+    if not pending:
+        return meta
+    # Antes del lock de views/: la recuperación puede tomar el de index/, y
+    # quien tiene el de index/ puede leer vistas
+    ends = {
+        storage.file_key(events_path, path): storage.committed_end(events_path, path)
+        for path in pending
+    }
+    with locked(events_path):
+        meta = _read_meta(events_path, name)
+        pending = storage.pending_files(events_path, meta["cursor"])
+        if not pending:
+            return meta
+        off_path, meta_path = _paths(events_path, name)
+        types = set(VIEWS[name])
+        needles = tuple(b'"%s"' % t.encode("utf-8") for t in types)
+        files = meta["files"]
+        with off_path.open("r+b" if off_path.exists() else "wb") as handle:
+            handle.truncate(meta["count"] * RECORD.size)
+            handle.seek(0, os.SEEK_END)
+            for path in pending:
+                key = storage.file_key(events_path, path)
+                if key not in ends:
+                    continue
+                if key not in files:
+                    files.append(key)
+                number = files.index(key)
+                position = meta["cursor"].get(key, 0)
+                records = []
+                for end, raw_line in segments.iter_raw(path, position):
+                    if end > ends[key]:
+                        break
+                    # Prefiltro por substring antes de mirar el tipo
+                    if any(needle in raw_line for needle in needles) and _line_type(raw_line) in types:
+                        records.append(RECORD.pack(number, end - len(raw_line), len(raw_line)))
+                    position = end
+                handle.write(b"".join(records))
+                meta["count"] += len(records)
+                meta["cursor"][key] = position
+        _write_meta(meta_path, meta)
+    return meta
+
+
+def rebuild(events_path: Path, name: Optional[str] = None) -> dict[str, dict[str, Any]]:
+    """Descarta las vistas (o solo `name`) y las reconstruye desde el log."""
+    names = [name] if name else list(VIEWS)
+    with locked(events_path):
+        if name is None:
+            for path in views_dir(events_path).iterdir():
+                if not path.name.startswith(locking.LOCK_NAME):
+                    path.unlink(missing_ok=True)
+        else:
+            for path in _paths(events_path, name):
+                path.unlink(missing_ok=True)
+    # Fuera del lock de views/: load puede tomar el de index/ (ver load)
+    return {view: load(events_path, view) for view in names}
+
+
+def _records(events_path: Path, name: str, meta: dict[str, Any]) -> list[tuple[int, int, int]]:
+    off_path, _ = _paths(events_path, name)
+    with off_path.open("rb") as handle:
+        data = handle.read(meta["count"] * RECORD.size)
+    return list(RECORD.iter_unpack(data))
+
+
+def iter_lines(
+    events_path: Path,
+    name: str,
+    keys: Optional[list[str]] = None,
+    newest_first: bool = False,
+) -> Iterator[bytes]:
+    """
+    Líneas crudas (sin `\\n`) de los eventos de la vista, en el orden del log
+    o del más nuevo al más viejo. `keys` (claves de storage.file_key, en
+    orden de lectura) limita a esos archivos; por default, todos.
+    """
+    meta = load(events_path, name)
+    if not meta["count"]:
+        return
+    if keys is None:
+        keys = [storage.file_key(events_path, path) for path in storage.log_files(events_path)]
+    order = {key: position for position, key in enumerate(keys)}
+    files = meta["files"]
+    # Los registros están en orden dentro de cada archivo, pero en layout
+    # daily los archivos se intercalan según cuándo se escaneó cada uno
+    records = sorted(
+        (order[files[number]], offset, length, files[number])
+        for number, offset, length in _records(events_path, name, meta)
+        if files[number] in order
+    )
+    if newest_first:
+        records.reverse()
+    yield from storage.lines_at(events_path, ((key, offset, length) for _, offset, length, key in records))
+
+
+def status(events_path: Path) -> dict[str, dict[str, Any]]:
+    """Cantidad de eventos y tamaño de cada vista (al día con el log)."""
+    result = {}
+    for name in VIEWS:
+        meta = load(events_path, name)
+        off_path, _ = _paths(events_path, name)
+        result[name] = {
+            "events": meta["count"],
+            "bytes": off_path.stat().st_size if off_path.exists() else 0,
+            "path": str(off_path),
+        }
+    return result
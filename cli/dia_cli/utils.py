@@ -1,10 +1,13 @@
 import hashlib
-import json
+import os
+import time
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Iterable, Optional
+from typing import Any, Iterator, Optional
 from zoneinfo import ZoneInfo
 
+from . import codec
+
 # Zona horaria: Buenos Aires, Argentina (UTC-3)
 TZ_BUENOS_AIRES = ZoneInfo("America/Argentina/Buenos_Aires")
 
@@ -19,17 +22,87 @@ def day_id() -> str:
     return datetime.now(TZ_BUENOS_AIRES).date().isoformat()
 
 
-def read_json_lines(path: Path) -> Iterable[dict[str, Any]]:
+def parse_ts(value: str) -> str:
+    """
+    Normaliza un timestamp ISO 8601 de entrada (ej: `--at`, `?at=`): sin zona
+    se toma en hora de Buenos Aires. ValueError si no es válido.
+    """
+    parsed = datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=TZ_BUENOS_AIRES)
+    return parsed.isoformat()
+
+
+def ts_day(ts: str) -> str:
+    """Día (YYYY-MM-DD, Buenos Aires) de un timestamp ISO 8601 con zona."""
+    return datetime.fromisoformat(ts.replace("Z", "+00:00")).astimezone(TZ_BUENOS_AIRES).date().isoformat()
+
+
+def ts_epoch(ts: Any) -> float:
+    """Convierte un timestamp ISO 8601 a epoch (segundos). Retorna 0.0 si no es válido."""
+    if not ts:
+        return 0.0
+    try:
+        return datetime.fromisoformat(str(ts).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return 0.0
+
+
+# Último ms usado por new_event_id y secuencia dentro de ese ms
+_last_id_ms = 0
+_id_seq = 0
+
+
+def new_event_id() -> str:
+    """
+    ID de evento ordenable por tiempo: `evt_` + UUIDv7 en hex (48 bits de
+    epoch en ms, luego aleatorio). Dentro del mismo ms (mismo proceso) el
+    contador en `rand_a` mantiene el orden de creación.
+    """
+    global _last_id_ms, _id_seq
+    ms = time.time_ns() // 1_000_000
+    if ms <= _last_id_ms:
+        # Mismo ms (o reloj hacia atrás): se sigue del último y se incrementa
+        ms = _last_id_ms
+        _id_seq += 1
+        if _id_seq > 0xFFF:
+            ms += 1
+            _id_seq = 0
+    else:
+        _id_seq = 0
+    _last_id_ms = ms
+    rand_b = int.from_bytes(os.urandom(8), "big") & ((1 << 62) - 1)
+    value = (ms << 80) | (0x7 << 76) | (_id_seq << 64) | (0b10 << 62) | rand_b
+    return f"evt_{value:032x}"
+
+
+def event_id_epoch(event_id: Any) -> Optional[float]:
+    """Epoch (segundos) de un ID de `new_event_id`, o None si no es UUIDv7 (ej: IDs uuid4 anteriores)."""
+    if not isinstance(event_id, str) or not event_id.startswith("evt_") or len(event_id) != 36:
+        return None
+    hex_value = event_id[4:]
+    if hex_value[12] != "7":
+        return None
+    try:
+        return int(hex_value[:12], 16) / 1000
+    except ValueError:
+        return None
+
+
+def read_json_lines(path: Path) -> Iterator[dict[str, Any]]:
+    """
+    Itera las líneas de un archivo NDJSON de a una (no carga el archivo en memoria).
+    Una línea final sin `\\n` (escritura en curso o cortada) se ignora.
+    """
     if not path.exists():
-        return []
-    lines: list[dict[str, Any]] = []
-    with path.open("r", encoding="utf-8") as handle:
+        return
+    with path.open("rb") as handle:
         for line in handle:
-            line = line.strip()
-            if not line:
+            if not line.endswith(b"\n"):
+                break
+            if not line.strip():
                 continue
-            lines.append(json.loads(line))
-    return lines
+            yield codec.loads_line(line)
 
 
 def write_text(path: Path, content: str) -> None:
@@ -82,49 +155,14 @@ def find_last_unfixed_capture(
     events_path: Path, session_id: Optional[str] = None, day_id: Optional[str] = None
 ) -> Optional[dict[str, Any]]:
     """
-    Busca el último CaptureCreated sin FixLinked asociado.
+    Busca la última captura (CaptureCreated con error_hash) sin FixLinked asociado.
     Si se proporciona session_id, busca solo en esa sesión.
     Si se proporciona day_id, busca solo en ese día.
-    
-    Usa error_event_id para asociar FixLinked a CaptureCreated específicos,
-    permitiendo que errores con el mismo hash tengan fixes independientes.
+
+    Retorna el registro de la proyección "errors" (ver error_lifecycle.py):
+    los FixLinked se asocian por error_event_id, así errores con el mismo hash
+    tienen fixes independientes.
     """
-    events = list(read_json_lines(events_path))
-    
-    # Filtrar por día si se especifica
-    if day_id:
-        events = [e for e in events if e.get("session", {}).get("day_id") == day_id]
-    
-    # Filtrar por sesión si se especifica
-    if session_id:
-        events = [e for e in events if e.get("session", {}).get("session_id") == session_id]
-    
-    # Recopilar todos los CaptureCreated
-    captures: list[dict[str, Any]] = []
-    for event in events:
-        if event.get("type") == "CaptureCreated":
-            error_hash = event.get("payload", {}).get("error_hash")
-            if error_hash:
-                captures.append(event)
-    
-    # Recopilar todos los FixLinked usando error_event_id (más preciso que error_hash)
-    fixed_event_ids: set[str] = set()
-    for event in events:
-        if event.get("type") == "FixLinked":
-            error_event_id = event.get("payload", {}).get("error_event_id")
-            if error_event_id:
-                fixed_event_ids.add(error_event_id)
-    
-    # Encontrar el último CaptureCreated sin fix (usando event_id específico)
-    unfixed = [
-        capture 
-        for capture in captures 
-        if capture.get("event_id") not in fixed_event_ids
-    ]
-    
-    if not unfixed:
-        return None
-    
-    # Ordenar por timestamp y retornar el más reciente
-    unfixed.sort(key=lambda e: e.get("ts", ""), reverse=True)
-    return unfixed[0]
+    from .error_lifecycle import last_open_capture
+
+    return last_open_capture(events_path, session_id=session_id, day_id=day_id)
@@ -8,6 +8,7 @@ urlpatterns = [
     path("sessions/current/", views.current_session, name="current_session"),
     path("session/active/", views.active_session, name="active_session"),
     path("events/recent/", views.events_recent, name="events_recent"),
+    path("events/blobs/<str:digest>/", views.blob_content, name="blob_content"),
     path("metrics/", views.metrics, name="metrics"),
     path("summaries/", views.daily_summaries, name="daily_summaries"),
     path("summaries/latest/", views.summaries_latest, name="summaries_latest"),
@@ -1,27 +1,32 @@
 import json
-import uuid
 from datetime import datetime
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterator
 from zoneinfo import ZoneInfo
 
 from django.conf import settings
-from django.http import JsonResponse
+from django.http import HttpResponse
+
+from dia_cli import codec, columnar, error_lifecycle, sqlite_mirror, storage
+from dia_cli import sessions as session_state
+from dia_cli.ndjson import read_json_lines_reverse
+from dia_cli.utils import new_event_id, parse_ts, ts_day, ts_epoch
 
 # Zona horaria: Buenos Aires, Argentina (UTC-3)
 TZ_BUENOS_AIRES = ZoneInfo("America/Argentina/Buenos_Aires")
 
 
-def _events_path() -> Path:
-    return Path(settings.DATA_ROOT) / "index" / "events.ndjson"
+def _json_response(data: dict[str, Any], status: int = 200) -> HttpResponse:
+    """Respuesta JSON serializada con el codec de dia_cli (orjson/msgspec si están)."""
+    return HttpResponse(codec.dumps(data), content_type="application/json", status=status)
 
 
-def _sessions_path() -> Path:
-    return Path(settings.DATA_ROOT) / "index" / "sessions.ndjson"
+def _events_path() -> Path:
+    return Path(settings.DATA_ROOT) / "index" / "events.ndjson"
 
 
 def _event_id() -> str:
-    return f"evt_{uuid.uuid4().hex}"
+    return new_event_id()
 
 
 def _now_iso() -> str:
@@ -29,13 +34,6 @@ def _now_iso() -> str:
     return datetime.now(TZ_BUENOS_AIRES).isoformat()
 
 
-def _append_line(path: Path, data: dict[str, Any]) -> None:
-    """Añade una línea JSON al archivo NDJSON."""
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("a", encoding="utf-8") as f:
-        f.write(json.dumps(data, ensure_ascii=False) + "\n")
-
-
 def _build_event(
     event_type: str,
     session: dict[str, Any],
@@ -59,82 +57,30 @@ def _build_event(
     }
 
 
-def _read_events() -> list[dict[str, Any]]:
-    path = _events_path()
-    if not path.exists():
-        return []
-    events: list[dict[str, Any]] = []
-    with path.open("r", encoding="utf-8") as handle:
-        for line in handle:
-            line = line.strip()
-            if not line:
-                continue
-            events.append(json.loads(line))
-    return events
+SUMMARY_EVENT_TYPES = ("RollingSummaryGenerated", "DailySummaryGenerated")
 
 
-def _build_sessions(events: list[dict[str, Any]]) -> list[dict[str, Any]]:
-    sessions: dict[str, dict[str, Any]] = {}
-    for event in events:
-        event_type = event.get("type")
-        # Manejar tanto SessionStarted como SessionStartedAfterDayClosed
-        if event_type in ("SessionStarted", "SessionStartedAfterDayClosed"):
-            session = event.get("session", {})
-            session_id = session.get("session_id")
-            if not session_id:
-                continue
-            sessions[session_id] = {
-                "day_id": session.get("day_id"),
-                "session_id": session_id,
-                "intent": session.get("intent"),
-                "dod": session.get("dod"),
-                "mode": session.get("mode"),
-                "start_ts": event.get("ts"),
-                "end_ts": None,
-                "result": None,
-                "repo": event.get("repo"),
-                "project": event.get("project"),
-                "actor": event.get("actor"),
-                "started_after_close": event_type == "SessionStartedAfterDayClosed",
-                "paused_ts": None,
-                "resumed_ts": None,
-            }
-        if event_type == "SessionEnded":
-            session = event.get("session", {})
-            session_id = session.get("session_id")
-            if not session_id or session_id not in sessions:
-                continue
-            sessions[session_id]["end_ts"] = event.get("ts")
-            sessions[session_id]["result"] = session.get("result")
-            sessions[session_id]["repo"] = event.get("repo")
-        if event_type == "SessionPaused":
-            session = event.get("session", {})
-            session_id = session.get("session_id")
-            if session_id and session_id in sessions:
-                sessions[session_id]["paused_ts"] = event.get("ts")
-        if event_type == "SessionResumed":
-            session = event.get("session", {})
-            session_id = session.get("session_id")
-            if session_id and session_id in sessions:
-                sessions[session_id]["resumed_ts"] = event.get("ts")
-    return list(sessions.values())
+def _iter_events(**filters: Any) -> Iterator[dict[str, Any]]:
+    """Itera eventos filtrados en streaming (ver dia_cli.storage.iter_events)."""
+    return storage.iter_events(_events_path(), **filters)
 
 
 def sessions(request):
-    events = _read_events()
-    items = _build_sessions(events)
-    items.sort(key=lambda item: item.get("start_ts") or "", reverse=True)
-    return JsonResponse({"sessions": items})
+    # Ordenadas por inicio descendente (proyección de sesiones, ver dia_cli.sessions)
+    items = session_state.list_sessions(_events_path())
+    return _json_response({"sessions": items})
 
 
 def current_session(request):
-    events = _read_events()
-    sessions_list = _build_sessions(events)
-    sessions_list.sort(key=lambda item: item.get("start_ts") or "", reverse=True)
-    for item in sessions_list:
-        if item.get("end_ts") is None:
-            return JsonResponse({"session": item})
-    return JsonResponse({"session": None})
+    entry = session_state.latest_open_session(_events_path())
+    return _json_response({"session": _session_item(entry)})
+
+
+def _session_item(entry: dict[str, Any] | None) -> dict[str, Any] | None:
+    """Registro de sesión para la API (sin el evento de inicio que agrega open_sessions)."""
+    if entry is None:
+        return None
+    return {key: value for key, value in entry.items() if key != "started"}
 
 
 def active_session(request):
@@ -143,211 +89,160 @@ def active_session(request):
     Una sesión está activa si:
     - Tiene SessionStarted/SessionStartedAfterDayClosed
     - No tiene SessionEnded ni SessionForceClosed
-    - No tiene SessionPaused, o tiene SessionPaused pero también tiene SessionResumed más reciente
+    - No tiene SessionPaused, o el último SessionPaused tiene un SessionResumed después
     
-    Si hay múltiples sesiones activas, retorna la más reciente y agrega advertencia.
-    Si hay sesión sin end_ts y day_id != today, la marca como anomalía pero no la oculta.
+    Solo cuenta las sesiones del día (o del día de `at`). Si hay múltiples
+    sesiones activas, retorna la más reciente y agrega advertencia. Las
+    sesiones activas de días anteriores (sin cerrar) no se ocultan: van
+    aparte, en `previous_day_sessions`.
     """
     from datetime import datetime
     
-    events = _read_events()
-    today = datetime.now(TZ_BUENOS_AIRES).date().isoformat()
-    
-    # Filtrar eventos del día actual primero
-    today_events = [e for e in events if e.get("session", {}).get("day_id") == today]
+    # ?at=<ts>: estado a ese momento (snapshot as-of anterior + tramo hasta `at`)
+    at = request.GET.get("at")
+    if at:
+        try:
+            at = parse_ts(at)
+        except ValueError:
+            return _json_response({"error": "at debe ser un timestamp ISO 8601"}, status=400)
+    today = ts_day(at) if at else datetime.now(TZ_BUENOS_AIRES).date().isoformat()
+    
+    # Sesiones abiertas y no pausadas, de la más reciente a la más vieja
+    open_active = [
+        entry for entry in reversed(session_state.open_sessions(_events_path(), at=at))
+        if entry["status"] == "active"
+    ]
+    active_sessions = [entry for entry in open_active if entry["day_id"] == today]
+    previous_day = [entry for entry in open_active if entry["day_id"] != today]
     
-    sessions: dict[str, dict[str, Any]] = {}
-    ended_sessions: set[str] = set()  # Track sessions that have ended (key: session_id:repo_path)
     anomalies: list[dict[str, Any]] = []
-    
-    # Primero, identificar todas las sesiones que han terminado (del día actual)
-    # Usar clave compuesta session_id:repo_path para distinguir sesiones en diferentes repos
-    for event in today_events:
-        if event.get("type") in ("SessionEnded", "SessionForceClosed"):
-            session_id = event.get("session", {}).get("session_id")
-            repo_path = event.get("repo", {}).get("path", "")
-            if session_id:
-                # Clave compuesta para distinguir sesiones en diferentes repos
-                key = f"{session_id}:{repo_path}"
-                ended_sessions.add(key)
-    
-    # Ahora construir sesiones y verificar estado (solo del día actual)
-    for event in today_events:
-        event_type = event.get("type")
-        if event_type in ("SessionStarted", "SessionStartedAfterDayClosed"):
-            session_id = event.get("session", {}).get("session_id")
-            if not session_id:
-                continue
-            repo_path = event.get("repo", {}).get("path", "")
-            # Clave compuesta para distinguir sesiones en diferentes repos
-            key = f"{session_id}:{repo_path}"
-            # Solo procesar si la sesión no ha terminado
-            if key not in ended_sessions:
-                day_id = event.get("session", {}).get("day_id")
-                session_data = {
-                    "day_id": day_id,
-                    "session_id": session_id,
-                    "intent": event.get("session", {}).get("intent"),
-                    "dod": event.get("session", {}).get("dod"),
-                    "mode": event.get("session", {}).get("mode"),
-                    "start_ts": event.get("ts"),
-                    "end_ts": None,
-                    "result": None,
-                    "repo": event.get("repo"),
-                    "project": event.get("project"),
-                    "actor": event.get("actor"),
-                    "started_after_close": event_type == "SessionStartedAfterDayClosed",
-                    "paused_ts": None,
-                    "resumed_ts": None,
-                }
-                sessions[key] = session_data
-        if event_type == "SessionPaused":
-            session_id = event.get("session", {}).get("session_id")
-            repo_path = event.get("repo", {}).get("path", "")
-            key = f"{session_id}:{repo_path}"
-            if key in sessions:
-                sessions[key]["paused_ts"] = event.get("ts")
-        if event_type == "SessionResumed":
-            session_id = event.get("session", {}).get("session_id")
-            repo_path = event.get("repo", {}).get("path", "")
-            key = f"{session_id}:{repo_path}"
-            if key in sessions:
-                sessions[key]["resumed_ts"] = event.get("ts")
-    
-    # Buscar sesión activa (no ended, no paused o resumed después de paused)
-    sessions_list = list(sessions.values())
-    sessions_list.sort(key=lambda item: item.get("start_ts") or "", reverse=True)
-    
-    active_sessions = []
-    for item in sessions_list:
-        # Verificar explícitamente que no esté en ended_sessions usando clave compuesta
-        session_id = item.get("session_id")
-        repo_path = item.get("repo", {}).get("path", "")
-        key = f"{session_id}:{repo_path}"
-        if key in ended_sessions:
-            continue
-            
-        paused_ts = item.get("paused_ts")
-        resumed_ts = item.get("resumed_ts")
-        
-        # Verificar estado paused
-        is_paused = False
-        if paused_ts:
-            if not resumed_ts:
-                is_paused = True
-            elif paused_ts > resumed_ts:
-                is_paused = True
-        
-        # Si no está paused, es activa
-        if not is_paused:
-            active_sessions.append(item)
-    
-    # Si hay múltiples activas, retornar la más reciente y agregar advertencia
     if len(active_sessions) > 1:
-        # Registrar anomalía
         anomalies.append({
             "type": "multiple_active_sessions",
             "count": len(active_sessions),
             "sessions": [s["session_id"] for s in active_sessions],
         })
-        # Retornar la más reciente
-        response = {"session": active_sessions[0]}
-        if anomalies:
-            response["anomalies"] = anomalies
-        return JsonResponse(response)
-    
-    # Si hay una activa, retornarla (con advertencias si aplica)
-    if active_sessions:
-        response = {"session": active_sessions[0]}
-        if anomalies:
-            response["anomalies"] = anomalies
-        return JsonResponse(response)
-    
-    # No hay sesiones activas
-    response = {"session": None}
+    
+    response = {"session": _active_session_item(active_sessions[0]) if active_sessions else None}
+    if at:
+        response["at"] = at
     if anomalies:
         response["anomalies"] = anomalies
-    return JsonResponse(response)
+    if previous_day:
+        response["previous_day_sessions"] = [_active_session_item(entry) for entry in previous_day]
+    return _json_response(response)
+
+
+def _active_session_item(entry: dict[str, Any]) -> dict[str, Any]:
+    """Registro de sesión con las claves de /api/session/active/ (sin `status` ni `started`)."""
+    return {key: value for key, value in entry.items() if key not in ("status", "started")}
 
 
 def events_recent(request):
     limit = int(request.GET.get("limit", "20"))
-    events = _read_events()
-    return JsonResponse({"events": events[-limit:]})
+    since = request.GET.get("since")
+    if since:
+        if not ts_epoch(since):
+            return _json_response({"error": "since debe ser un timestamp ISO 8601"}, status=400)
+        # Cada archivo se lee desde el offset del índice de ts (ver ts_index)
+        events = storage.newest_events(_events_path(), limit, since=since)
+    else:
+        # Salta directo a las últimas `limit` líneas usando el índice sidecar
+        events = storage.read_tail(_events_path(), limit)
+    # Campos voluminosos guardados aparte (artifacts/blobs/): se devuelven resueltos
+    events = [storage.resolve_blobs(_events_path(), dict(event)) for event in events]
+    return _json_response({"events": events})
+
+
+def blob_content(request, digest: str):
+    """Contenido de un blob referenciado desde el payload de un evento ({"$blob": digest, ...})."""
+    if len(digest) != 64 or any(char not in "0123456789abcdef" for char in digest):
+        return _json_response({"error": "Digest inválido"}, status=400)
+    try:
+        value = storage.resolve_blobs(_events_path(), {"$blob": digest})
+    except FileNotFoundError:
+        return _json_response({"error": "Blob no encontrado"}, status=404)
+    return _json_response({"digest": digest, "value": value})
 
 
 def metrics(request):
-    events = _read_events()
-    sessions_list = _build_sessions(events)
-    commit_suggestions = [
-        event for event in events if event.get("type") == "CommitSuggestionIssued"
-    ]
-    return JsonResponse(
+    events_path = _events_path()
+    sessions_list = session_state.list_sessions(events_path)
+    if not columnar.is_available():
+        return _json_response(
+            {
+                "total_sessions": len(sessions_list),
+                "commit_suggestions": sqlite_mirror.count_events(
+                    events_path, types=("CommitSuggestionIssued",)
+                ),
+                "total_events": sqlite_mirror.count_events(events_path),
+            }
+        )
+
+    # Conteos y latencias vectorizados sobre el cache columnar (index/columns/)
+    columns = columnar.load(events_path)
+    by_type = columnar.counts_by(columns, "type")
+    durations = [d for d in columnar.session_durations(columns).values() if d is not None]
+    return _json_response(
         {
             "total_sessions": len(sessions_list),
-            "commit_suggestions": len(commit_suggestions),
-            "total_events": len(events),
+            "commit_suggestions": by_type.get("CommitSuggestionIssued", 0),
+            "total_events": columnar.count(columns),
+            "events_by_type": by_type,
+            "events_by_day": columnar.counts_by(columns, "day"),
+            "session_minutes_avg": (
+                round(sum(durations) / len(durations) / 60, 1) if durations else None
+            ),
+            "fix_latency": columnar.latency_summary(columnar.fix_latencies(columns)),
         }
     )
 
 
-def _summaries_path() -> Path:
-    """Ruta al índice de resúmenes (summaries.ndjson)."""
-    summaries_path = Path(settings.DATA_ROOT) / "index" / "summaries.ndjson"
-    # Mantener compatibilidad temporal con daily_summaries.ndjson
-    daily_summaries_path = Path(settings.DATA_ROOT) / "index" / "daily_summaries.ndjson"
-    if summaries_path.exists():
-        return summaries_path
-    elif daily_summaries_path.exists():
-        return daily_summaries_path
-    return summaries_path
-
-
-def _read_summaries() -> list[dict[str, Any]]:
-    """Lee todos los resúmenes del índice."""
-    path = _summaries_path()
-    if not path.exists():
-        return []
-    summaries: list[dict[str, Any]] = []
-    with path.open("r", encoding="utf-8") as handle:
-        for line in handle:
-            line = line.strip()
-            if not line:
-                continue
-            summaries.append(json.loads(line))
-    return summaries
+def _iter_summaries(day_id: str | None = None) -> Iterator[dict[str, Any]]:
+    """Resúmenes del más nuevo al más viejo (vista `summaries` del log), con blobs resueltos."""
+    events_path = _events_path()
+    for summary in storage.iter_events(
+        events_path, types=SUMMARY_EVENT_TYPES, day_id=day_id, newest_first=True
+    ):
+        yield storage.resolve_blobs(events_path, dict(summary))
+    # Mantener compatibilidad temporal con daily_summaries.ndjson (data roots
+    # anteriores a summaries.ndjson, con resúmenes fuera del log)
+    index_dir = events_path.parent
+    daily_summaries_path = index_dir / "daily_summaries.ndjson"
+    if daily_summaries_path.exists() and not (index_dir / "summaries.ndjson").exists():
+        yield from read_json_lines_reverse(daily_summaries_path)
+
+
+def _summary_matches(
+    summary: dict[str, Any], day_id: str | None, mode: str | None
+) -> bool:
+    if day_id and summary.get("session", {}).get("day_id") != day_id:
+        return False
+    if mode and summary.get("payload", {}).get("mode") != mode:
+        return False
+    return True
 
 
 def daily_summaries(request):
     """Retorna resúmenes con filtros opcionales."""
-    summaries = _read_summaries()
-    
     # Filtros
     day_id_filter = request.GET.get("day_id")
     mode_filter = request.GET.get("mode")
     limit = request.GET.get("limit")
     
-    # Filtrar por día
-    if day_id_filter:
-        summaries = [
-            s for s in summaries
-            if s.get("session", {}).get("day_id") == day_id_filter
-        ]
-    
-    # Filtrar por modo
-    if mode_filter:
-        summaries = [
-            s for s in summaries
-            if s.get("payload", {}).get("mode") == mode_filter
-        ]
-    
-    # Ordenar y limitar
-    summaries.sort(key=lambda s: s.get("ts", ""), reverse=True)
+    # Leer desde el final (más nuevos primero) y cortar al llegar al límite
+    summaries: list[dict[str, Any]] = []
+    for summary in _iter_summaries(day_id_filter):
+        if not _summary_matches(summary, day_id_filter, mode_filter):
+            continue
+        summaries.append(summary)
+        if limit and len(summaries) >= int(limit):
+            break
     
-    if limit:
-        summaries = summaries[:int(limit)]
+    # Ordenar
+    summaries.sort(key=lambda s: s.get("ts", ""), reverse=True)
     
-    return JsonResponse({"summaries": summaries})
+    return _json_response({"summaries": summaries})
 
 
 def summaries_latest(request):
@@ -356,23 +251,19 @@ def summaries_latest(request):
     mode_filter = request.GET.get("mode", "rolling")
     
     if not day_id_filter:
-        return JsonResponse({"error": "day_id requerido"}, status=400)
-    
-    summaries = _read_summaries()
-    
-    # Filtrar por día y modo
-    filtered = [
-        s for s in summaries
-        if s.get("session", {}).get("day_id") == day_id_filter
-        and s.get("payload", {}).get("mode") == mode_filter
-    ]
+        return _json_response({"error": "day_id requerido"}, status=400)
     
-    if not filtered:
-        return JsonResponse({"summary": None})
+    if sqlite_mirror.is_enabled(_events_path()):
+        summary = sqlite_mirror.latest_summary(_events_path(), day_id_filter, mode_filter)
+        if summary is not None:
+            summary = storage.resolve_blobs(_events_path(), summary)
+        return _json_response({"summary": summary})
     
-    # Ordenar por timestamp y retornar el más reciente
-    filtered.sort(key=lambda s: s.get("ts", ""), reverse=True)
-    return JsonResponse({"summary": filtered[0]})
+    # Leer desde el final: el primero que coincide es el más reciente
+    for summary in _iter_summaries(day_id_filter):
+        if _summary_matches(summary, day_id_filter, mode_filter):
+            return _json_response({"summary": summary})
+    return _json_response({"summary": None})
 
 
 def day_closed(request):
@@ -380,21 +271,15 @@ def day_closed(request):
     day_id_filter = request.GET.get("day_id")
     
     if not day_id_filter:
-        return JsonResponse({"error": "day_id requerido"}, status=400)
+        return _json_response({"error": "day_id requerido"}, status=400)
     
-    events = _read_events()
-    
-    # Buscar evento DayClosed para el día
-    day_closed_events = [
-        e for e in events
-        if e.get("type") == "DayClosed"
-        and e.get("session", {}).get("day_id") == day_id_filter
-    ]
-    
-    is_closed = len(day_closed_events) > 0
-    closed_event = day_closed_events[0] if day_closed_events else None
+    # Buscar evento DayClosed para el día (corta en el primero)
+    closed_event = storage.first_event(
+        _events_path(), types=("DayClosed",), day_id=day_id_filter
+    )
+    is_closed = closed_event is not None
     
-    return JsonResponse({
+    return _json_response({
         "day_id": day_id_filter,
         "closed": is_closed,
         "closed_at": closed_event.get("payload", {}).get("closed_at") if closed_event else None,
@@ -406,46 +291,15 @@ def day_today(request):
     from datetime import datetime
     
     day_id_val = datetime.now(TZ_BUENOS_AIRES).date().isoformat()
-    events = _read_events()
-    
-    # Filtrar eventos del día
-    day_events = [
-        e for e in events
-        if e.get("session", {}).get("day_id") == day_id_val
-    ]
     
-    # Contar sesiones iniciadas (incluyendo SessionStartedAfterDayClosed)
-    sessions_started = [
-        e for e in day_events
-        if e.get("type") in ("SessionStarted", "SessionStartedAfterDayClosed")
-    ]
+    # Sesiones del día desde la proyección de sesiones (ver dia_cli.sessions)
+    state = session_state.load_session_state(_events_path())
     
     # Construir lista de sesiones del día con start/end/elapsed
     sessions_today = []
-    sessions_dict = {}
-    
-    for event in day_events:
-        event_type = event.get("type")
-        session_id = event.get("session", {}).get("session_id")
-        
-        # Manejar tanto SessionStarted como SessionStartedAfterDayClosed
-        if event_type in ("SessionStarted", "SessionStartedAfterDayClosed"):
-            if session_id not in sessions_dict:
-                sessions_dict[session_id] = {
-                    "session_id": session_id,
-                    "start_ts": event.get("ts"),
-                    "end_ts": None,
-                    "intent": event.get("session", {}).get("intent"),
-                    "dod": event.get("session", {}).get("dod"),
-                    "repo": event.get("repo"),
-                    "started_after_close": event_type == "SessionStartedAfterDayClosed",
-                }
-        elif event_type == "SessionEnded":
-            if session_id in sessions_dict:
-                sessions_dict[session_id]["end_ts"] = event.get("ts")
-    
-    # Calcular elapsed para cada sesión
-    for session_id, session_data in sessions_dict.items():
+    for session_data in state["sessions"].values():
+        if session_data["day_id"] != day_id_val:
+            continue
         start_ts = session_data["start_ts"]
         end_ts = session_data["end_ts"]
         
@@ -473,21 +327,17 @@ def day_today(request):
         })
     
     # Ordenar por start_ts descendente
-    sessions_today.sort(key=lambda s: s.get("start_ts") or "", reverse=True)
+    sessions_today.sort(key=lambda s: ts_epoch(s.get("start_ts")), reverse=True)
     
-    # Verificar si el día está cerrado
-    day_closed_events = [
-        e for e in day_events
-        if e.get("type") == "DayClosed"
-    ]
-    is_closed = len(day_closed_events) > 0
+    # Sesiones iniciadas (incluyendo SessionStartedAfterDayClosed) y cierre del día
+    closed_at = state["closed_days"].get(day_id_val)
     
-    return JsonResponse({
+    return _json_response({
         "day_id": day_id_val,
-        "sessions_count": len(sessions_started),
+        "sessions_count": state["started_per_day"].get(day_id_val, 0),
         "sessions": sessions_today,
-        "closed": is_closed,
-        "closed_at": day_closed_events[0].get("payload", {}).get("closed_at") if day_closed_events else None,
+        "closed": day_id_val in state["closed_days"],
+        "closed_at": closed_at,
     })
 
 
@@ -495,10 +345,10 @@ def jornada(request, day_id: str):
     """Retorna contenido de bitácora de jornada específica."""
     jornada_path = Path(settings.DATA_ROOT) / "bitacora" / f"{day_id}.md"
     if not jornada_path.exists():
-        return JsonResponse({"error": "Jornada no encontrada"}, status=404)
+        return _json_response({"error": "Jornada no encontrada"}, status=404)
     
     content = jornada_path.read_text(encoding="utf-8")
-    return JsonResponse({"day_id": day_id, "content": content})
+    return _json_response({"day_id": day_id, "content": content})
 
 
 def jornada_human_update(request, day_id: str):
@@ -509,19 +359,19 @@ def jornada_human_update(request, day_id: str):
     # Validar que es día actual
     today = datetime.now(TZ_BUENOS_AIRES).date().isoformat()
     if day_id != today:
-        return JsonResponse(
+        return _json_response(
             {"error": "Solo se puede editar la bitácora del día actual"},
             status=403
         )
     
     if request.method != "PUT":
-        return JsonResponse({"error": "Método no permitido"}, status=405)
+        return _json_response({"error": "Método no permitido"}, status=405)
     
     try:
         data = json.loads(request.body)
         new_human_content = data.get("content", "").strip()
     except (json.JSONDecodeError, KeyError):
-        return JsonResponse({"error": "Datos inválidos"}, status=400)
+        return _json_response({"error": "Datos inválidos"}, status=400)
     
     jornada_path = Path(settings.DATA_ROOT) / "bitacora" / f"{day_id}.md"
     
@@ -566,7 +416,7 @@ def jornada_human_update(request, day_id: str):
     
     # Validar que no se intentó modificar el separador
     if "---\n\n## 3. Registro automático (NO EDITAR)" in new_human_content:
-        return JsonResponse(
+        return _json_response(
             {"error": "No se puede modificar el separador de secciones"},
             status=400
         )
@@ -575,16 +425,16 @@ def jornada_human_update(request, day_id: str):
     try:
         jornada_path.parent.mkdir(parents=True, exist_ok=True)
         jornada_path.write_text(new_content, encoding="utf-8")
-        return JsonResponse({"day_id": day_id, "status": "updated"})
+        return _json_response({"day_id": day_id, "status": "updated"})
     except Exception as e:
-        return JsonResponse({"error": f"Error al escribir archivo: {str(e)}"}, status=500)
+        return _json_response({"error": f"Error al escribir archivo: {str(e)}"}, status=500)
 
 
 def notes_tmp_list(request, day_id: str):
     """Lista archivos temporales del día."""
     notes_dir = Path(settings.DATA_ROOT) / "notes" / "tmp" / day_id
     if not notes_dir.exists():
-        return JsonResponse({"day_id": day_id, "files": []})
+        return _json_response({"day_id": day_id, "files": []})
     
     files = []
     for md_file in notes_dir.glob("*.md"):
@@ -599,38 +449,42 @@ def notes_tmp_list(request, day_id: str):
     # Ordenar por fecha de modificación (más reciente primero)
     files.sort(key=lambda f: f["modified"], reverse=True)
     
-    return JsonResponse({"day_id": day_id, "files": files})
+    return _json_response({"day_id": day_id, "files": files})
 
 
 def notes_tmp_content(request, day_id: str, file_name: str):
     """Retorna contenido de un archivo temporal."""
     # Validar que el nombre del archivo no contenga path traversal
     if ".." in file_name or "/" in file_name or "\\" in file_name:
-        return JsonResponse({"error": "Nombre de archivo inválido"}, status=400)
+        return _json_response({"error": "Nombre de archivo inválido"}, status=400)
     
     notes_dir = Path(settings.DATA_ROOT) / "notes" / "tmp" / day_id
     file_path = notes_dir / file_name
     
     if not file_path.exists():
-        return JsonResponse({"error": "Archivo no encontrado"}, status=404)
+        return _json_response({"error": "Archivo no encontrado"}, status=404)
     
     # Validar que el archivo está dentro del directorio esperado
     try:
         file_path.resolve().relative_to(notes_dir.resolve())
     except ValueError:
-        return JsonResponse({"error": "Ruta inválida"}, status=400)
+        return _json_response({"error": "Ruta inválida"}, status=400)
     
     try:
         content = file_path.read_text(encoding="utf-8")
-        return JsonResponse({"day_id": day_id, "file_name": file_name, "content": content})
+        return _json_response({"day_id": day_id, "file_name": file_name, "content": content})
     except Exception as e:
-        return JsonResponse({"error": f"Error al leer archivo: {str(e)}"}, status=500)
+        return _json_response({"error": f"Error al leer archivo: {str(e)}"}, status=500)
 
 
 def captures_recent(request):
     """Retorna capturas recientes (CaptureCreated y CaptureReoccurred)."""
     limit = int(request.GET.get("limit", "20"))
-    events = _read_events()
+    events_path = _events_path()
+    # Solo las últimas `limit` capturas, leyendo el log desde el final
+    events = storage.newest_events(
+        events_path, limit, types=("CaptureCreated", "CaptureReoccurred")
+    )
     
     captures = []
     for event in events:
@@ -640,168 +494,106 @@ def captures_recent(request):
                 "type": event.get("type"),
                 "ts": event.get("ts"),
                 "session": event.get("session"),
-                "payload": event.get("payload", {}),
+                "payload": storage.resolve_blobs(events_path, event.get("payload", {})),
                 "links": event.get("links", []),
             })
     
     captures.sort(key=lambda x: x.get("ts", ""), reverse=True)
-    return JsonResponse({"captures": captures[:limit]})
+    return _json_response({"captures": captures[:limit]})
 
 
 def errors_open(request):
-    """Retorna lista de errores sin fix (último CaptureCreated sin FixLinked por sesión).
+    """Retorna lista de errores sin fix (última captura sin FixLinked por sesión).
     
     Por defecto, muestra solo errores del día actual. Se puede filtrar por día usando
-    el parámetro query 'day_id'.
+    el parámetro query 'day_id'. Con 'at' (timestamp ISO 8601), los errores abiertos
+    a ese momento (por defecto, del día de `at`). Lee la proyección "errors"
+    (ver dia_cli.error_lifecycle), sin recorrer el log.
     """
     from datetime import datetime
     
-    events = _read_events()
-    today = datetime.now(TZ_BUENOS_AIRES).date().isoformat()
+    at = request.GET.get("at")
+    if at:
+        try:
+            at = parse_ts(at)
+        except ValueError:
+            return _json_response({"error": "at debe ser un timestamp ISO 8601"}, status=400)
+    today = ts_day(at) if at else datetime.now(TZ_BUENOS_AIRES).date().isoformat()
     
     # Filtrar por día actual por defecto, o por el día especificado en query parameter
     day_filter = request.GET.get("day_id", today)
-    events = [e for e in events if e.get("session", {}).get("day_id") == day_filter]
     
-    # Recopilar todos los CaptureCreated
-    captures: dict[str, dict[str, Any]] = {}
-    for event in events:
-        if event.get("type") == "CaptureCreated":
-            error_hash = event.get("payload", {}).get("error_hash")
-            if error_hash:
-                session_id = event.get("session", {}).get("session_id")
-                if session_id:
-                    key = f"{session_id}:{error_hash}"
-                    captures[key] = event
-    
-    # Recopilar todos los FixLinked usando error_event_id (más preciso que error_hash)
-    fixed_event_ids: set[str] = set()
-    for event in events:
-        if event.get("type") == "FixLinked":
-            error_event_id = event.get("payload", {}).get("error_event_id")
-            if error_event_id:
-                fixed_event_ids.add(error_event_id)
-    
-    # Encontrar errores sin fix (último por sesión)
-    open_errors: dict[str, dict[str, Any]] = {}
-    for key, capture in captures.items():
-        capture_event_id = capture.get("event_id")
-        session_id = capture.get("session", {}).get("session_id")
-        
-        # Un error está fijado si tiene un FixLinked asociado a su event_id específico
-        if capture_event_id not in fixed_event_ids:
-            # Si ya hay un error abierto para esta sesión, mantener el más reciente
-            if session_id not in open_errors:
-                open_errors[session_id] = capture
-            else:
-                existing_ts = open_errors[session_id].get("ts", "")
-                current_ts = capture.get("ts", "")
-                if current_ts > existing_ts:
-                    open_errors[session_id] = capture
-    
-    # Convertir a lista y formatear
     result = []
-    for capture in open_errors.values():
-        capture_event_id = capture.get("event_id")
-        has_fix = capture_event_id in fixed_event_ids
+    for capture in error_lifecycle.open_captures(_events_path(), day_id=day_filter, at=at or None):
         result.append({
-            "event_id": capture_event_id,
-            "ts": capture.get("ts"),
-            "session": capture.get("session"),
-            "title": capture.get("payload", {}).get("title"),
-            "error_hash": capture.get("payload", {}).get("error_hash"),
-            "artifact_ref": capture.get("payload", {}).get("artifact_ref"),
-            "links": capture.get("links", []),
-            "has_fix": has_fix,
+            "event_id": capture["event_id"],
+            "ts": capture["ts"],
+            "session": capture["session"],
+            "title": capture["title"],
+            "error_hash": capture["error_hash"],
+            "artifact_ref": capture["artifact_ref"],
+            "links": capture["links"],
+            "has_fix": False,
+            "recurrences": capture["recurrences"],
+            "last_seen_ts": capture["last_seen_ts"],
         })
     
-    result.sort(key=lambda x: x.get("ts", ""), reverse=True)
-    return JsonResponse({"errors": result})
+    result.sort(key=lambda x: x.get("ts") or "", reverse=True)
+    response: dict[str, Any] = {"errors": result}
+    if at:
+        response["at"] = at
+    return _json_response(response)
 
 
 def chain_latest(request):
-    """Retorna la última cadena abierta Error→Fix→Commit de la sesión actual."""
-    events = _read_events()
-    
-    # Encontrar sesión activa
-    sessions_list = _build_sessions(events)
-    sessions_list.sort(key=lambda item: item.get("start_ts") or "", reverse=True)
-    current_session_data = None
-    for item in sessions_list:
-        if item.get("end_ts") is None:
-            current_session_data = item
-            break
+    """Retorna la última cadena Error→Fix→Commit de la sesión actual (proyección "errors")."""
+    # Encontrar sesión actual (activa o pausada)
+    current_session_data = session_state.latest_open_session(_events_path())
     
     if not current_session_data:
-        return JsonResponse({"error": None, "fix": None, "commit": None})
+        return _json_response({"error": None, "fix": None, "commit": None})
     
-    session_id = current_session_data.get("session_id")
-    
-    # Buscar último error sin fix (CaptureCreated)
-    captures = []
-    for event in events:
-        if event.get("type") == "CaptureCreated":
-            event_session_id = event.get("session", {}).get("session_id")
-            if event_session_id == session_id:
-                captures.append(event)
-    
-    if not captures:
-        return JsonResponse({"error": None, "fix": None, "commit": None})
-    
-    # Ordenar por timestamp y tomar el más reciente
-    captures.sort(key=lambda x: x.get("ts", ""), reverse=True)
-    latest_capture = captures[0]
-    error_event_id = latest_capture.get("event_id")
+    # Última captura de la sesión, con su fix y su commit
+    capture = error_lifecycle.latest_capture(
+        _events_path(), current_session_data.get("day_id"), current_session_data.get("session_id")
+    )
     
-    # Buscar FixLinked asociado
-    fix_linked = None
-    for event in events:
-        if event.get("type") == "FixLinked":
-            if event.get("payload", {}).get("error_event_id") == error_event_id:
-                fix_linked = event
-                break
-    
-    # Buscar FixCommitted asociado
-    fix_committed = None
-    if fix_linked:
-        fix_event_id = fix_linked.get("event_id")
-        for event in events:
-            if event.get("type") == "FixCommitted":
-                if event.get("payload", {}).get("fix_event_id") == fix_event_id:
-                    fix_committed = event
-                    break
+    if not capture:
+        return _json_response({"error": None, "fix": None, "commit": None})
     
     # Construir respuesta
     result = {
         "error": {
-            "event_id": latest_capture.get("event_id"),
-            "ts": latest_capture.get("ts"),
-            "title": latest_capture.get("payload", {}).get("title"),
-            "error_hash": latest_capture.get("payload", {}).get("error_hash"),
-            "artifact_ref": latest_capture.get("payload", {}).get("artifact_ref"),
-        } if latest_capture else None,
+            "event_id": capture["event_id"],
+            "ts": capture["ts"],
+            "title": capture["title"],
+            "error_hash": capture["error_hash"],
+            "artifact_ref": capture["artifact_ref"],
+            "state": capture["state"],
+            "recurrences": capture["recurrences"],
+        },
         "fix": {
-            "fix_id": fix_linked.get("payload", {}).get("fix_id"),
-            "event_id": fix_linked.get("event_id"),
-            "ts": fix_linked.get("ts"),
-            "title": fix_linked.get("payload", {}).get("title"),
-            "fix_sha": fix_linked.get("payload", {}).get("fix_sha"),
-        } if fix_linked else None,
+            "fix_id": capture["fix_id"],
+            "event_id": capture["fix_event_id"],
+            "ts": capture["fixed_ts"],
+            "title": capture["fix_title"],
+            "fix_sha": capture["fix_sha"],
+        } if capture["fix_event_id"] else None,
         "commit": {
-            "commit_sha": fix_committed.get("payload", {}).get("commit_sha"),
-            "event_id": fix_committed.get("event_id"),
-            "ts": fix_committed.get("ts"),
-        } if fix_committed else None,
+            "commit_sha": capture["commit_sha"],
+            "event_id": capture["commit_event_id"],
+            "ts": capture["committed_ts"],
+        } if capture["commit_event_id"] else None,
     }
     
-    return JsonResponse(result)
+    return _json_response(result)
 
 
 def summaries_list(request, day_id: str):
     """Lista resúmenes disponibles para un día específico."""
     summaries_dir = Path(settings.DATA_ROOT) / "artifacts" / "summaries" / day_id
     if not summaries_dir.exists():
-        return JsonResponse({"summaries": []})
+        return _json_response({"summaries": []})
     
     summaries = []
     for file_path in summaries_dir.glob("*.md"):
@@ -830,17 +622,17 @@ def summaries_list(request, day_id: str):
         })
     
     summaries.sort(key=lambda s: s.get("timestamp", ""), reverse=True)
-    return JsonResponse({"summaries": summaries})
+    return _json_response({"summaries": summaries})
 
 
 def summary_content(request, day_id: str, summary_id: str):
     """Devuelve contenido markdown de un resumen específico."""
     summary_path = Path(settings.DATA_ROOT) / "artifacts" / "summaries" / day_id / f"{summary_id}.md"
     if not summary_path.exists():
-        return JsonResponse({"error": "Resumen no encontrado"}, status=404)
+        return _json_response({"error": "Resumen no encontrado"}, status=404)
     
     content = summary_path.read_text(encoding="utf-8")
-    return JsonResponse({"day_id": day_id, "summary_id": summary_id, "content": content})
+    return _json_response({"day_id": day_id, "summary_id": summary_id, "content": content})
 
 
 def _build_docs_tree(docs_dir: Path, base_path: Path) -> list[dict[str, Any]]:
@@ -882,10 +674,10 @@ def docs_list(request):
     docs_dir = Path("/docs")
     
     if not docs_dir.exists():
-        return JsonResponse({"tree": []})
+        return _json_response({"tree": []})
     
     tree = _build_docs_tree(docs_dir, docs_dir)
-    return JsonResponse({"tree": tree})
+    return _json_response({"tree": tree})
 
 
 def doc_content(request, doc_path: str):
@@ -898,16 +690,16 @@ def doc_content(request, doc_path: str):
     try:
         doc_file.resolve().relative_to(docs_dir.resolve())
     except ValueError:
-        return JsonResponse({"error": "Ruta inválida"}, status=400)
+        return _json_response({"error": "Ruta inválida"}, status=400)
     
     if not doc_file.exists() or not doc_file.is_file():
-        return JsonResponse({"error": "Documento no encontrado"}, status=404)
+        return _json_response({"error": "Documento no encontrado"}, status=404)
     
     if doc_file.suffix != ".md":
-        return JsonResponse({"error": "Solo se permiten archivos .md"}, status=400)
+        return _json_response({"error": "Solo se permiten archivos .md"}, status=400)
     
     content = doc_file.read_text(encoding="utf-8")
-    return JsonResponse({"path": doc_path, "content": content})
+    return _json_response({"path": doc_path, "content": content})
 
 
 def endpoints_doc(request):
@@ -921,91 +713,36 @@ def endpoints_doc(request):
     try:
         doc_file.resolve().relative_to(docs_dir.resolve())
     except ValueError:
-        return JsonResponse({"error": "Ruta inválida"}, status=400)
+        return _json_response({"error": "Ruta inválida"}, status=400)
     
     if not doc_file.exists() or not doc_file.is_file():
-        return JsonResponse({"error": "Documento no encontrado"}, status=404)
+        return _json_response({"error": "Documento no encontrado"}, status=404)
     
     if doc_file.suffix != ".md":
-        return JsonResponse({"error": "Solo se permiten archivos .md"}, status=400)
+        return _json_response({"error": "Solo se permiten archivos .md"}, status=400)
     
     content = doc_file.read_text(encoding="utf-8")
-    return JsonResponse({"path": doc_path, "content": content})
+    return _json_response({"path": doc_path, "content": content})
 
 
 def session_pause(request):
     """Pausa la sesión activa actual."""
     if request.method != "POST":
-        return JsonResponse({"error": "Método no permitido"}, status=405)
-    
-    events = _read_events()
+        return _json_response({"error": "Método no permitido"}, status=405)
+    # Validación del estado + escritura con el lock de index/ (compartido con el CLI)
+    with storage.locked(_events_path(), "web_pause"):
+        return _session_pause(request)
+
+
+def _session_pause(request):
+    """Cuerpo de session_pause (POST); corre con el lock tomado."""
     events_path = _events_path()
-    sessions_path = _sessions_path()
     
-    # Importar funciones de sesión del CLI (necesitamos importarlas o replicar lógica)
-    # Por ahora, replicamos la lógica básica
-    from datetime import datetime as dt
-    today = dt.now().astimezone().date().isoformat()
-    
-    # Buscar sesión activa (no paused, no ended)
-    active_session_data = None
-    sessions_dict = {}
-    ended_sessions = set()
-    
-    for event in events:
-        event_type = event.get("type")
-        if event_type in ("SessionEnded", "SessionForceClosed"):
-            session_id = event.get("session", {}).get("session_id")
-            repo_path = event.get("repo", {}).get("path", "")
-            if session_id:
-                ended_sessions.add(f"{session_id}:{repo_path}")
-        
-        if event_type in ("SessionStarted", "SessionStartedAfterDayClosed"):
-            session_id = event.get("session", {}).get("session_id")
-            repo_path = event.get("repo", {}).get("path", "")
-            key = f"{session_id}:{repo_path}"
-            if key not in ended_sessions:
-                sessions_dict[key] = {
-                    "session_id": session_id,
-                    "day_id": event.get("session", {}).get("day_id"),
-                    "start_ts": event.get("ts"),
-                    "paused_ts": None,
-                    "resumed_ts": None,
-                    "repo": event.get("repo"),
-                }
-        
-        if event_type == "SessionPaused":
-            session_id = event.get("session", {}).get("session_id")
-            repo_path = event.get("repo", {}).get("path", "")
-            key = f"{session_id}:{repo_path}"
-            if key in sessions_dict:
-                sessions_dict[key]["paused_ts"] = event.get("ts")
-        
-        if event_type == "SessionResumed":
-            session_id = event.get("session", {}).get("session_id")
-            repo_path = event.get("repo", {}).get("path", "")
-            key = f"{session_id}:{repo_path}"
-            if key in sessions_dict:
-                sessions_dict[key]["resumed_ts"] = event.get("ts")
-    
-    # Encontrar sesión activa (no ended, no paused o resumed después de paused)
-    for key, session_data in sessions_dict.items():
-        if key in ended_sessions:
-            continue
-        paused_ts = session_data.get("paused_ts")
-        resumed_ts = session_data.get("resumed_ts")
-        is_paused = False
-        if paused_ts:
-            if not resumed_ts:
-                is_paused = True
-            elif paused_ts > resumed_ts:
-                is_paused = True
-        if not is_paused:
-            active_session_data = session_data
-            break
+    # Sesión activa más reciente (no paused, no ended), de la proyección de sesiones
+    active_session_data = session_state.latest_open_session(events_path, status="active")
     
     if not active_session_data:
-        return JsonResponse({"error": "No hay sesión activa"}, status=400)
+        return _json_response({"error": "No hay sesión activa"}, status=400)
     
     session_id = active_session_data["session_id"]
     day_id_val = active_session_data["day_id"]
@@ -1033,80 +770,29 @@ def session_pause(request):
         },
     )
     
-    _append_line(events_path, pause_event)
-    _append_line(sessions_path, pause_event)
+    storage.append_event(events_path, pause_event)
     
-    return JsonResponse({"status": "paused", "session_id": session_id})
+    return _json_response({"status": "paused", "session_id": session_id})
 
 
 def session_resume(request):
     """Reanuda una sesión pausada."""
     if request.method != "POST":
-        return JsonResponse({"error": "Método no permitido"}, status=405)
-    
-    events = _read_events()
+        return _json_response({"error": "Método no permitido"}, status=405)
+    # Validación del estado + escritura con el lock de index/ (compartido con el CLI)
+    with storage.locked(_events_path(), "web_resume"):
+        return _session_resume(request)
+
+
+def _session_resume(request):
+    """Cuerpo de session_resume (POST); corre con el lock tomado."""
     events_path = _events_path()
-    sessions_path = _sessions_path()
     
-    # Buscar sesión pausada (no ended, paused sin resume más reciente)
-    paused_session_data = None
-    sessions_dict = {}
-    ended_sessions = set()
-    
-    for event in events:
-        event_type = event.get("type")
-        if event_type in ("SessionEnded", "SessionForceClosed"):
-            session_id = event.get("session", {}).get("session_id")
-            repo_path = event.get("repo", {}).get("path", "")
-            if session_id:
-                ended_sessions.add(f"{session_id}:{repo_path}")
-        
-        if event_type in ("SessionStarted", "SessionStartedAfterDayClosed"):
-            session_id = event.get("session", {}).get("session_id")
-            repo_path = event.get("repo", {}).get("path", "")
-            key = f"{session_id}:{repo_path}"
-            if key not in ended_sessions:
-                sessions_dict[key] = {
-                    "session_id": session_id,
-                    "day_id": event.get("session", {}).get("day_id"),
-                    "start_ts": event.get("ts"),
-                    "paused_ts": None,
-                    "resumed_ts": None,
-                    "repo": event.get("repo"),
-                }
-        
-        if event_type == "SessionPaused":
-            session_id = event.get("session", {}).get("session_id")
-            repo_path = event.get("repo", {}).get("path", "")
-            key = f"{session_id}:{repo_path}"
-            if key in sessions_dict:
-                sessions_dict[key]["paused_ts"] = event.get("ts")
-        
-        if event_type == "SessionResumed":
-            session_id = event.get("session", {}).get("session_id")
-            repo_path = event.get("repo", {}).get("path", "")
-            key = f"{session_id}:{repo_path}"
-            if key in sessions_dict:
-                sessions_dict[key]["resumed_ts"] = event.get("ts")
-    
-    # Encontrar sesión pausada
-    for key, session_data in sessions_dict.items():
-        if key in ended_sessions:
-            continue
-        paused_ts = session_data.get("paused_ts")
-        resumed_ts = session_data.get("resumed_ts")
-        is_paused = False
-        if paused_ts:
-            if not resumed_ts:
-                is_paused = True
-            elif paused_ts > resumed_ts:
-                is_paused = True
-        if is_paused:
-            paused_session_data = session_data
-            break
+    # Sesión pausada más reciente (no ended), de la proyección de sesiones
+    paused_session_data = session_state.latest_open_session(events_path, status="paused")
     
     if not paused_session_data:
-        return JsonResponse({"error": "No hay sesión pausada"}, status=400)
+        return _json_response({"error": "No hay sesión pausada"}, status=400)
     
     session_id = paused_session_data["session_id"]
     day_id_val = paused_session_data["day_id"]
@@ -1133,56 +819,29 @@ def session_resume(request):
         },
     )
     
-    _append_line(events_path, resume_event)
-    _append_line(sessions_path, resume_event)
+    storage.append_event(events_path, resume_event)
     
-    return JsonResponse({"status": "resumed", "session_id": session_id})
+    return _json_response({"status": "resumed", "session_id": session_id})
 
 
 def session_end(request):
     """Finaliza la sesión activa actual."""
     if request.method != "POST":
-        return JsonResponse({"error": "Método no permitido"}, status=405)
-    
-    events = _read_events()
+        return _json_response({"error": "Método no permitido"}, status=405)
+    # Validación del estado + escritura con el lock de index/ (compartido con el CLI)
+    with storage.locked(_events_path(), "web_end"):
+        return _session_end(request)
+
+
+def _session_end(request):
+    """Cuerpo de session_end (POST); corre con el lock tomado."""
     events_path = _events_path()
-    sessions_path = _sessions_path()
-    
-    # Buscar sesión activa o pausada (no ended)
-    current_session_data = None
-    sessions_dict = {}
-    ended_sessions = set()
     
-    for event in events:
-        event_type = event.get("type")
-        if event_type in ("SessionEnded", "SessionForceClosed"):
-            session_id = event.get("session", {}).get("session_id")
-            repo_path = event.get("repo", {}).get("path", "")
-            if session_id:
-                ended_sessions.add(f"{session_id}:{repo_path}")
-        
-        if event_type in ("SessionStarted", "SessionStartedAfterDayClosed"):
-            session_id = event.get("session", {}).get("session_id")
-            repo_path = event.get("repo", {}).get("path", "")
-            key = f"{session_id}:{repo_path}"
-            if key not in ended_sessions:
-                sessions_dict[key] = {
-                    "session_id": session_id,
-                    "day_id": event.get("session", {}).get("day_id"),
-                    "start_ts": event.get("ts"),
-                    "paused_ts": None,
-                    "resumed_ts": None,
-                    "repo": event.get("repo"),
-                }
-    
-    # Encontrar sesión actual (no ended)
-    for key, session_data in sessions_dict.items():
-        if key not in ended_sessions:
-            current_session_data = session_data
-            break
+    # Sesión abierta más reciente (activa o pausada), de la proyección de sesiones
+    current_session_data = session_state.latest_open_session(events_path)
     
     if not current_session_data:
-        return JsonResponse({"error": "No hay sesión activa o pausada"}, status=400)
+        return _json_response({"error": "No hay sesión activa o pausada"}, status=400)
     
     session_id = current_session_data["session_id"]
     day_id_val = current_session_data["day_id"]
@@ -1210,7 +869,6 @@ def session_end(request):
         },
     )
     
-    _append_line(events_path, end_event)
-    _append_line(sessions_path, end_event)
+    storage.append_event(events_path, end_event)
     
-    return JsonResponse({"status": "ended", "session_id": session_id})
+    return _json_response({"status": "ended", "session_id": session_id})
@@ -6,6 +6,12 @@ from pathlib import Path
 BASE_DIR = Path(__file__).resolve().parent.parent
 REPO_ROOT = BASE_DIR.parent
 
+# El servidor reutiliza la capa de almacenamiento del CLI (dia_cli) para leer
+# y escribir el log de eventos con el mismo formato e índices.
+CLI_ROOT = Path(os.getenv("DIA_CLI_ROOT", REPO_ROOT / "cli")).expanduser().resolve()
+if str(CLI_ROOT) not in sys.path:
+    sys.path.insert(0, str(CLI_ROOT))
+
 
 def _get_data_root() -> Path:
     """